@@ -1,13 +1,19 @@
 from __future__ import annotations
 
+import json
 import os
+import time
 from pathlib import Path
 from urllib.parse import urlparse
 
 import typer
+from PIL import Image
 
 from mosaic_builder.config import AppConfig, load_config
-from mosaic_builder.index.build_index import build_kdtree
+from mosaic_builder.index.build_index import build_index, compact_index, update_index
+from mosaic_builder.index.index_file import BACKENDS
+from mosaic_builder.pipeline.batch import build_batch as run_batch
+from mosaic_builder.pipeline.batch import read_manifest, write_report
 from mosaic_builder.pipeline.build_mosaic import build_mosaic
 from mosaic_builder.pipeline.ingest import ingest_dir
 from mosaic_builder.stores.factory import open_store
@@ -21,6 +27,7 @@ def _resolve_cfg(
     store: str | None,
     index_path: Path | None,
     tile_px: int | None,
+    atlas_dir: Path | None = None,
 ) -> AppConfig:
     cfg = load_config(config_path)
 
@@ -33,23 +40,75 @@ def _resolve_cfg(
         cfg.index_path = index_path
     if tile_px is not None:
         cfg.tile_px = tile_px
+    if atlas_dir is not None:
+        cfg.atlas_dir = atlas_dir
 
     return cfg
 
 
+def _parse_tile_sizes(value: str | None) -> list[int] | None:
+    """Parse "24" or "16,24,32,48" into a sorted list of distinct pixel sizes."""
+    if value is None:
+        return None
+    try:
+        sizes = sorted({int(v) for v in value.split(",") if v.strip()})
+    except ValueError as e:
+        raise typer.BadParameter(f"tile sizes must be comma-separated integers, got {value!r}") from e
+    if not sizes or sizes[0] <= 0:
+        raise typer.BadParameter(f"tile sizes must be positive, got {value!r}")
+    return sizes
+
+
+def _parse_params(values: list[str] | None) -> dict:
+    """Parse ["M=32", "factory=IVF256,PQ16"] into {"M": 32, "factory": "IVF256,PQ16"} (JSON values, else strings)."""
+    params = {}
+    for item in values or []:
+        key, sep, value = item.partition("=")
+        if not sep or not key.strip():
+            raise typer.BadParameter(f"backend parameters look like key=value, got {item!r}")
+        try:
+            params[key.strip()] = json.loads(value)
+        except ValueError:
+            params[key.strip()] = value
+    return params
+
+
 @app.command()
 def ingest(
     images_dir: Path | None = typer.Option(None),
     config: Path | None = typer.Option(None, "--config", "-c"),
     store: str | None = typer.Option(None),
-    tile_px: int | None = typer.Option(None),
+    tile_px: str | None = typer.Option(None, help='Tile size, or several sizes in one pass: "16,24,32,48".'),
     debug_dir: Path | None = typer.Option(None),
     reingest: bool = typer.Option(False, help="Recompute tiles for this grid size if it already exists."),
+    workers: int = typer.Option(0, help="Decode and tile photos in N worker processes (0 = in-process)."),
+    hash_content: bool = typer.Option(False, help="Also fingerprint photos by content hash, not just size/mtime."),
+    min_source_px: int = typer.Option(
+        0, help="Decode JPEGs at reduced scale, keeping at least N pixels per tile side (0 = full resolution)."
+    ),
+    layout_k: int = typer.Option(1, help="Also store a k×k sub-block Lab layout per tile (e.g. 2 or 3)."),
+    atlas_dir: Path | None = typer.Option(None, help="Write tile pixels into packed patch atlases here."),
+    atlas_px: str | None = typer.Option(None, help='Atlas patch resolutions, e.g. "24,64" (default: tile size).'),
 ):
-    cfg = _resolve_cfg(config, images_dir, store, None, tile_px)
+    cfg = _resolve_cfg(config, images_dir, store, None, None, atlas_dir)
     if cfg.photos_src is None:
         raise typer.BadParameter("photos_src not provided.")
-    ingest_dir(cfg.store_url, cfg.photos_src, cfg.tile_px, cfg.tile_px, debug_dir, reingest=reingest)
+    sizes = _parse_tile_sizes(tile_px) or [cfg.tile_px]
+    ingest_dir(
+        cfg.store_url,
+        cfg.photos_src,
+        sizes[0],
+        sizes[0],
+        debug_dir,
+        reingest=reingest,
+        workers=workers,
+        tile_sizes=[(px, px) for px in sizes],
+        hash_content=hash_content,
+        min_source_px=min_source_px,
+        layout_k=layout_k,
+        atlas_dir=cfg.atlas_dir,
+        atlas_px=_parse_tile_sizes(atlas_px),
+    )
 
 
 @app.command()
@@ -58,9 +117,44 @@ def index(
     store: str | None = typer.Option(None),
     index_path: Path | None = typer.Option(None),
     debug_dir: Path | None = typer.Option(None, help="Save debug images here"),
+    layout_k: int = typer.Option(1, help="Index k×k layout descriptors instead of mean Lab (tiles ingested with it)."),
+    tile_px: str | None = typer.Option(
+        None, help='Index only tiles of these sizes, e.g. "24" or "24,48" (default: all).'
+    ),
+    backend: str = typer.Option("kdtree", help=f"Index backend: {', '.join(BACKENDS)}."),
+    param: list[str] | None = typer.Option(
+        None, help='Backend parameter, repeatable: --param M=32 --param "factory=IVF4096,PQ16" --param nprobe=16.'
+    ),
+    update: bool = typer.Option(
+        False, help="Add tiles ingested since the last build as a delta segment and tombstone deleted ones."
+    ),
+    compact: bool = typer.Option(False, help="Merge delta segments and tombstones into a new main segment."),
+    shard_by: str | None = typer.Option(
+        None, help='Build a sharded index, partitioned by "id" range or by tile "size" (then id range).'
+    ),
+    shard_rows: int | None = typer.Option(None, help="Most tiles per shard (implies --shard-by id; default 10M)."),
+    jobs: int | None = typer.Option(None, help="Processes building shards (default: all CPUs)."),
 ):
     cfg = _resolve_cfg(config, None, store, index_path, None)
-    build_kdtree(cfg.store_url, cfg.index_path, debug_dir)
+    if update or compact:
+        if update:
+            update_index(cfg.store_url, cfg.index_path)
+        if compact:
+            compact_index(cfg.index_path)
+        return
+    sizes = _parse_tile_sizes(tile_px)
+    build_index(
+        cfg.store_url,
+        cfg.index_path,
+        debug_dir,
+        layout_k,
+        [(px, px) for px in sizes] if sizes else None,
+        backend=backend.lower(),
+        backend_params=_parse_params(param),
+        shard_by=shard_by.lower() if shard_by else None,
+        shard_rows=shard_rows,
+        jobs=jobs,
+    )
 
 
 @app.command()
@@ -72,9 +166,124 @@ def build(
     index_path: Path | None = typer.Option(None),
     tile_px: int | None = typer.Option(None),
     debug_dir: Path | None = typer.Option(None, help="Save debug images here"),
+    atlas_dir: Path | None = typer.Option(None, help="Read patches from ingest-time atlases here."),
+    memory_budget_mb: int | None = typer.Option(
+        None, help="Stream the mosaic to a PNG in row bands, keeping render memory within this many MiB."
+    ),
+    render_threads: int = typer.Option(1, help="Composite tile patches in N threads (1 = serial)."),
+    max_uses: int | None = typer.Option(None, help="Use each tile at most this many times."),
+    min_repeat_distance: int = typer.Option(0, help="Keep repeats of a tile at least this many cells apart."),
+    candidates: int = typer.Option(16, help="Nearest tiles considered per cell when limiting repeats."),
+    adaptive_levels: int = typer.Option(
+        1, help="Quadtree layout with cells of tile-px * 2^n (n < levels); 1 = fixed grid."
+    ),
+    split_variance: float = typer.Option(40.0, help="Split adaptive cells whose Lab variance exceeds this."),
+    dzi_tile_size: int = typer.Option(254, help="Tile size of Deep Zoom output (--out ending in .dzi)."),
+    dzi_format: str = typer.Option("jpg", help="Image format of Deep Zoom tiles: jpg or png."),
+    preview: Path | None = typer.Option(
+        None, help="Render progressively, rewriting this image with each intermediate (mean colors first)."
+    ),
+    preview_passes: int = typer.Option(4, help="Refinement passes between the color preview and the final mosaic."),
 ):
-    cfg = _resolve_cfg(config, None, store, index_path, tile_px)
-    build_mosaic(cfg.store_url, cfg.index_path, target, out, cfg.tile_px, cfg.tile_px, debug_dir)
+    cfg = _resolve_cfg(config, None, store, index_path, tile_px, atlas_dir)
+    on_preview = _preview_writer(preview) if preview else None
+    build_mosaic(
+        cfg.store_url,
+        cfg.index_path,
+        target,
+        out,
+        cfg.tile_px,
+        cfg.tile_px,
+        debug_dir,
+        cfg.atlas_dir,
+        memory_budget_mb=memory_budget_mb,
+        render_threads=render_threads,
+        max_uses=max_uses,
+        min_repeat_distance=min_repeat_distance,
+        candidates=candidates,
+        adaptive_levels=adaptive_levels,
+        split_variance=split_variance,
+        dzi_tile_size=dzi_tile_size,
+        dzi_format=dzi_format,
+        on_preview=on_preview,
+        preview_passes=preview_passes,
+        search_processes=cfg.search_processes,
+    )
+
+
+def _preview_writer(path: Path):
+    """Callback that atomically replaces `path` with each progressive intermediate."""
+    start = time.perf_counter()
+    tmp = path.with_name(f".{path.name}.tmp")
+
+    def write(image, done: int, total: int) -> None:
+        image.save(tmp, format=Image.registered_extensions().get(path.suffix.lower(), "PNG"))
+        os.replace(tmp, path)
+        print(f"[mosaic-builder] Preview {done}/{total} cells at {time.perf_counter() - start:.2f}s -> {path}")
+
+    return write
+
+
+@app.command()
+def build_batch(
+    manifest: Path = typer.Argument(..., help="CSV with a target,out[,tile_px] header; paths relative to it."),
+    config: Path | None = typer.Option(None, "--config", "-c"),
+    store: str | None = typer.Option(None),
+    index_path: Path | None = typer.Option(None),
+    tile_px: int | None = typer.Option(None, help="Tile size for jobs that do not set one."),
+    atlas_dir: Path | None = typer.Option(None, help="Read patches from ingest-time atlases here."),
+    workers: int = typer.Option(4, help="Build N mosaics concurrently (threads sharing one index and cache)."),
+    cache_mb: int = typer.Option(1024, help="Decoded source photos kept across jobs, in MiB."),
+    report: Path | None = typer.Option(None, help="Write per-job timings to this CSV."),
+):
+    cfg = _resolve_cfg(config, None, store, index_path, tile_px, atlas_dir)
+    jobs = read_manifest(manifest, cfg.tile_px)
+    result = run_batch(
+        cfg.store_url, cfg.index_path, jobs, workers, cache_mb, cfg.atlas_dir, search_processes=cfg.search_processes
+    )
+    if report is not None:
+        write_report(result.results, report)
+    times = sorted(r.seconds for r in result.results if not r.error)
+    for r in result.failed:
+        print(f"[mosaic-builder] FAILED {r.job.target}: {r.error}")
+    if times:
+        print(
+            f"[mosaic-builder] Built {len(times)}/{len(jobs)} mosaics in {result.seconds:.1f}s "
+            f"(setup {result.load_seconds:.1f}s once); per job median {times[len(times) // 2]:.2f}s, "
+            f"max {times[-1]:.2f}s; photo cache {result.cache.hits} hits / {result.cache.misses} misses"
+        )
+    if result.failed:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def serve(
+    config: Path | None = typer.Option(None, "--config", "-c"),
+    store: str | None = typer.Option(None),
+    index_path: Path | None = typer.Option(None),
+    tile_px: int | None = typer.Option(None, help="Tile size for requests that do not pass tile_px."),
+    atlas_dir: Path | None = typer.Option(None, help="Read patches from ingest-time atlases here."),
+    host: str = typer.Option("127.0.0.1", help="Address to bind; keep it on localhost unless fronted by a proxy."),
+    port: int = typer.Option(8765),
+    workers: int = typer.Option(4, help="Threads for decoding, matching and rendering."),
+    cache_mb: int = typer.Option(1024, help="Decoded source photos kept warm, in MiB."),
+    batch_window_ms: float = typer.Option(2.0, help="Wait this long to batch concurrent match requests."),
+):
+    from mosaic_builder.service import serve as run_service
+
+    cfg = _resolve_cfg(config, None, store, index_path, tile_px, atlas_dir)
+    run_service(
+        cfg.store_url,
+        cfg.index_path,
+        host,
+        port,
+        cfg.atlas_dir,
+        workers,
+        cache_mb,
+        batch_window_ms,
+        default_tile_px=cfg.tile_px,
+        search_processes=cfg.search_processes,
+    )
 
 
 @app.command()
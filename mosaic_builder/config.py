@@ -22,8 +22,10 @@ class AppConfig:
     # core
     photos_src: Path | None = None
     store_url: str = "sqlite:///mosaic.db"
-    index_path: Path = Path("tiles_kdtree.joblib")
+    index_path: Path = Path("tiles.index")
     tile_px: int = 24
+    atlas_dir: Path | None = None
+    search_processes: int = 2  # worker processes searching a sharded index
 
 
 def _load_toml(path: Path) -> dict:
@@ -54,6 +56,10 @@ def load_config(explicit_path: Path | None = None) -> AppConfig:
         cfg.index_path = Path(section["index_path"])
     if "tile_px" in section:
         cfg.tile_px = int(section["tile_px"])
+    if "atlas_dir" in section:
+        cfg.atlas_dir = Path(section["atlas_dir"])
+    if "search_processes" in section:
+        cfg.search_processes = int(section["search_processes"])
 
     # 2) Environment overrides (optional)
     if os.getenv("MOSAIC_PHOTOS_SRC"):
@@ -64,5 +70,9 @@ def load_config(explicit_path: Path | None = None) -> AppConfig:
         cfg.index_path = Path(os.getenv("MOSAIC_INDEX_PATH", str(cfg.index_path)))
     if os.getenv("MOSAIC_TILE_PX"):
         cfg.tile_px = int(os.getenv("MOSAIC_TILE_PX", cfg.tile_px))
+    if os.getenv("MOSAIC_ATLAS_DIR"):
+        cfg.atlas_dir = Path(os.getenv("MOSAIC_ATLAS_DIR", ""))
+    if os.getenv("MOSAIC_SEARCH_PROCESSES"):
+        cfg.search_processes = int(os.getenv("MOSAIC_SEARCH_PROCESSES", cfg.search_processes))
 
     return cfg
@@ -1,3 +1,3 @@
-from mosaic_builder.index.base import SearchResult, VectorIndex
+from mosaic_builder.index.base import SearchIndex, SearchResult, VectorIndex
 from mosaic_builder.index.bruteforce import BruteForceIndex
 from mosaic_builder.index.kdtree import KDTreeIndex
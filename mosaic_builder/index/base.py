@@ -21,27 +21,21 @@ class SearchResult:
     distances: VectorF32  # (k,)
 
 
-class VectorIndex(ABC):
-    """Stable interface for nearest-neighbor search."""
-
-    @abstractmethod
-    def build(self, vectors: MatrixF32) -> None:
-        """Build or load the index from a (N, D) array."""
+class SearchIndex(ABC):
+    """
+    Query side of an index: all a build needs. Composite indexes over several built
+    backends (delta segments, shards) implement only this.
+    """
 
     @abstractmethod
     def query(self, vec: VectorF32, k: int = 1) -> SearchResult:
         """Return k nearest neighbors to vec (D,)."""
 
-    @abstractmethod
-    def save(self, path: str) -> None:
-        """Persist index metadata (optional for in-memory backends)."""
-
-    @abstractmethod
-    def load(self, path: str) -> None:
-        """Load a previously saved index (optional)."""
-
     def batch_query(self, vecs: MatrixF32, k: int = 1) -> tuple[IndexArray, MatrixF32]:
-        """Vectorized helper: query many vectors. Returns (indices, distances)."""
+        """
+        Query many vectors at once. Returns (indices, distances), each (n, k).
+        Backends override this with a native batched search; this fallback loops over `query`.
+        """
         n = int(vecs.shape[0])
         idx: IndexArray = np.empty((n, k), dtype=np.intp)
         dist: MatrixF32 = np.empty((n, k), dtype=np.float32)
@@ -50,3 +44,24 @@ class VectorIndex(ABC):
             r = self.query(v32, k=k)
             idx[i], dist[i] = r.indices, r.distances
         return idx, dist
+
+    def close(self) -> None:
+        """Release worker processes or other resources held for searching (none by default)."""
+
+
+class VectorIndex(SearchIndex):
+    """Stable interface for nearest-neighbor search backends: built from vectors, saved and loaded."""
+
+    pads_missing = False  # True if short results are padded with label -1 (see `fallback`)
+
+    @abstractmethod
+    def build(self, vectors: MatrixF32) -> None:
+        """Build or load the index from a (N, D) array."""
+
+    @abstractmethod
+    def save(self, path: str) -> None:
+        """Persist index metadata (optional for in-memory backends)."""
+
+    @abstractmethod
+    def load(self, path: str) -> None:
+        """Load a previously saved index (optional)."""
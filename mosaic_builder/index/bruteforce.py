@@ -4,12 +4,16 @@ from mosaic_builder.index.base import Array, SearchResult, VectorIndex
 
 
 class BruteForceIndex(VectorIndex):
-    def __init__(self, metric: str = "euclidean"):
+    def __init__(self, metric: str = "euclidean", block_rows: int = 1024, block_bytes: int = 64 << 20):
         self.metric = metric
+        # queries per GEMM block in batch_query, capped so a block's (b, N) distances stay under block_bytes
+        self.block_rows, self.block_bytes = block_rows, block_bytes
         self.vectors: Array | None = None
+        self._sq_norms: Array | None = None
 
     def build(self, vectors: Array) -> None:
         self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._sq_norms = None
 
     def _euclidean(self, vec: Array) -> np.ndarray:
         diff = self.vectors - vec[None, :]
@@ -33,9 +37,47 @@ class BruteForceIndex(VectorIndex):
         order = order[np.argsort(dists[order])]
         return SearchResult(indices=order, distances=dists[order])
 
+    def _block_distances(self, block: Array) -> np.ndarray:
+        """(b, N) distances from a block of queries to every vector, via one matrix product."""
+        A = self.vectors
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum("ij,ij->i", A, A)
+        dots = block @ A.T
+        if self.metric == "euclidean":
+            # |a - q|² = |a|² + |q|² - 2 a·q; clamp the rounding negatives before the sqrt
+            sq = self._sq_norms[None, :] + np.einsum("ij,ij->i", block, block)[:, None] - 2.0 * dots
+            return np.sqrt(np.maximum(sq, 0.0, out=sq), out=sq)
+        if self.metric == "cosine":
+            denom = np.sqrt(self._sq_norms)[None, :] * np.linalg.norm(block, axis=1)[:, None] + 1e-9
+            return 1.0 - dots / denom
+        raise ValueError(f"Unsupported metric: {self.metric}")
+
+    def batch_query(self, vecs: Array, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        assert self.vectors is not None
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        n = len(vecs)
+        idx = np.empty((n, k), dtype=np.intp)
+        dist = np.empty((n, k), dtype=np.float32)
+        step = max(1, min(self.block_rows, self.block_bytes // (4 * len(self.vectors))))
+        rows = np.arange(min(step, n))[:, None]
+        for start in range(0, n, step):
+            dists = self._block_distances(vecs[start : start + step])
+            b = len(dists)
+            if k == 1:
+                top = dists.argmin(axis=1)[:, None]
+            elif k < dists.shape[1]:
+                top = np.argpartition(dists, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(k), (b, 1))
+            order = np.take_along_axis(top, np.argsort(dists[rows[:b], top], axis=1), axis=1)
+            idx[start : start + b] = order
+            dist[start : start + b] = dists[rows[:b], order]
+        return idx, dist
+
     def save(self, path: str) -> None:
         if self.vectors is not None:
-            np.save(path, self.vectors)
+            with open(path, "wb") as f:  # np.save(str) would append ".npy" and break load(path)
+                np.save(f, self.vectors)
 
     def load(self, path: str) -> None:
         self.vectors = np.load(path)
@@ -1,22 +1,101 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, replace
 from pathlib import Path
 
-import joblib
 import numpy as np
-from scipy.spatial import cKDTree
 
+from mosaic_builder.index.factory import make_index
+from mosaic_builder.index.index_file import (
+    BACKENDS,
+    IndexHeader,
+    open_index,
+    swap_into_place,
+    write_header,
+    write_index,
+)
+from mosaic_builder.index.kdtree import KDTreeIndex
+from mosaic_builder.index.lut import LabLUTIndex
 from mosaic_builder.stores.factory import open_store
 
 
-def build_kdtree(store_url: str, index_path: Path, debug_dir: Path | None = None):
+def _size_filter(grid_sizes: np.ndarray, tile_sizes: list | None) -> np.ndarray:
+    """Rows of `grid_sizes` whose (tile_w, tile_h) is in `tile_sizes` (all rows when None)."""
+    if not tile_sizes:
+        return np.ones(len(grid_sizes), dtype=bool)
+    return (grid_sizes[:, None, :] == np.asarray(tile_sizes, dtype=np.int32)[None]).all(axis=2).any(axis=1)
+
+
+def build_index(
+    store_url: str,
+    index_path: Path,
+    debug_dir: Path | None = None,
+    layout_k: int = 1,
+    tile_sizes: list[tuple[int, int]] | None = None,
+    backend: str = "kdtree",
+    backend_params: dict | None = None,
+    shard_by: str | None = None,
+    shard_rows: int | None = None,
+    jobs: int | None = None,
+):
+    """
+    Index the store's tile vectors into the index directory at `index_path` (see
+    `index_file`). `tile_sizes` restricts the index to tiles cut at those (tile_w, tile_h).
+
+    `backend` is one of kdtree (exact), bruteforce (exact up to float32 rounding, no build),
+    faiss or hnsw (approximate; need the ann-faiss / ann-hnsw extras) or lut (a precomputed
+    Lab voxel table for 3-D indexes, within a fixed distance of exact; see `index.lut`). `backend_params` go to
+    the backend constructor, e.g. {"factory": "IVF4096,PQ16", "nprobe": 16} or {"M": 32,
+    "ef_search": 128}, and are recorded in the header so builds load the same configuration.
+
+    `shard_by` ("id" or "size") or `shard_rows` build a sharded index instead; see
+    `build_sharded_index`.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown index backend {backend!r}; choose from {', '.join(BACKENDS)}")
+    params = dict(backend_params or {})
+    try:
+        index = make_index(backend, **params)  # fail on bad parameters before reading the store
+    except TypeError as e:
+        raise ValueError(f"bad parameters {params} for the {backend} backend: {e}") from None
+    if shard_by or shard_rows:
+        build_sharded_index(
+            store_url, index_path, layout_k, tile_sizes, backend, params, shard_by or "id", shard_rows, jobs
+        )
+        return
     store = open_store(store_url)
     try:
-        ids, vecs = store.all_tile_vectors()
+        snapshot = store.tile_snapshot()
+        ids, vecs = store.all_tile_vectors(layout_k)
+        grid_sizes = store.tile_grid_sizes(ids)  # lets adaptive builds filter matches by grid size
     finally:
         store.close()
-    tree = cKDTree(vecs)
-    joblib.dump(
-        {"ids": np.array(ids, dtype=np.int32), "vecs": vecs, "tree": tree}, index_path
+    if tile_sizes:
+        keep = _size_filter(grid_sizes, tile_sizes)
+        ids, vecs, grid_sizes = ids[keep], np.ascontiguousarray(vecs[keep]), grid_sizes[keep]
+    if not len(ids):
+        raise ValueError("no tiles to index" + (f" of sizes {tile_sizes}" if tile_sizes else ""))
+    index.build(vecs)
+    header = IndexHeader(
+        backend=backend,
+        metric=index.metric,
+        dims=vecs.shape[1],
+        count=len(ids),
+        layout_k=layout_k,
+        tile_filter=[list(map(int, size)) for size in tile_sizes] if tile_sizes else None,
+        store_snapshot=snapshot,
+        params=params,
     )
+    write_index(index_path, header, ids, vecs, grid_sizes, index)
+    print(f"[mosaic-builder] Indexed {len(ids):,} tiles ({vecs.shape[1]}-D, {backend}) into {index_path}")
+    if isinstance(index, LabLUTIndex):
+        print(
+            f"[mosaic-builder] Lab LUT: {np.prod(index.shape):,} voxels of {index.step:g}; matches within "
+            f"{index.error_bound:.2f} Lab of exact (measured worst {index.measured_error:.2f})"
+        )
 
     if debug_dir:
         try:
@@ -24,7 +103,8 @@ def build_kdtree(store_url: str, index_path: Path, debug_dir: Path | None = None
 
             debug_dir.mkdir(parents=True, exist_ok=True)
             plt.figure(figsize=(5, 4))
-            plt.scatter(vecs[:, 1], vecs[:, 2], c=vecs[:, 0], cmap="gray", s=3)
+            lab = vecs.reshape(len(vecs), -1, 3).mean(axis=1)  # tile mean for layout descriptors
+            plt.scatter(lab[:, 1], lab[:, 2], c=lab[:, 0], cmap="gray", s=3)
             plt.xlabel("a*")
             plt.ylabel("b*")
             plt.title("Tile colors (Lab)")
@@ -32,3 +112,299 @@ def build_kdtree(store_url: str, index_path: Path, debug_dir: Path | None = None
             plt.close()
         except ImportError:
             print("[mosaic-builder] matplotlib not installed; skipping scatter plot.")
+
+
+def build_kdtree(
+    store_url: str,
+    index_path: Path,
+    debug_dir: Path | None = None,
+    layout_k: int = 1,
+    tile_sizes: list[tuple[int, int]] | None = None,
+):
+    """`build_index` with the exact KD-tree backend."""
+    build_index(store_url, index_path, debug_dir, layout_k, tile_sizes)
+
+
+def update_index(
+    store_url: str,
+    index_path: Path,
+    max_segments: int = 8,
+    max_delta_fraction: float = 0.1,
+) -> None:
+    """
+    Bring an index up to date with the store without re-reading every tile.
+
+    Tiles added since the index's high-water tile id (the store's max id when it was last
+    built or updated) become a new KD-tree delta segment; tiles deleted since (e.g. by
+    `--reingest`) are tombstoned, found by listing ids up to the high-water mark only when
+    their count changed. Builds then search all segments and merge the results.
+
+    When deltas exceed `max_segments` or their tiles plus tombstones exceed
+    `max_delta_fraction` of the main segment, the index is compacted (`compact_index`).
+    Falls back to a full `build_index` when there is no index yet, the index is sharded, the
+    store was wiped, or the store can reuse tile ids (SQLite databases created before
+    AUTOINCREMENT ids).
+    """
+    index_path = Path(index_path)
+    store = open_store(store_url)
+    try:
+        snapshot = store.tile_snapshot()
+        current = open_index(index_path) if index_path.is_dir() else None
+        header = current.header if current else None
+        hw = (header.store_snapshot if header else {}).get("max_tile_id")
+        reason = None
+        if current is None:
+            reason = "no index in the current format"
+        elif header.shards:
+            reason = "sharded indexes are rebuilt rather than updated"
+        elif header.store_snapshot.get("generation") != snapshot["generation"] or snapshot["max_tile_id"] < hw:
+            reason = "the store was wiped or rebuilt since the index was made"
+        elif not store.tile_ids_monotonic():
+            reason = (
+                "this SQLite store can reuse tile ids (created before AUTOINCREMENT); rebuild it to update in place"
+            )
+        if reason is None:
+            new_ids, new_vecs = store.all_tile_vectors(header.layout_k, above_id=hw)
+            new_sizes = store.tile_grid_sizes(new_ids)
+            gone = np.empty(0, dtype=np.int64)
+            if store.tile_count(hw) != header.store_snapshot["tile_count"]:  # tiles <= hw can only be deleted
+                live_ids = store.tile_ids(hw)
+                ids = np.asarray(current.all_ids)
+                gone = np.flatnonzero(~np.isin(ids, live_ids) & current.live_mask)
+    finally:
+        store.close()
+    if reason is not None:
+        print(f"[mosaic-builder] Full index rebuild: {reason}")
+        if header is None:
+            build_index(store_url, index_path)
+        else:
+            build_index(
+                store_url,
+                index_path,
+                layout_k=header.layout_k,
+                tile_sizes=[tuple(size) for size in header.tile_filter] if header.tile_filter else None,
+                backend=header.backend,
+                backend_params=header.params,
+                shard_by=header.shard_by,
+                shard_rows=header.shard_rows,
+            )
+        return
+
+    keep = _size_filter(new_sizes, header.tile_filter)
+    new_ids, new_vecs, new_sizes = new_ids[keep], np.ascontiguousarray(new_vecs[keep]), new_sizes[keep]
+    segments, tombstones = list(header.segments), header.tombstones
+    if len(new_ids):
+        name = f"delta-{len(segments) + 1:04d}"
+        delta = KDTreeIndex()
+        delta.build(new_vecs)
+        delta_header = IndexHeader("kdtree", "euclidean", new_vecs.shape[1], len(new_ids), header.layout_k)
+        write_index(index_path / name, delta_header, new_ids, new_vecs, new_sizes, delta)
+        segments.append(name)
+    if len(gone):
+        tombstones = f"tombstones-{time.time_ns()}.npy"  # a new file, so open readers keep the old one
+        np.save(index_path / tombstones, np.union1d(current.dead, gone))
+    updated = replace(header, segments=segments, tombstones=tombstones, store_snapshot=snapshot)
+    write_header(index_path, updated)
+    print(
+        f"[mosaic-builder] Index update: +{len(new_ids):,} tiles"
+        + (f" in {segments[-1]}" if len(new_ids) else "")
+        + f", {len(gone):,} tombstoned; {len(segments)} delta segment(s)"
+    )
+
+    refreshed = open_index(index_path)
+    delta_rows = sum(len(d.ids) for d in refreshed.deltas) + len(refreshed.dead)
+    if len(segments) > max_segments or delta_rows > max_delta_fraction * len(refreshed.ids):
+        compact_index(index_path)
+
+
+def compact_index(index_path: Path) -> None:
+    """
+    Merge the main segment and all deltas, minus tombstones, into a new main segment built
+    with the index's own backend. Only the index is read, not the store. The new directory
+    replaces the old one atomically, so running builds and services keep their mapped copy.
+    """
+    current = open_index(index_path)
+    header = current.header
+    if header.shards:
+        raise ValueError(f"{index_path} is sharded: it has no delta segments to compact")
+    live = np.flatnonzero(current.live_mask)
+    ids = np.asarray(current.all_ids[live], dtype=np.int64)
+    vecs = np.ascontiguousarray(current.all_vecs[live], dtype=np.float32)
+    sizes = np.asarray(current.all_tile_sizes[live], dtype=np.int32)
+    index = make_index(header.backend, metric=header.metric, **header.params)
+    index.build(vecs)
+    compacted = replace(header, count=len(ids), segments=[], tombstones=None, payload={})
+    write_index(index_path, compacted, ids, vecs, sizes, index)
+    print(f"[mosaic-builder] Compacted index: {len(ids):,} live tiles in one {header.backend} segment")
+
+
+DEFAULT_SHARD_ROWS = 10_000_000
+
+
+def _shard_plan(stats: list[tuple[int, int, int, int, int]], shard_by: str, shard_rows: int) -> list[dict]:
+    """
+    Shards for `SqlTileStore.tile_size_stats` rows: one group of tiles per grid size
+    (shard_by="size") or a single group ("id"), each cut into id ranges of about `shard_rows`
+    tiles. Ranges are spaced evenly between the group's smallest and largest id.
+    """
+    if shard_by == "size":
+        groups = [([w, h], count, lo, hi) for w, h, count, lo, hi in stats]
+    else:
+        groups = [(None, sum(r[2] for r in stats), min(r[3] for r in stats), max(r[4] for r in stats))]
+    plan = []
+    for size, count, lo, hi in groups:
+        n = max(1, -(-count // shard_rows))
+        edges = np.linspace(lo - 1, hi, n + 1).round().astype(np.int64)
+        for above, upto in zip(edges[:-1], edges[1:]):
+            if upto > above:
+                plan.append(
+                    {"name": f"shard-{len(plan):04d}", "tile_size": size, "above_id": int(above), "max_id": int(upto)}
+                )
+    return plan
+
+
+def _spill_shards(store, work: Path, plan: list[dict], layout_k: int, tile_sizes: list | None) -> None:
+    """
+    Stream the store's tile vectors once, appending each row to its shard's raw spill files
+    (work/spill/<name>.ids|.vecs|.sizes), so no process ever holds more than one shard.
+    """
+    spill = work / "spill"
+    spill.mkdir()
+    files = {
+        (spec["name"], kind): (spill / f"{spec['name']}.{kind}").open("wb")
+        for spec in plan
+        for kind in ("ids", "vecs", "sizes")
+    }
+    try:
+        for ids, vecs in store.iter_tile_vectors(layout_k):
+            sizes = store.tile_grid_sizes(ids)
+            keep = _size_filter(sizes, tile_sizes)
+            for spec in plan:
+                mask = keep & (ids > spec["above_id"]) & (ids <= spec["max_id"])
+                if spec["tile_size"]:
+                    mask &= (sizes == spec["tile_size"]).all(axis=1)
+                if mask.any():
+                    ids[mask].tofile(files[spec["name"], "ids"])
+                    vecs[mask].tofile(files[spec["name"], "vecs"])
+                    sizes[mask].astype(np.int32).tofile(files[spec["name"], "sizes"])
+    finally:
+        for f in files.values():
+            f.close()
+    for spec in plan:
+        spec["count"] = (spill / f"{spec['name']}.ids").stat().st_size // 8
+
+
+def _build_shard(work: Path, spec: dict, plan: dict) -> tuple[str, int]:
+    """Build one shard's index directory from its spill files (runs in a worker process)."""
+    base = work / "spill" / spec["name"]
+    ids = np.fromfile(f"{base}.ids", dtype=np.int64)
+    vecs = np.fromfile(f"{base}.vecs", dtype=np.float32).reshape(len(ids), -1)
+    sizes = np.fromfile(f"{base}.sizes", dtype=np.int32).reshape(len(ids), 2)
+    index = make_index(plan["backend"], **plan["params"])
+    index.build(vecs)
+    header = IndexHeader(
+        backend=plan["backend"],
+        metric=index.metric,
+        dims=vecs.shape[1],
+        count=len(ids),
+        layout_k=plan["layout_k"],
+        tile_filter=[spec["tile_size"]] if spec["tile_size"] else plan["tile_filter"],
+        store_snapshot=plan["store_snapshot"],
+        params=plan["params"],
+    )
+    write_index(work / spec["name"], header, ids, vecs, sizes, index)
+    for kind in ("ids", "vecs", "sizes"):
+        os.unlink(f"{base}.{kind}")
+    return spec["name"], len(ids)
+
+
+def build_sharded_index(
+    store_url: str,
+    index_path: Path,
+    layout_k: int = 1,
+    tile_sizes: list[tuple[int, int]] | None = None,
+    backend: str = "kdtree",
+    backend_params: dict | None = None,
+    shard_by: str = "id",
+    shard_rows: int | None = None,
+    jobs: int | None = None,
+) -> None:
+    """
+    Build a sharded index: tiles are partitioned by id range (`shard_by="id"`) or by grid size
+    and then id range (`"size"`) into shards of at most about `shard_rows` tiles, and each
+    shard becomes an independent index directory built by one of `jobs` worker processes.
+
+    The store is read once, streamed into per-shard spill files. Work happens in a
+    `.<name>.shards-build` directory next to `index_path`, which replaces any index there only
+    when every shard is done. An interrupted build re-run with the same arguments against an
+    unchanged store keeps the plan and the shards already built.
+    """
+    if shard_by not in ("id", "size"):
+        raise ValueError(f"shard_by must be 'id' or 'size', got {shard_by!r}")
+    index_path = Path(index_path)
+    params = dict(backend_params or {})
+    work = index_path.with_name(f".{index_path.name}.shards-build")
+    store = open_store(store_url)
+    try:
+        snapshot = store.tile_snapshot()
+        plan = {
+            "backend": backend,
+            "params": params,
+            "layout_k": layout_k,
+            "tile_filter": [list(map(int, size)) for size in tile_sizes] if tile_sizes else None,
+            "shard_by": shard_by,
+            "shard_rows": shard_rows or DEFAULT_SHARD_ROWS,
+            "store_snapshot": snapshot,
+        }
+        previous = json.loads((work / "plan.json").read_text()) if (work / "plan.json").exists() else None
+        if previous is not None and {k: previous.get(k) for k in plan} == plan:
+            plan = previous
+            print(f"[mosaic-builder] Resuming sharded build in {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+            work.mkdir(parents=True)
+            stats = store.tile_size_stats(layout_k)
+            if tile_sizes:
+                stats = [row for row in stats if (row[0], row[1]) in {tuple(size) for size in tile_sizes}]
+            if not stats:
+                raise ValueError("no tiles to index" + (f" of sizes {tile_sizes}" if tile_sizes else ""))
+            shards = _shard_plan(stats, shard_by, plan["shard_rows"])
+            _spill_shards(store, work, shards, layout_k, tile_sizes)
+            plan["shards"] = [spec for spec in shards if spec["count"]]
+            (work / "plan.json").write_text(json.dumps(plan, indent=2) + "\n")  # the spill is complete
+    finally:
+        store.close()
+
+    shards = plan["shards"]
+    todo = [spec for spec in shards if not (work / spec["name"] / "header.json").exists()]
+    print(
+        f"[mosaic-builder] Sharding {sum(s['count'] for s in shards):,} tiles by {shard_by} into {len(shards)} "
+        f"shards; {len(todo)} to build"
+    )
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_build_shard, work, spec, plan) for spec in todo]
+        for done, future in enumerate(as_completed(futures), 1):
+            name, count = future.result()
+            print(f"[mosaic-builder] Built {name} ({count:,} tiles) [{done}/{len(todo)}]")
+
+    shutil.rmtree(work / "spill", ignore_errors=True)
+    first = open_index(work / shards[0]["name"]).header
+    header = IndexHeader(
+        backend=backend,
+        metric=first.metric,
+        dims=first.dims,
+        count=sum(s["count"] for s in shards),
+        layout_k=layout_k,
+        tile_filter=plan["tile_filter"],
+        store_snapshot=plan["store_snapshot"],
+        params=params,
+        shards=[s["name"] for s in shards],
+        shard_by=shard_by,
+        shard_rows=plan["shard_rows"],
+    )
+    (work / "header.json").write_text(json.dumps(asdict(header), indent=2) + "\n")
+    swap_into_place(work, index_path)
+    print(
+        f"[mosaic-builder] Indexed {header.count:,} tiles ({header.dims}-D, {backend}) "
+        f"in {len(shards)} shards into {index_path}"
+    )
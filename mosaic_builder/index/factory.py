@@ -17,4 +17,8 @@ def make_index(name: str, **kwargs) -> VectorIndex:
         from mosaic_builder.index.hnsw_backend import HNSWIndex
 
         return HNSWIndex(**kwargs)
+    if name in ("lut", "lab-lut"):
+        from mosaic_builder.index.lut import LabLUTIndex
+
+        return LabLUTIndex(**kwargs)
     raise ValueError(f"Unknown index backend: {name}")
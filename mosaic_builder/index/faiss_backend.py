@@ -1,18 +1,37 @@
+import re
+
 import numpy as np
 
 from mosaic_builder.index.base import Array, SearchResult, VectorIndex
 
 
+def _fit_factory(factory: str, d: int) -> str:
+    """
+    Shrink any `PQm` stage to the largest m that divides d, so one factory string works
+    for 3-D mean Lab as well as wider layout descriptors (e.g. PQ64 -> PQ3, PQ12, PQ27).
+    """
+
+    def fit(m: re.Match) -> str:
+        m_req = int(m.group(1))
+        return "PQ" + str(max(k for k in range(1, min(m_req, d) + 1) if d % k == 0))
+
+    return re.sub(r"PQ(\d+)", fit, factory)
+
+
 class FaissIndex(VectorIndex):
+    pads_missing = True
+
     def __init__(
         self,
         metric: str = "euclidean",
         factory: str = "IVF256,PQ64",
         use_gpu: bool = False,
+        nprobe: int | None = None,
     ):
         self.metric = metric
         self.factory = factory
         self.use_gpu = use_gpu
+        self.nprobe = nprobe  # IVF lists scanned per query (faiss default 1); recall vs speed
         self.index = None
         self.d = None
 
@@ -26,15 +45,26 @@ class FaissIndex(VectorIndex):
         self.d = vectors.shape[1]
         if self.metric != "euclidean":
             raise ValueError("This stub uses L2; extend as needed.")
-        self.index = faiss.index_factory(self.d, self.factory, faiss.METRIC_L2)
+        self.index = faiss.index_factory(self.d, _fit_factory(self.factory, self.d), faiss.METRIC_L2)
         if not self.index.is_trained:
             self.index.train(vectors.astype(np.float32))
         self.index.add(vectors.astype(np.float32))
+        self._set_nprobe()
+
+    def _set_nprobe(self) -> None:
+        if self.nprobe is not None:
+            import faiss
+
+            faiss.ParameterSpace().set_index_parameter(self.index, "nprobe", self.nprobe)
 
     def query(self, vec: Array, k: int = 1) -> SearchResult:
         D, I = self.index.search(vec.astype(np.float32).reshape(1, -1), k)
         return SearchResult(indices=I[0], distances=D[0])
 
+    def batch_query(self, vecs: Array, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        D, I = self.index.search(np.ascontiguousarray(vecs, dtype=np.float32), k)
+        return I.astype(np.intp), D
+
     def save(self, path: str) -> None:
         import faiss
 
@@ -44,3 +74,5 @@ class FaissIndex(VectorIndex):
         import faiss
 
         self.index = faiss.read_index(path)
+        self.d = self.index.d
+        self._set_nprobe()
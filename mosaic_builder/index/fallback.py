@@ -0,0 +1,51 @@
+"""
+faiss and hnswlib pad a search that finds fewer than k neighbours (an IVF probe over sparse
+lists, a poorly connected HNSW graph) with label -1. Used as a position, -1 silently picks
+the last tile, so such backends are searched through `ExactFallbackIndex`.
+"""
+
+import numpy as np
+
+from mosaic_builder.index.base import IndexArray, MatrixF32, SearchIndex, SearchResult, VectorF32, VectorIndex
+from mosaic_builder.index.bruteforce import BruteForceIndex
+
+
+class ExactFallbackIndex(SearchIndex):
+    """
+    Searches `index` and answers again, by exact search over `vectors` (the vectors `index`
+    was built from), every query row it returned padded. Those rows' distances are exact;
+    the rest are the backend's own.
+    """
+
+    def __init__(self, index: SearchIndex, vectors: MatrixF32, metric: str = "euclidean"):
+        self.index = index
+        self.vectors = vectors
+        self.metric = metric
+        self._exact: BruteForceIndex | None = None
+        self.refilled = 0  # query rows answered by the exact search so far
+
+    def query(self, vec: VectorF32, k: int = 1) -> SearchResult:
+        idx, dist = self.batch_query(np.asarray(vec).reshape(1, -1), k)
+        return SearchResult(indices=idx[0], distances=dist[0])
+
+    def batch_query(self, vecs: MatrixF32, k: int = 1) -> tuple[IndexArray, MatrixF32]:
+        idx, dist = self.index.batch_query(vecs, k)
+        short = np.flatnonzero((np.asarray(idx) < 0).any(axis=1))
+        if not len(short):
+            return idx, dist
+        if self._exact is None:
+            exact = BruteForceIndex(metric=self.metric)
+            exact.vectors = self.vectors  # searched in place, like the brute-force backend
+            self._exact = exact
+        idx, dist = np.array(idx, dtype=np.intp), np.array(dist, dtype=np.float32)
+        idx[short], dist[short] = self._exact.batch_query(np.asarray(vecs, dtype=np.float32)[short], k)
+        self.refilled += len(short)
+        return idx, dist
+
+    def close(self) -> None:
+        self.index.close()
+
+
+def with_exact_fallback(index: VectorIndex, vectors: MatrixF32) -> SearchIndex:
+    """`index`, wrapped in an `ExactFallbackIndex` if its backend pads short results."""
+    return ExactFallbackIndex(index, vectors, index.metric) if index.pads_missing else index
@@ -1,9 +1,13 @@
+import threading
+
 import numpy as np
 
 from mosaic_builder.index.base import Array, SearchResult, VectorIndex
 
 
 class HNSWIndex(VectorIndex):
+    pads_missing = True
+
     def __init__(
         self,
         metric: str = "euclidean",
@@ -17,6 +21,8 @@ class HNSWIndex(VectorIndex):
         self.ef_search = ef_search
         self.index = None
         self.dim = None
+        # ef is state on the shared hnswlib index: each search sets it and runs under this lock
+        self._lock = threading.Lock()
 
     def build(self, vectors: Array) -> None:
         try:
@@ -35,15 +41,48 @@ class HNSWIndex(VectorIndex):
         self.index.set_ef(self.ef_search)
 
     def query(self, vec: Array, k: int = 1) -> SearchResult:
-        labels, distances = self.index.knn_query(vec.astype(np.float32), k=k)
-        return SearchResult(indices=labels[0], distances=distances[0])
+        idx, dist = self.batch_query(np.asarray(vec).reshape(1, -1), k)
+        return SearchResult(indices=idx[0], distances=dist[0])
+
+    def batch_query(self, vecs: Array, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        # one multi-threaded search over all queries; ef must be at least k
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        with self._lock:
+            self.index.set_ef(max(self.ef_search, k))
+            return self._knn_query(vecs, k)
+
+    def _knn_query(self, vecs: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        try:
+            labels, distances = self.index.knn_query(vecs, k=k, num_threads=-1)
+        except RuntimeError:
+            # hnswlib raises, rather than padding, when any query reaches fewer than k elements:
+            # bisect the batch so only the failing rows are padded, for `fallback` to answer exactly
+            if len(vecs) == 1:
+                return np.full((1, k), -1, dtype=np.intp), np.full((1, k), np.inf, dtype=np.float32)
+            half = len(vecs) // 2
+            (li, di), (lj, dj) = self._knn_query(vecs[:half], k), self._knn_query(vecs[half:], k)
+            return np.concatenate([li, lj]), np.concatenate([di, dj])
+        return labels.astype(np.intp), distances
 
     def save(self, path: str) -> None:
+        import json
+        import os
+
         self.index.save_index(path)
+        # hnswlib needs space/dim before load_index; keep them next to the graph
+        with open(os.path.splitext(path)[0] + ".json", "w") as f:
+            json.dump({"metric": self.metric, "dim": self.dim, "ef_search": self.ef_search}, f)
 
     def load(self, path: str) -> None:
+        import json
+        import os
+
         import hnswlib
 
-        # space/dim are encoded in file; hnswlib reconstructs them
-        self.index = hnswlib.Index(space="l2", dim=1)
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            meta = json.load(f)
+        self.metric, self.dim, self.ef_search = meta["metric"], meta["dim"], meta["ef_search"]
+        space = "l2" if self.metric == "euclidean" else "cosine"
+        self.index = hnswlib.Index(space=space, dim=self.dim)
         self.index.load_index(path)
+        self.index.set_ef(self.ef_search)
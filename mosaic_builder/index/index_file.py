@@ -0,0 +1,264 @@
+"""
+On-disk index format: a directory holding
+
+    header.json      format version, backend, metric, dims, count, layout_k, tile-size
+                     filter, store snapshot and the backend payload's files
+    ids.npy          (N,) int64 tile ids, row-aligned with vecs
+    vecs.npy         (N, D) float32 tile vectors
+    tile_sizes.npy   (N, 2) int32 grid (tile_w, tile_h) of each tile
+    <payload>        backend files named in the header: kdtree.pkl, faiss.index, hnsw.bin
+                     (+ hnsw.json) or lut.npy (+ lut.json); brute force searches vecs.npy directly
+    delta-NNNN/      incremental segments (same layout, KD-tree backend) for tiles added
+                     after the main segment was built
+    tombstones-*.npy global positions of tiles deleted since (see `build_index.update_index`)
+
+A sharded index instead holds only header.json, plan.json and `shard-NNNN/` directories,
+each a complete index of one partition of the tiles (see `build_index.build_index` and
+`shards`).
+
+The arrays open with np.load(mmap_mode="r"): loading costs a few page faults whatever the
+library size, and processes using the same index share its pages through the page cache.
+Positions run through the main segment, then each delta (or each shard) in order.
+Single-file joblib bundles from earlier versions still load.
+"""
+
+import json
+import os
+import pickle
+import shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import joblib
+import numpy as np
+import scipy
+from scipy.spatial import cKDTree
+
+from mosaic_builder.index.base import SearchIndex, VectorIndex
+from mosaic_builder.index.bruteforce import BruteForceIndex
+from mosaic_builder.index.factory import make_index
+from mosaic_builder.index.fallback import with_exact_fallback
+from mosaic_builder.index.kdtree import KDTreeIndex
+from mosaic_builder.index.lut import LabLUTIndex
+from mosaic_builder.index.segments import SegmentedArray, SegmentedIndex
+from mosaic_builder.index.shards import ShardedIndex
+
+FORMAT = "mosaic-index"
+FORMAT_VERSION = 3  # v2 adds delta segments and tombstones, v3 shards
+
+BACKENDS = ("kdtree", "bruteforce", "faiss", "hnsw", "lut")
+SEARCH_PROCESSES = 2  # default worker processes searching a sharded index
+
+_PAYLOAD_FILES = {"kdtree": "kdtree.pkl", "faiss": "faiss.index", "hnsw": "hnsw.bin", "lut": "lut.npy"}
+
+
+def _library_version(backend: str) -> str | None:
+    if backend == "kdtree":
+        return scipy.__version__
+    if backend in ("faiss", "hnsw"):
+        module = __import__("faiss" if backend == "faiss" else "hnswlib")
+        return getattr(module, "__version__", None)
+    return None
+
+
+@dataclass
+class IndexHeader:
+    backend: str
+    metric: str
+    dims: int
+    count: int
+    layout_k: int = 1
+    tile_filter: list[list[int]] | None = None  # [[tile_w, tile_h], ...] indexed; None = every size
+    store_snapshot: dict = field(default_factory=dict)  # SqlTileStore.tile_snapshot() at build time
+    params: dict = field(default_factory=dict)  # backend constructor arguments, e.g. {"M": 32}
+    payload: dict = field(default_factory=dict)  # backend file and the library version that wrote it
+    segments: list[str] = field(default_factory=list)  # delta segment directories, oldest first
+    tombstones: str | None = None  # .npy of deleted global positions
+    shards: list[str] = field(default_factory=list)  # shard directories, in position order
+    shard_by: str | None = None  # "id" or "size"
+    shard_rows: int | None = None  # most tiles per shard
+    format: str = FORMAT
+    version: int = FORMAT_VERSION
+
+
+@dataclass
+class IndexFile:
+    """An opened index: header plus (memory-mapped) arrays. `load_backend` gives the searchable index."""
+
+    path: Path
+    header: IndexHeader
+    ids: np.ndarray
+    vecs: np.ndarray
+    tile_sizes: np.ndarray | None
+    _tree: cKDTree | None = None  # legacy bundles carry an unpickled tree
+    deltas: list["IndexFile"] = field(default_factory=list)
+    dead: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))  # tombstoned positions
+    shards: list["IndexFile"] = field(default_factory=list)
+
+    @property
+    def layout_k(self) -> int:
+        return self.header.layout_k
+
+    def _combined(self, name: str):
+        parts = [getattr(f, name) for f in (self, *self.deltas)]
+        if len(parts) == 1:
+            return parts[0]
+        return None if any(p is None for p in parts) else SegmentedArray(parts)
+
+    @property
+    def all_ids(self):
+        """Tile id at every position, across the main segment and the deltas."""
+        return self._combined("ids")
+
+    @property
+    def all_vecs(self):
+        return self._combined("vecs")
+
+    @property
+    def all_tile_sizes(self):
+        return self._combined("tile_sizes")
+
+    @property
+    def live_mask(self) -> np.ndarray:
+        """Boolean mask over all positions: False where a tile was tombstoned."""
+        mask = np.ones(len(self.all_ids), dtype=bool)
+        mask[self.dead] = False
+        return mask
+
+    def load_backend(self, workers: int = -1, processes: int = SEARCH_PROCESSES) -> SearchIndex:
+        """
+        The searchable index the header declares. With delta segments or tombstones this is
+        a `SegmentedIndex` over all positions, merging results across segments; a sharded
+        index is searched by a `ShardedIndex` with `processes` worker processes, one per shard
+        group; close it to stop them. `workers` are the KD-tree search threads. Segments whose
+        backend pads short results with -1 (faiss, hnswlib) are searched through
+        `with_exact_fallback`.
+        """
+        if self.shards:
+            return ShardedIndex(self.shards, processes=processes)
+        files = (self, *self.deltas)
+        segments = [with_exact_fallback(f._load_segment(workers), f.vecs) for f in files]
+        if len(segments) == 1 and not len(self.dead):
+            return segments[0]
+        return SegmentedIndex(segments, [f.vecs for f in files], self.dead)
+
+    def _load_segment(self, workers: int) -> VectorIndex:
+        backend, payload = self.header.backend, self.header.payload
+        if backend not in BACKENDS:
+            raise ValueError(f"{self.path}: unsupported index backend {backend!r}")
+        if backend == "kdtree":
+            tree = self._tree
+            if tree is None and payload.get("version") == scipy.__version__:
+                with (self.path / payload["file"]).open("rb") as f:
+                    tree = pickle.load(f)
+            if tree is None:  # written by another SciPy: the pickled tree may not load, so rebuild it
+                print(
+                    f"[mosaic-builder] Rebuilding KD-tree for {self.path} (written with SciPy {payload.get('version')})"
+                )
+                tree = cKDTree(self.vecs)
+            return KDTreeIndex.from_tree(tree, self.vecs, workers=workers)
+        index = make_index(backend, metric=self.header.metric, **self.header.params)
+        if isinstance(index, BruteForceIndex):
+            index.vectors = self.vecs  # searched in place, straight from the mapped file
+        else:
+            index.load(str(self.path / payload["file"]))
+        if isinstance(index, LabLUTIndex):
+            index.vectors = self.vecs  # the table stores positions; distances come from the mapped vectors
+        return index
+
+
+def write_index(
+    path: Path,
+    header: IndexHeader,
+    ids: np.ndarray,
+    vecs: np.ndarray,
+    tile_sizes: np.ndarray,
+    index: VectorIndex,
+) -> None:
+    """
+    Write an index directory at `path` for the built `index` (of `header.backend`), replacing
+    any index (or legacy bundle) there. Files go to a sibling temporary directory that is
+    renamed into place, so readers never see a half-written index.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "ids.npy", np.ascontiguousarray(ids, dtype=np.int64))
+    np.save(tmp / "vecs.npy", np.ascontiguousarray(vecs, dtype=np.float32))
+    np.save(tmp / "tile_sizes.npy", np.ascontiguousarray(tile_sizes, dtype=np.int32))
+    name = _PAYLOAD_FILES.get(header.backend)
+    header.payload = {"file": name, "version": _library_version(header.backend)} if name else {}
+    if isinstance(index, KDTreeIndex):
+        with (tmp / name).open("wb") as f:
+            pickle.dump(index.tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    elif name:
+        index.save(str(tmp / name))
+    (tmp / "header.json").write_text(json.dumps(asdict(header), indent=2) + "\n")
+    swap_into_place(tmp, path)
+
+
+def swap_into_place(tmp: Path, path: Path) -> None:
+    """Rename the finished index directory `tmp` to `path`, replacing whatever is there."""
+    if path.is_dir():
+        old = path.with_name(f".{path.name}.old-{os.getpid()}")
+        path.rename(old)
+        tmp.rename(path)
+        shutil.rmtree(old)
+    else:
+        if path.exists():
+            path.unlink()
+        tmp.rename(path)
+
+
+def open_index(path: Path) -> IndexFile:
+    """Open an index directory (arrays memory-mapped) or a legacy joblib bundle."""
+    path = Path(path)
+    if not path.is_dir():
+        return _open_legacy_bundle(path)
+    meta = json.loads((path / "header.json").read_text())
+    if meta.get("format") != FORMAT or meta.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(
+            f"{path}: not a {FORMAT} v{FORMAT_VERSION} index (header says {meta.get('format')!r} "
+            f"v{meta.get('version')}); rebuild it with `mosaic-builder index`"
+        )
+    header = IndexHeader(**meta)
+    if header.shards:
+        shards = [open_index(path / name) for name in header.shards]
+        combined = {
+            name: SegmentedArray([getattr(s, name) for s in shards]) if len(shards) > 1 else getattr(shards[0], name)
+            for name in ("ids", "vecs", "tile_sizes")
+        }
+        return IndexFile(path=path, header=header, shards=shards, **combined)
+    sizes_path = path / "tile_sizes.npy"
+    return IndexFile(
+        path=path,
+        header=header,
+        ids=np.load(path / "ids.npy", mmap_mode="r"),
+        vecs=np.load(path / "vecs.npy", mmap_mode="r"),
+        tile_sizes=np.load(sizes_path, mmap_mode="r") if sizes_path.exists() else None,
+        deltas=[open_index(path / name) for name in header.segments],
+        dead=np.load(path / header.tombstones) if header.tombstones else np.empty(0, dtype=np.int64),
+    )
+
+
+def write_header(path: Path, header: IndexHeader) -> None:
+    """Atomically replace an index's header.json (e.g. after adding a segment)."""
+    tmp = Path(path) / f".header.json.tmp-{os.getpid()}"
+    tmp.write_text(json.dumps(asdict(header), indent=2) + "\n")
+    os.replace(tmp, Path(path) / "header.json")
+
+
+def _open_legacy_bundle(path: Path) -> IndexFile:
+    bundle = joblib.load(path)
+    tree = bundle["tree"]
+    vecs = np.asarray(bundle.get("vecs", tree.data), dtype=np.float32)
+    header = IndexHeader(
+        backend="kdtree",
+        metric="euclidean",
+        dims=vecs.shape[1],
+        count=len(vecs),
+        layout_k=bundle.get("layout_k", 1),
+        version=0,
+    )
+    return IndexFile(path, header, np.asarray(bundle["ids"]), vecs, bundle.get("tile_sizes"), _tree=tree)
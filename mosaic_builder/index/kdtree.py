@@ -2,20 +2,29 @@
 import numpy as np
 from scipy.spatial import cKDTree
 
-from mosaic_builder.index.base import MatrixF32, SearchResult, VectorF32, VectorIndex
+from mosaic_builder.index.base import IndexArray, MatrixF32, SearchResult, VectorF32, VectorIndex
 
 
 class KDTreeIndex(VectorIndex):
-    def __init__(self, metric: str = "euclidean", leaf_size: int = 40):
+    def __init__(self, metric: str = "euclidean", leaf_size: int = 40, workers: int = -1):
         # cKDTree is Euclidean (L2) only; emulate manhattan via p=1 on KDTree if needed,
         # but for speed stick to Euclidean here.
         if metric != "euclidean":
             raise ValueError("cKDTree backend supports 'euclidean' only.")
         self.metric = "euclidean"
         self.leaf_size = leaf_size  # kept for API symmetry; cKDTree ignores it
+        self.workers = workers  # batch_query threads; -1 = all CPUs
         self.tree: cKDTree | None = None
         self.vectors: MatrixF32 | None = None
 
+    @classmethod
+    def from_tree(cls, tree: cKDTree, vectors: MatrixF32 | None = None, workers: int = -1) -> "KDTreeIndex":
+        """Wrap an already-built cKDTree (e.g. from an index file) without rebuilding it."""
+        index = cls(workers=workers)
+        index.tree = tree
+        index.vectors = vectors
+        return index
+
     def build(self, vectors: MatrixF32) -> None:
         self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
         self.tree = cKDTree(self.vectors)
@@ -23,10 +32,17 @@ class KDTreeIndex(VectorIndex):
     def query(self, vec: VectorF32, k: int = 1) -> SearchResult:
         assert self.tree is not None
         dist, idx = self.tree.query(vec.reshape(1, -1), k=k)
-        # cKDTree returns shape (1, k) when k>1, or scalars when k==1
-        if k == 1:
-            return SearchResult(indices=np.array([int(idx)]), distances=np.array([float(dist)]))
-        return SearchResult(indices=idx[0].astype(int), distances=dist[0].astype(float))
+        # cKDTree returns shape (1, k) when k>1, or (1,) when k==1
+        return SearchResult(
+            indices=np.asarray(idx).reshape(-1).astype(np.intp),
+            distances=np.asarray(dist).reshape(-1).astype(np.float32),
+        )
+
+    def batch_query(self, vecs: MatrixF32, k: int = 1) -> tuple[IndexArray, MatrixF32]:
+        assert self.tree is not None
+        dist, idx = self.tree.query(np.asarray(vecs).reshape(len(vecs), -1), k=k, workers=self.workers)
+        n = len(vecs)
+        return np.asarray(idx).reshape(n, k).astype(np.intp), np.asarray(dist).reshape(n, k).astype(np.float32)
 
     def save(self, path: str) -> None:
         import json
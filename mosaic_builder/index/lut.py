@@ -0,0 +1,141 @@
+"""
+Precomputed nearest-tile lookup table over the Lab colour space.
+
+The sRGB gamut spans L in [0, 100], a in [-86.2, 98.3] and b in [-107.9, 94.5]. `LabLUTIndex`
+cuts that box into cubic voxels of side `step` and stores, for every voxel centre, the
+positions of its `top_k` nearest tiles. A query is then one floor/ravel and one gather, so
+matching a whole target grid costs the same however many tiles the library holds.
+
+Error bound: a query q lies within h = step·√3/2 of its voxel centre c, and the stored tile
+t is the nearest to c, so by the triangle inequality
+
+    |q - t| <= |c - t| + h <= |c - t*| + h <= |q - t*| + 2h
+
+for the exact nearest tile t*. The returned match is therefore at most `step·√3` Lab units
+(about 1.7 at the default step of 1, under one just-noticeable difference) further than the
+exact one. `build` also measures the worst excess on random queries against an exact
+KD-tree search (`measured_error`). Queries outside the box are clamped to the edge voxels and
+carry no bound; mean colours of sRGB images never fall there.
+"""
+
+import json
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from mosaic_builder.index.base import IndexArray, MatrixF32, SearchResult, VectorF32, VectorIndex
+from mosaic_builder.index.kdtree import KDTreeIndex
+
+GAMUT_LO = np.array([0.0, -87.0, -108.0], dtype=np.float32)
+GAMUT_HI = np.array([100.0, 99.0, 95.0], dtype=np.float32)
+
+_CHUNK_VOXELS = 1 << 18
+
+
+class LabLUTIndex(VectorIndex):
+    def __init__(
+        self,
+        metric: str = "euclidean",
+        step: float = 1.0,
+        top_k: int = 1,
+        workers: int = -1,
+        check_samples: int = 100_000,
+    ):
+        if metric != "euclidean":
+            raise ValueError("the Lab LUT backend supports 'euclidean' only.")
+        if step <= 0 or top_k < 1:
+            raise ValueError(f"need step > 0 and top_k >= 1, got step={step}, top_k={top_k}")
+        self.metric = "euclidean"
+        self.step = float(step)
+        self.top_k = int(top_k)
+        self.workers = workers  # build-time KD-tree threads; -1 = all CPUs
+        self.check_samples = check_samples  # random queries used to measure the error at build time
+        self.shape = tuple(int(n) for n in np.ceil((GAMUT_HI - GAMUT_LO) / self.step))
+        self.table: np.ndarray | None = None  # (voxels, top_k) tile positions, nearest first
+        self.vectors: MatrixF32 | None = None  # exact distances and the k > top_k fallback read these
+        self.measured_error: float | None = None
+        self._exact: KDTreeIndex | None = None
+
+    @property
+    def error_bound(self) -> float:
+        """Worst-case excess distance (Lab units) of a returned tile over the exact match."""
+        return self.step * float(np.sqrt(3.0))
+
+    def build(self, vectors: MatrixF32) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != 3:
+            raise ValueError(f"the Lab LUT backend indexes 3-D mean colours (layout_k=1), got shape {vectors.shape}")
+        if len(vectors) < self.top_k:
+            raise ValueError(f"top_k={self.top_k} exceeds the {len(vectors)} vectors to index")
+        self.vectors = vectors
+        tree = cKDTree(vectors)
+        n = int(np.prod(self.shape))
+        table = np.empty((n, self.top_k), dtype=np.int32 if len(vectors) < 2**31 else np.int64)
+        for lo in range(0, n, _CHUNK_VOXELS):
+            cells = np.stack(np.unravel_index(np.arange(lo, min(lo + _CHUNK_VOXELS, n)), self.shape), axis=1)
+            centres = GAMUT_LO + (cells + 0.5).astype(np.float32) * np.float32(self.step)
+            _, idx = tree.query(centres, k=self.top_k, workers=self.workers)
+            table[lo : lo + len(cells)] = np.asarray(idx).reshape(len(cells), self.top_k)
+        self.table = table
+        self._exact = KDTreeIndex.from_tree(tree, vectors, workers=self.workers)
+        self.measured_error = self._measure_error()
+
+    def _measure_error(self) -> float:
+        """Largest excess of the table's nearest-tile distance over exact search, on random in-box queries."""
+        if not self.check_samples:
+            return float("nan")
+        rng = np.random.default_rng(0)
+        queries = rng.uniform(GAMUT_LO, GAMUT_HI, size=(self.check_samples, 3)).astype(np.float32)
+        _, approx = self.batch_query(queries, k=1)
+        _, exact = self._exact_index().batch_query(queries, k=1)
+        return float(max(0.0, (approx - exact).max()))
+
+    def _exact_index(self) -> KDTreeIndex:
+        if self._exact is None:
+            self._exact = KDTreeIndex(workers=self.workers)
+            self._exact.build(np.asarray(self.vectors))
+        return self._exact
+
+    def query(self, vec: VectorF32, k: int = 1) -> SearchResult:
+        idx, dist = self.batch_query(np.asarray(vec).reshape(1, -1), k)
+        return SearchResult(indices=idx[0], distances=dist[0])
+
+    def batch_query(self, vecs: MatrixF32, k: int = 1) -> tuple[IndexArray, MatrixF32]:
+        assert self.table is not None and self.vectors is not None
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(len(vecs), -1)
+        if k > self.top_k:  # more candidates than the table holds: answer exactly
+            return self._exact_index().batch_query(vecs, k)
+        cells = np.floor((vecs - GAMUT_LO) / np.float32(self.step)).astype(np.intp)
+        voxels = np.ravel_multi_index(tuple(cells.T), self.shape, mode="clip")
+        idx = np.asarray(self.table[voxels, :k], dtype=np.intp)
+        diff = np.asarray(self.vectors[idx.ravel()], dtype=np.float32).reshape(len(vecs), k, 3) - vecs[:, None, :]
+        dist = np.sqrt(np.einsum("nkd,nkd->nk", diff, diff))
+        if k > 1:  # the table is ordered by distance to the voxel centre; re-rank for the query
+            order = np.argsort(dist, axis=1, kind="stable")
+            idx, dist = np.take_along_axis(idx, order, 1), np.take_along_axis(dist, order, 1)
+        return idx, dist
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:  # np.save(str) would append ".npy" and break load(path)
+            np.save(f, self.table)
+        # the vectors are not duplicated here: the index directory's vecs.npy supplies them
+        with open(os.path.splitext(path)[0] + ".json", "w") as f:
+            json.dump(
+                {
+                    "step": self.step,
+                    "top_k": self.top_k,
+                    "shape": list(self.shape),
+                    "error_bound": self.error_bound,
+                    "measured_error": self.measured_error,
+                },
+                f,
+            )
+
+    def load(self, path: str) -> None:
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            meta = json.load(f)
+        self.step, self.top_k, self.shape = meta["step"], meta["top_k"], tuple(meta["shape"])
+        self.measured_error = meta.get("measured_error")
+        self.table = np.load(path, mmap_mode="r")
+        self._exact = None
@@ -0,0 +1,105 @@
+import numpy as np
+
+from mosaic_builder.index.base import IndexArray, MatrixF32, SearchIndex, SearchResult, VectorF32
+
+
+class SegmentedArray:
+    """
+    Read-only row concatenation of per-segment arrays (e.g. memory-mapped main + delta
+    vectors) that supports the indexing builds need without copying the main segment.
+    """
+
+    def __init__(self, parts: list[np.ndarray]):
+        self.parts = parts
+        self.offsets = np.cumsum([0] + [len(p) for p in parts])
+        self.shape = (int(self.offsets[-1]), *parts[0].shape[1:])
+        self.dtype = parts[0].dtype
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            seg = int(np.searchsorted(self.offsets, key, side="right")) - 1
+            return self.parts[seg][key - self.offsets[seg]]
+        if isinstance(key, slice):
+            key = np.arange(len(self))[key]
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        flat = key.ravel()
+        seg = np.searchsorted(self.offsets, flat, side="right") - 1
+        out = np.empty((len(flat), *self.shape[1:]), dtype=self.dtype)
+        for s in np.unique(seg):
+            mask = seg == s
+            out[mask] = self.parts[s][flat[mask] - self.offsets[s]]
+        return out.reshape(*key.shape, *self.shape[1:])
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        out = np.concatenate([np.asarray(p) for p in self.parts])
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+class SegmentedIndex(SearchIndex):
+    """
+    Searches a main index plus delta segments as one index over concatenated positions,
+    skipping tombstoned positions. Query-only: segments are built by `build_index.update_index`
+    and written and opened through `index_file`.
+
+    Each segment is asked for k candidates plus room for its tombstones; rows left short
+    after dropping dead hits are re-queried with a larger k. Candidates are re-ranked by
+    exact Euclidean distance to the query, so backends that report squared or approximate
+    distances (faiss, hnsw) merge correctly with exact KD-tree deltas.
+    """
+
+    metric = "euclidean"
+
+    def __init__(self, segments: list[SearchIndex], vectors: list[np.ndarray], dead: np.ndarray | None = None):
+        self.segments, self.vectors = segments, vectors
+        self.offsets = np.cumsum([0] + [len(v) for v in vectors])
+        dead = np.unique(np.asarray(dead if dead is not None else [], dtype=np.int64))
+        self.dead = [  # per-segment sorted local dead positions
+            dead[(dead >= lo) & (dead < hi)] - lo for lo, hi in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+        self.live = int(self.offsets[-1]) - len(dead)
+
+    def query(self, vec: VectorF32, k: int = 1) -> SearchResult:
+        idx, dist = self.batch_query(np.asarray(vec).reshape(1, -1), k)
+        return SearchResult(indices=idx[0], distances=dist[0])
+
+    def _segment_candidates(self, s: int, vecs: np.ndarray, k: int) -> np.ndarray:
+        """(n, k) global positions of live hits in segment s, -1 where it has fewer than k."""
+        index, dead, size = self.segments[s], self.dead[s], len(self.vectors[s])
+        k = min(k, size - len(dead))
+        out = np.full((len(vecs), max(k, 0)), -1, dtype=np.int64)
+        if k <= 0:
+            return out
+        todo = np.arange(len(vecs))
+        kq = min(size, k + min(len(dead), 16))
+        while len(todo):
+            idx, _ = index.batch_query(vecs[todo], k=kq)
+            idx = np.asarray(idx, dtype=np.int64)
+            alive = (idx >= 0) & ~np.isin(idx, dead)
+            enough = alive.sum(axis=1) >= k
+            if kq >= size:
+                enough[:] = True  # every live tile was returned
+            for row in np.flatnonzero(enough):
+                hits = idx[row][alive[row]][:k]
+                out[todo[row], : len(hits)] = hits + self.offsets[s]
+            todo = todo[~enough]
+            kq = min(size, kq * 4)
+        return out
+
+    def batch_query(self, vecs: MatrixF32, k: int = 1) -> tuple[IndexArray, MatrixF32]:
+        if k > self.live:
+            raise ValueError(f"k={k} exceeds the {self.live} live vectors in the index")
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(len(vecs), -1)
+        cand = np.concatenate([self._segment_candidates(s, vecs, k) for s in range(len(self.segments))], axis=1)
+        dist = np.full(cand.shape, np.inf, dtype=np.float32)
+        for s, base in enumerate(self.vectors):
+            mask = (cand >= self.offsets[s]) & (cand < self.offsets[s + 1])
+            rows, cols = np.nonzero(mask)
+            diff = np.asarray(base[cand[rows, cols] - self.offsets[s]], dtype=np.float32) - vecs[rows]
+            dist[rows, cols] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(cand, order, 1).astype(np.intp), np.take_along_axis(dist, order, 1)
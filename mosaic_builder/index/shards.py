@@ -0,0 +1,126 @@
+"""
+Searching a sharded index: independently built index directories (`shard-NNNN/`) whose
+positions run through the shards in order.
+
+Shards are split round-robin into groups, and each group is served by its own
+single-process pool that opens those shards once and keeps them loaded, so a library far
+larger than one process's comfortable KD-tree is searched by several processes at once. A
+query batch is copied once into shared memory; every group searches its shards, re-ranks
+its candidates by exact Euclidean distance and returns its top k as global positions, and
+the caller merges the groups' results.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from mosaic_builder.index.base import IndexArray, MatrixF32, SearchIndex, SearchResult, VectorF32
+from mosaic_builder.index.segments import SegmentedArray, SegmentedIndex
+
+_group = None  # per worker process: (index over the group's shards, their vectors, local offsets, global offsets)
+
+
+def _shard_group(files: list, workers: int):
+    """(index, vectors, local offsets) searching `files` (opened shard IndexFiles) as one index."""
+    if len(files) == 1:
+        return files[0].load_backend(workers), files[0].vecs, np.array([0, len(files[0].ids)])
+    index = SegmentedIndex([f.load_backend(workers) for f in files], [f.vecs for f in files])
+    return index, SegmentedArray([f.vecs for f in files]), index.offsets
+
+
+def _group_top_k(group, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """(n, k') global positions and exact distances of the group's k' = min(k, size) nearest tiles."""
+    index, vectors, local, offsets = group
+    k = min(k, int(local[-1]))
+    idx, _ = index.batch_query(queries, k=k)
+    idx = np.asarray(idx, dtype=np.int64)
+    # faiss/hnsw report squared or approximate distances: recompute them so groups merge exactly
+    diff = np.asarray(vectors[idx], dtype=np.float32) - queries[:, None, :]
+    dist = np.sqrt(np.einsum("nkd,nkd->nk", diff, diff))
+    seg = np.searchsorted(local, idx, side="right") - 1
+    return idx - local[seg] + offsets[seg], dist
+
+
+def _open_group(paths: list[str], offsets: list[int]) -> None:
+    global _group
+    from mosaic_builder.index.index_file import open_index  # index_file imports this module
+
+    index, vectors, local = _shard_group([open_index(p) for p in paths], workers=1)
+    _group = (index, vectors, np.asarray(local), np.asarray(offsets, dtype=np.int64))
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def _query_group(shm_name: str, shape: tuple[int, int], k: int) -> tuple[np.ndarray, np.ndarray]:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        queries = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        result = _group_top_k(_group, queries, k)
+        del queries  # release the buffer before closing the mapping
+        return result
+    finally:
+        shm.close()
+
+
+class ShardedIndex(SearchIndex):
+    """
+    Searches the shards of a sharded index (opened `IndexFile`s) from `processes` worker
+    processes, or in this process when `processes` <= 1. Query-only: shards are built by
+    `build_index.build_sharded_index` and opened through `index_file`.
+    """
+
+    metric = "euclidean"
+
+    def __init__(self, shards: list, processes: int = 1):
+        self.offsets = np.cumsum([0] + [len(s.ids) for s in shards])
+        self.count = int(self.offsets[-1])
+        self.processes = max(1, min(processes, len(shards)))
+        self.pools: list[ProcessPoolExecutor] = []
+        self._local = None
+        if self.processes == 1:
+            index, vectors, local = _shard_group(shards, workers=-1)
+            self._local = (index, vectors, np.asarray(local), np.asarray(self.offsets[:-1], dtype=np.int64))
+            return
+        # workers started after the tracker share it; with their own, each would "clean up" the
+        # parent's query buffers as leaks on exit
+        resource_tracker.ensure_running()
+        for g in range(self.processes):
+            members = range(g, len(shards), self.processes)
+            args = ([str(shards[s].path) for s in members], [int(self.offsets[s]) for s in members])
+            self.pools.append(ProcessPoolExecutor(max_workers=1, initializer=_open_group, initargs=args))
+        for future in [pool.submit(_ready) for pool in self.pools]:
+            future.result()  # load every group now, in parallel, so failures surface here
+
+    def query(self, vec: VectorF32, k: int = 1) -> SearchResult:
+        idx, dist = self.batch_query(np.asarray(vec).reshape(1, -1), k)
+        return SearchResult(indices=idx[0], distances=dist[0])
+
+    def batch_query(self, vecs: MatrixF32, k: int = 1) -> tuple[IndexArray, MatrixF32]:
+        if k > self.count:
+            raise ValueError(f"k={k} exceeds the {self.count} vectors in the index")
+        vecs = np.ascontiguousarray(np.asarray(vecs, dtype=np.float32).reshape(len(vecs), -1))
+        if self._local is not None:
+            idx, dist = _group_top_k(self._local, vecs, k)
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=max(vecs.nbytes, 1))
+            try:
+                np.ndarray(vecs.shape, dtype=np.float32, buffer=shm.buf)[:] = vecs
+                futures = [pool.submit(_query_group, shm.name, vecs.shape, k) for pool in self.pools]
+                parts = [f.result() for f in futures]
+            finally:
+                shm.close()
+                shm.unlink()
+            idx = np.concatenate([p[0] for p in parts], axis=1)
+            dist = np.concatenate([p[1] for p in parts], axis=1)
+        order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(idx, order, 1).astype(np.intp), np.take_along_axis(dist, order, 1)
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        for pool in self.pools:
+            pool.shutdown()
+        self.pools = []
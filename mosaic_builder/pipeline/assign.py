@@ -0,0 +1,100 @@
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Assignment:
+    indices: np.ndarray  # (rows, cols) chosen positions in the vector index
+    cost: float  # sum of the chosen candidates' distances
+    optimum: float  # sum of nearest-neighbour distances: the unconstrained lower bound
+    fallbacks: int  # cells where no candidate met the constraints
+
+    @property
+    def overhead(self) -> float:
+        """Relative cost above the unconstrained optimum (0.05 = 5% worse)."""
+        return self.cost / self.optimum - 1.0 if self.optimum else 0.0
+
+
+def assign_tiles(
+    cand_idx: np.ndarray,
+    cand_dist: np.ndarray,
+    shape: tuple[int, int],
+    max_uses: int | None = None,
+    min_distance: int = 0,
+) -> Assignment:
+    """
+    Pick one tile per cell from its k nearest candidates, limiting repetition.
+
+    `cand_idx`/`cand_dist` are the (rows*cols, k) output of `SearchIndex.batch_query`, in
+    row-major cell order. A tile is used at most `max_uses` times, and never twice within
+    `min_distance` cells (Chebyshev distance, so 1 forbids touching repeats).
+
+    Greedy in global distance order: all (cell, candidate) pairs are visited from closest
+    to farthest, and each cell takes the first candidate that still satisfies the
+    constraints. That is one sort plus one pass over the pairs, so 100k+ cells take about
+    a second. Cells whose k candidates are all exhausted fall back to their best candidate
+    under the usage cap alone (or their nearest one), and are counted in `fallbacks`.
+    """
+    rows, cols = shape
+    n, k = cand_idx.shape
+    flat_idx = cand_idx.ravel().tolist()
+    flat_dist = cand_dist.ravel()
+    r = min_distance
+
+    chosen = [-1] * n  # flat candidate position chosen per cell
+    uses: dict[int, int] = defaultdict(int)
+    # spacing check: each tile's uses hashed into (r+1)-cell buckets; any repeat within r cells
+    # is in one of the 3x3 neighbouring buckets, which hold at most a few uses each
+    buckets: dict[tuple[int, int, int], list[tuple[int, int]]] = defaultdict(list)
+    size = r + 1
+
+    def too_close(t: int, y: int, x: int) -> bool:
+        by, bx = y // size, x // size
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for py, px in buckets.get((t, by + dy, bx + dx), ()):
+                    if abs(py - y) <= r and abs(px - x) <= r:
+                        return True
+        return False
+
+    remaining = n
+    for o in np.argsort(flat_dist, kind="stable").tolist():
+        cell = o // k
+        if chosen[cell] >= 0:
+            continue
+        t = flat_idx[o]
+        if max_uses is not None and uses[t] >= max_uses:
+            continue
+        if r:
+            y, x = divmod(cell, cols)
+            if too_close(t, y, x):
+                continue
+            buckets[t, y // size, x // size].append((y, x))
+        chosen[cell] = o
+        uses[t] += 1
+        remaining -= 1
+        if not remaining:
+            break
+
+    fallbacks = 0
+    for cell in range(n):
+        if chosen[cell] >= 0:
+            continue
+        fallbacks += 1
+        ranks = range(cell * k, (cell + 1) * k)
+        o = next((o for o in ranks if max_uses is None or uses[flat_idx[o]] < max_uses), cell * k)
+        chosen[cell] = o
+        uses[flat_idx[o]] += 1
+        if r:
+            y, x = divmod(cell, cols)
+            buckets[flat_idx[o], y // size, x // size].append((y, x))
+
+    chosen_arr = np.asarray(chosen, dtype=np.int64)
+    return Assignment(
+        indices=cand_idx.ravel()[chosen_arr].reshape(rows, cols),
+        cost=float(flat_dist[chosen_arr].sum(dtype=np.float64)),
+        optimum=float(cand_dist.min(axis=1).sum(dtype=np.float64)),
+        fallbacks=fallbacks,
+    )
@@ -0,0 +1,137 @@
+import json
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+_ATLAS_RE = re.compile(r"atlas_(\d+)x(\d+)_(\d+)\.u8$")
+_STAMP = "atlas.json"  # the store generation the atlases were written for
+
+
+def grid_patches(im: Image.Image, tile_w: int, tile_h: int, cols: int, rows: int, patch_px: int) -> np.ndarray:
+    """
+    Resample the tiled region of `im` into a (rows, cols, patch_px, patch_px, 3) uint8 block
+    of per-tile patches with one LANCZOS resize of the whole grid, instead of one per tile.
+    tile_w/tile_h are in `im` pixels.
+    """
+    region = im.crop((0, 0, cols * tile_w, rows * tile_h))
+    arr = np.asarray(region.resize((cols * patch_px, rows * patch_px), Image.Resampling.LANCZOS))
+    return arr.reshape(rows, patch_px, cols, patch_px, 3).transpose(0, 2, 1, 3, 4)
+
+
+class PatchAtlas:
+    """
+    Packed tile pixels for one source grid size at one patch resolution.
+
+    Two append-only files: `atlas_{tw}x{th}_{px}.u8` holds fixed-size px×px×3 slots and
+    `.ids` the int64 tile id of each slot. Pixels are written before ids, so a slot is
+    only visible once complete. Reads go through a memory map; if an id was written more
+    than once (tiles re-ingested), the last slot wins. Reads are safe from several threads:
+    the lookup arrays are opened under a lock and published together.
+    """
+
+    def __init__(self, root: Path, tile_w: int, tile_h: int, patch_px: int):
+        self.tile_w, self.tile_h, self.patch_px = tile_w, tile_h, patch_px
+        self.pixels_path = root / f"atlas_{tile_w}x{tile_h}_{patch_px}.u8"
+        self.ids_path = self.pixels_path.with_suffix(".ids")
+        self._slot_shape = (patch_px, patch_px, 3)
+        self._view: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None  # (sorted ids, slots, pixels)
+        self._lock = threading.Lock()
+
+    def append(self, tile_ids: np.ndarray, patches: np.ndarray) -> None:
+        patches = np.ascontiguousarray(patches, dtype=np.uint8).reshape(-1, *self._slot_shape)
+        self.pixels_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.pixels_path, "ab") as f:
+            f.write(patches.tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.asarray(tile_ids, dtype=np.int64).tobytes())
+        self._view = None  # reopen lazily on next read
+
+    def _open(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            if self._view is None:
+                self._view = self._read()
+            return self._view
+
+    def _read(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ids = np.fromfile(self.ids_path, dtype=np.int64) if self.ids_path.exists() else np.empty(0, np.int64)
+        slot_bytes = int(np.prod(self._slot_shape))
+        n = min(len(ids), self.pixels_path.stat().st_size // slot_bytes if self.pixels_path.exists() else 0)
+        ids = ids[:n]
+        # unique over the reversed ids keeps the last slot written for each id
+        keys, first_rev = np.unique(ids[::-1], return_index=True)
+        pixels = (
+            np.memmap(self.pixels_path, dtype=np.uint8, mode="r", shape=(n, *self._slot_shape))
+            if n
+            else np.empty((0, *self._slot_shape), np.uint8)
+        )
+        return keys, n - 1 - first_rev, pixels
+
+    def get(self, tile_id: int) -> np.ndarray | None:
+        """The tile's px×px×3 patch, or None if it is not in the atlas."""
+        keys, slots, pixels = self._view or self._open()
+        i = int(np.searchsorted(keys, tile_id))
+        if i == len(keys) or keys[i] != tile_id:
+            return None
+        return pixels[slots[i]]
+
+
+def atlas_generation(root: Path) -> str | None:
+    """Store generation the atlases under `root` were written for; None if unstamped."""
+    try:
+        return json.loads((root / _STAMP).read_text())["generation"]
+    except FileNotFoundError:
+        return None
+
+
+def claim_atlas_dir(root: Path, generation: str) -> None:
+    """
+    Stamp `root` for patches of the store at `generation` before writing to it. Atlases
+    stamped for another generation are deleted first: the store was wiped since, and the
+    tile ids they are keyed by have been (or will be) reused. Unstamped atlases predate
+    the stamp and are kept.
+    """
+    stamped = atlas_generation(root)
+    if stamped == generation:
+        return
+    if stamped is not None:
+        stale = [p for p in sorted(root.glob("atlas_*")) if p.suffix in (".u8", ".ids")]
+        print(f"[mosaic-builder] Removing {len(stale)} atlas files written before the store was wiped from {root}")
+        for p in stale:
+            p.unlink()
+    root.mkdir(parents=True, exist_ok=True)
+    (root / _STAMP).write_text(json.dumps({"generation": generation}))
+
+
+class AtlasSet:
+    """
+    All atlases in a directory, keyed by source grid size and patch resolution. Given the
+    store's `generation`, atlases stamped for another one are `stale` and left unused.
+    """
+
+    def __init__(self, root: Path, generation: str | None = None):
+        self.atlases: dict[tuple[int, int], dict[int, PatchAtlas]] = {}
+        stamped = atlas_generation(root) if generation is not None else None
+        self.stale = stamped is not None and stamped != generation
+        for p in sorted(root.glob("atlas_*.u8")) if root.is_dir() and not self.stale else []:
+            m = _ATLAS_RE.match(p.name)
+            if m:
+                tw, th, px = map(int, m.groups())
+                self.atlases.setdefault((tw, th), {})[px] = PatchAtlas(root, tw, th, px)
+
+    def patch(self, tile_id: int, tile_w: int, tile_h: int, out_px: int) -> np.ndarray | None:
+        """
+        Best stored patch for rendering at `out_px`: the exact resolution if present,
+        else the smallest larger one (downsampling), else the largest available.
+        """
+        by_px = self.atlases.get((tile_w, tile_h))
+        if not by_px:
+            return None
+        larger = sorted(px for px in by_px if px >= out_px)
+        for px in larger + sorted((px for px in by_px if px < out_px), reverse=True):
+            patch = by_px[px].get(tile_id)
+            if patch is not None:
+                return patch
+        return None
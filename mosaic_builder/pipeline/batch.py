@@ -0,0 +1,100 @@
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from mosaic_builder.index.index_file import SEARCH_PROCESSES
+from mosaic_builder.pipeline.build_mosaic import MosaicSession
+from mosaic_builder.pipeline.render import CacheStats, ImageCache
+
+
+@dataclass
+class BatchJob:
+    target: Path
+    out: Path
+    tile_px: int
+
+
+@dataclass
+class JobResult:
+    job: BatchJob
+    seconds: float
+    cells: int = 0
+    error: str | None = None
+
+
+@dataclass
+class BatchReport:
+    results: list[JobResult]
+    load_seconds: float  # index, store and atlas setup, paid once per batch
+    seconds: float  # wall time for all jobs
+    cache: CacheStats
+
+    @property
+    def failed(self) -> list[JobResult]:
+        return [r for r in self.results if r.error]
+
+
+def read_manifest(path: Path, default_tile_px: int) -> list[BatchJob]:
+    """
+    Jobs from a CSV with a `target,out[,tile_px]` header. Relative paths are taken relative
+    to the manifest's directory; a blank or missing tile_px uses `default_tile_px`.
+    """
+    base = path.parent
+    jobs = []
+    with path.open(newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            if not row.get("target") or not row.get("out"):
+                raise ValueError(f"{path}:{line}: each job needs a target and an out path")
+            tile_px = (row.get("tile_px") or "").strip()
+            jobs.append(
+                BatchJob(base / row["target"].strip(), base / row["out"].strip(), int(tile_px or default_tile_px))
+            )
+    return jobs
+
+
+def build_batch(
+    store_url: str,
+    index_path: Path,
+    jobs: list[BatchJob],
+    workers: int = 4,
+    cache_mb: int = 1024,
+    atlas_dir: Path | None = None,
+    search_processes: int = SEARCH_PROCESSES,
+    **build_options,
+) -> BatchReport:
+    """
+    Build many mosaics against one library: the index, store and atlases are loaded
+    once, source photos decoded for one job are reused by the others (up to `cache_mb` of
+    decoded pixels), and `workers` jobs run concurrently in threads. A failing job is
+    recorded in its result and does not stop the batch. `build_options` go to `MosaicSession.build`.
+    """
+
+    def run(job: BatchJob) -> JobResult:
+        start = time.perf_counter()
+        try:
+            report = session.build(job.target, job.out, job.tile_px, job.tile_px, quiet=True, **build_options)
+        except Exception as e:  # one bad target must not sink the batch
+            return JobResult(job, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+        return JobResult(job, report.seconds, cells=report.cells)
+
+    start = time.perf_counter()
+    cache = ImageCache(max_bytes=cache_mb << 20)
+    with MosaicSession(store_url, index_path, atlas_dir, cache, search_processes) as session:
+        loaded = time.perf_counter()
+        if workers <= 1:
+            results = [run(job) for job in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(run, jobs))
+    return BatchReport(results, loaded - start, time.perf_counter() - loaded, session.cache.stats)
+
+
+def write_report(results: list[JobResult], path: Path) -> None:
+    """Per-job timing as CSV: target, out, tile_px, cells, seconds, error."""
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["target", "out", "tile_px", "cells", "seconds", "error"])
+        for r in results:
+            writer.writerow([r.job.target, r.job.out, r.job.tile_px, r.cells, f"{r.seconds:.3f}", r.error or ""])
@@ -1,19 +1,240 @@
+import math
+import time
+from dataclasses import dataclass
 from pathlib import Path
+from typing import BinaryIO, Callable
 
-import joblib
 import numpy as np
 from PIL import Image, ImageOps
-from skimage.color import rgb2lab
 
-from mosaic_builder.stores.factory import open_store
+from mosaic_builder.color import lab_to_srgb
+from mosaic_builder.index.factory import make_index
+from mosaic_builder.index.index_file import SEARCH_PROCESSES, open_index
+from mosaic_builder.pipeline.assign import assign_tiles
+from mosaic_builder.pipeline.atlas import AtlasSet
+from mosaic_builder.pipeline.dzi import DeepZoomWriter
+from mosaic_builder.pipeline.png_stream import PngStripWriter
+from mosaic_builder.pipeline.quadtree import SizeIndexes, match_by_size, quadtree_cells
+from mosaic_builder.pipeline.render import (
+    ImageCache,
+    PatchRenderer,
+    band_rows_for_budget,
+    fill_boxes,
+    grid_boxes,
+)
+from mosaic_builder.pipeline.tiling import image_to_lab, layout_means, tile_layouts
+from mosaic_builder.stores.pool import StorePool
 
 
-def grid_avg_lab(img, tile_w: int, tile_h: int):
+def grid_avg_lab(img, tile_w: int, tile_h: int, layout_k: int = 1):
+    """
+    Per-cell target vectors: (rows, cols, 3) mean Lab, or with layout_k > 1 the same
+    (rows, cols, 3k²) k×k layout descriptor that ingest stores for each tile.
+    """
     w, h = img.size
     cols, rows = w // tile_w, h // tile_h
-    small = img.resize((cols, rows), Image.Resampling.LANCZOS)
-    arr = np.asarray(small.convert("RGB"), dtype=np.float32) / 255.0
-    return rgb2lab(arr), cols, rows, small
+    small = img.resize((cols * layout_k, rows * layout_k), Image.Resampling.LANCZOS)
+    lab = image_to_lab(small)
+    if layout_k > 1:
+        lab = tile_layouts(lab, layout_k)
+    return lab, cols, rows, small
+
+
+_DZI_BUDGET_MB = 256  # default render budget for Deep Zoom output, which is always streamed
+
+# on_preview(image, cells_done, cells_total): called with each progressive intermediate
+PreviewCallback = Callable[[Image.Image, int, int], None]
+
+
+@dataclass
+class BuildReport:
+    cells: int
+    tiles: int  # distinct tiles placed
+    seconds: float
+    cache_hits: int  # decoded-photo cache lookups during this build
+    cache_misses: int
+
+
+class MosaicSession:
+    """
+    What a build reads besides its target: the index, store connections (one per
+    thread), patch atlases and the decoded-photo cache. Load it once and call `build` for
+    many targets, from several threads at once if needed; source photos decoded for one
+    mosaic are reused by the next. `close` it (or use it as a context manager) to release
+    the store connections and a sharded index's `search_processes`.
+    """
+
+    def __init__(
+        self,
+        store_url: str,
+        index_path: Path,
+        atlas_dir: Path | None = None,
+        cache: ImageCache | None = None,
+        search_processes: int = SEARCH_PROCESSES,
+    ):
+        self.index_file = open_index(index_path)
+        self.ids = self.index_file.all_ids  # per index position, across delta segments
+        self.vecs = self.index_file.all_vecs
+        self.layout_k = self.index_file.layout_k
+        self.index = self.index_file.load_backend(processes=search_processes)
+        header = self.index_file.header
+        self.size_indexes = SizeIndexes(  # adaptive builds' per-size indexes, built once per session
+            self.vecs,
+            self.index_file.all_tile_sizes,
+            self.index_file.live_mask,
+            lambda: make_index(header.backend, metric=header.metric, **header.params),
+        )
+        self.stores = StorePool(store_url)
+        self.atlases = None
+        if atlas_dir:
+            self.atlases = AtlasSet(atlas_dir, self.stores.get().tile_snapshot()["generation"])
+            if self.atlases.stale:
+                print(f"[mosaic-builder] Not using the atlases in {atlas_dir}: written before the store was wiped")
+        self.cache = cache or ImageCache()
+
+    def close(self) -> None:
+        self.index.close()  # stops a sharded index's search processes
+        self.stores.close()
+
+    def __enter__(self) -> "MosaicSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def build(
+        self,
+        target_path: Path | BinaryIO,
+        out_path: Path | BinaryIO,
+        tile_w=24,
+        tile_h=24,
+        debug_dir: Path | None = None,
+        memory_budget_mb: int | None = None,
+        render_threads: int = 1,
+        max_uses: int | None = None,
+        min_repeat_distance: int = 0,
+        candidates: int = 16,
+        adaptive_levels: int = 1,
+        split_variance: float = 40.0,
+        dzi_tile_size: int = 254,
+        dzi_format: str = "jpg",
+        quiet: bool = False,
+        on_preview: PreviewCallback | None = None,
+        preview_passes: int = 4,
+    ) -> BuildReport:
+        """
+        Render one mosaic; options as for `build_mosaic`. `quiet` suppresses progress lines.
+        The target and output may also be binary streams (the output is then PNG).
+        """
+        deep_zoom = isinstance(out_path, (str, Path)) and Path(out_path).suffix.lower() == ".dzi"
+        if deep_zoom and memory_budget_mb is None:
+            memory_budget_mb = _DZI_BUDGET_MB
+        if memory_budget_mb is not None and Path(out_path).suffix.lower() not in (".png", ".dzi"):
+            raise ValueError("streaming render (memory_budget_mb) writes PNG or DZI; use a .png or .dzi output path")
+        if on_preview is not None and memory_budget_mb is not None:
+            raise ValueError("progressive previews need the in-memory render; drop memory_budget_mb or use .png")
+        log = (lambda msg: None) if quiet else print
+        start = time.perf_counter()
+        hits, misses = self.cache.stats.hits, self.cache.stats.misses
+        ids, index = self.ids, self.index
+
+        target = ImageOps.exif_transpose(Image.open(target_path).convert("RGB"))
+        small = None
+        if adaptive_levels > 1:
+            if tile_w != tile_h or self.layout_k != 1 or max_uses is not None or min_repeat_distance:
+                raise ValueError("adaptive layout needs square tiles, a layout_k=1 index and no repeat limits")
+            cells = quadtree_cells(target, tile_w, adaptive_levels, split_variance)
+            positions = match_by_size(cells, index, self.size_indexes)
+            boxes, width, height = cells.boxes, cells.width, cells.height
+            row_px = tile_w << (adaptive_levels - 1)  # bands must not cut through the largest cells
+            sizes, counts = np.unique(cells.sizes, return_counts=True)
+            log(
+                f"[mosaic-builder] Adaptive layout: {len(boxes)} cells ("
+                + ", ".join(f"{c}×{sz}px" for sz, c in zip(sizes.tolist(), counts.tolist()))
+                + f") instead of {(width // tile_w) * (height // tile_h)} fixed cells"
+            )
+        else:
+            lab_grid, cols, rows, small = grid_avg_lab(target, tile_w, tile_h, self.layout_k)
+            if max_uses is None and not min_repeat_distance:
+                idx, _ = index.batch_query(lab_grid.reshape(rows * cols, -1), k=1)
+                positions = idx[:, 0]
+            else:
+                idx, dist = index.batch_query(lab_grid.reshape(rows * cols, -1), k=min(candidates, len(ids)))
+                assignment = assign_tiles(idx, dist, (rows, cols), max_uses, min_repeat_distance)
+                positions = assignment.indices.ravel()
+                log(
+                    f"[mosaic-builder] Assignment cost {assignment.cost:,.1f} vs unconstrained "
+                    f"{assignment.optimum:,.1f} (+{assignment.overhead:.1%}); "
+                    f"{assignment.fallbacks} cells fell back past the constraints"
+                )
+            boxes, width, height = grid_boxes(rows, cols, tile_w, tile_h), cols * tile_w, rows * tile_h
+            row_px = tile_h
+
+        tile_ids = ids[positions]
+        infos = self.stores.get().tile_patch_infos(np.unique(tile_ids))
+        renderer = PatchRenderer(infos, tile_w, tile_h, self.atlases, self.cache, threads=render_threads)
+        if memory_budget_mb is None:
+            pixels = np.empty((height, width, 3), dtype=np.uint8)
+            if on_preview is None:
+                renderer.render_placements(tile_ids, boxes, pixels)
+            else:
+                self._render_progressive(renderer, positions, tile_ids, boxes, pixels, on_preview, preview_passes)
+            canvas = Image.fromarray(pixels)
+            canvas.save(out_path, format=None if isinstance(out_path, (str, Path)) else "PNG")
+        else:
+            band_px = band_rows_for_budget(1, width, row_px, (memory_budget_mb << 20) // 2) * row_px
+            canvas = None
+            if deep_zoom:
+                sink = DeepZoomWriter(out_path, width, height, dzi_tile_size, fmt=dzi_format)
+            else:
+                sink = PngStripWriter(out_path, width, height)
+            with sink:
+                for band in renderer.iter_placement_bands(tile_ids, boxes, width, height, band_px):
+                    sink.write_rows(band)
+        report = BuildReport(
+            cells=len(tile_ids),
+            tiles=len(infos),
+            seconds=time.perf_counter() - start,
+            cache_hits=self.cache.stats.hits - hits,
+            cache_misses=self.cache.stats.misses - misses,
+        )
+        log(
+            f"[mosaic-builder] Rendered {report.cells} cells from {report.tiles} tiles; "
+            f"photo cache {report.cache_hits} hits / {report.cache_misses} misses"
+        )
+        if debug_dir:
+            debug_dir.mkdir(parents=True, exist_ok=True)
+            if small is not None:
+                small.save(debug_dir / "target_colorgrid.jpg")
+            if canvas is not None:  # a streamed mosaic is never held in memory
+                canvas.save(debug_dir / "mosaic_preview.jpg")
+        return report
+
+    def _render_progressive(
+        self,
+        renderer: PatchRenderer,
+        positions: np.ndarray,
+        tile_ids: np.ndarray,
+        boxes: np.ndarray,
+        pixels: np.ndarray,
+        on_preview: PreviewCallback,
+        passes: int,
+    ) -> None:
+        """
+        Flat-fill every cell with its tile's indexed mean color and publish that, then paste
+        the real patches in `passes` runs of cells (placement order) and publish after each.
+        """
+        means = self.vecs[positions]
+        if self.layout_k > 1:
+            means = layout_means(means)
+        fill_boxes(lab_to_srgb(means), boxes, pixels)
+        total = len(tile_ids)
+        on_preview(Image.fromarray(pixels.copy()), 0, total)
+        step = max(1, math.ceil(total / max(1, passes)))
+        for lo in range(0, total, step):
+            hi = min(total, lo + step)
+            renderer.render_placements(tile_ids[lo:hi], boxes[lo:hi], pixels)
+            on_preview(Image.fromarray(pixels.copy()), hi, total)
 
 
 def build_mosaic(
@@ -24,34 +245,69 @@ def build_mosaic(
     tile_w=24,
     tile_h=24,
     debug_dir: Path | None = None,
-):
-    bundle = joblib.load(index_path)
-    ids, tree = bundle["ids"], bundle["tree"]
-
-    target = ImageOps.exif_transpose(Image.open(target_path).convert("RGB"))
-    lab_grid, cols, rows, small = grid_avg_lab(target, tile_w, tile_h)
-
-    nearest_ids = np.empty((rows, cols), dtype=np.int32)
-    for y in range(rows):
-        d, idx = tree.query(lab_grid[y, :, :], k=1)
-        nearest_ids[y, :] = ids[idx]
-
-    store = open_store(store_url)
-    try:
-        canvas = Image.new("RGB", (cols * tile_w, rows * tile_h))
-        for y in range(rows):
-            for x in range(cols):
-                path, gx, gy, tw, th = store.tile_patch_info(int(nearest_ids[y, x]))
-                im = ImageOps.exif_transpose(Image.open(path).convert("RGB"))
-                patch = im.crop((gx * tw, gy * th, (gx + 1) * tw, (gy + 1) * th))
-                canvas.paste(
-                    patch.resize((tile_w, tile_h), Image.Resampling.LANCZOS),
-                    (x * tile_w, y * tile_h),
-                )
-        canvas.save(out_path)
-        if debug_dir:
-            debug_dir.mkdir(parents=True, exist_ok=True)
-            small.save(debug_dir / "target_colorgrid.jpg")
-            canvas.save(debug_dir / "mosaic_preview.jpg")
-    finally:
-        store.close()
+    atlas_dir: Path | None = None,
+    memory_budget_mb: int | None = None,
+    render_threads: int = 1,
+    max_uses: int | None = None,
+    min_repeat_distance: int = 0,
+    candidates: int = 16,
+    adaptive_levels: int = 1,
+    split_variance: float = 40.0,
+    dzi_tile_size: int = 254,
+    dzi_format: str = "jpg",
+    on_preview: PreviewCallback | None = None,
+    preview_passes: int = 4,
+    search_processes: int = SEARCH_PROCESSES,
+) -> BuildReport:
+    """
+    Render a mosaic of `target_path`. With `atlas_dir`, patches come from the ingest-time
+    patch atlas; tiles missing from it fall back to decoding their source photo.
+
+    With `memory_budget_mb`, the mosaic is rendered in row bands and streamed to a PNG, so
+    peak memory stays within the budget (half for the band buffer, half for decoded source
+    photos) whatever the output size. `out_path` must then be a .png or .dzi.
+
+    An `out_path` ending in .dzi writes a Deep Zoom tile pyramid (`dzi_tile_size` tiles in
+    `dzi_format`) straight from the streamed bands, every zoom level in the same pass; the
+    memory budget defaults to 256 MiB.
+
+    `render_threads` composites disjoint row runs in parallel; output is identical.
+
+    `max_uses` caps how often one tile appears and `min_repeat_distance` keeps repeats at
+    least that many cells apart; tiles are then assigned from each cell's `candidates`
+    nearest neighbours instead of taking the single nearest.
+
+    `adaptive_levels` > 1 switches to a quadtree layout: cells of tile_w * 2^n pixels
+    (n < adaptive_levels) split wherever the target's Lab variance exceeds `split_variance`,
+    each matched against tiles ingested at that size (see `quadtree_cells`). Needs square
+    tiles, mean-Lab (layout_k=1) indexes, and no repeat limits.
+
+    `on_preview(image, cells_done, cells_total)` makes the render progressive: it is first
+    called with every cell flat-filled in its matched tile's mean color (from the index, no
+    photo decoding), then after each of `preview_passes` runs of real patches; the last call
+    shows the finished mosaic. Not available with streamed (memory-budget or .dzi) output.
+
+    `search_processes` is the number of worker processes searching a sharded index.
+    """
+    if memory_budget_mb is None and Path(out_path).suffix.lower() == ".dzi":
+        memory_budget_mb = _DZI_BUDGET_MB
+    cache = ImageCache(max_bytes=(memory_budget_mb << 20) // 2) if memory_budget_mb is not None else None
+    with MosaicSession(store_url, index_path, atlas_dir, cache, search_processes) as session:
+        return session.build(
+            target_path,
+            out_path,
+            tile_w,
+            tile_h,
+            debug_dir,
+            memory_budget_mb=memory_budget_mb,
+            render_threads=render_threads,
+            max_uses=max_uses,
+            min_repeat_distance=min_repeat_distance,
+            candidates=candidates,
+            adaptive_levels=adaptive_levels,
+            split_variance=split_variance,
+            dzi_tile_size=dzi_tile_size,
+            dzi_format=dzi_format,
+            on_preview=on_preview,
+            preview_passes=preview_passes,
+        )
@@ -0,0 +1,135 @@
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+def _halve(rows: np.ndarray) -> np.ndarray:
+    """2×2 box-downsample an even number of (n, w, 3) rows; an odd last column is repeated."""
+    if rows.shape[1] % 2:
+        rows = np.concatenate([rows, rows[:, -1:]], axis=1)
+    n, w = rows.shape[0] // 2, rows.shape[1] // 2
+    quads = rows.reshape(n, 2, w, 2, 3).astype(np.uint16)
+    return ((quads.sum(axis=(1, 3)) + 2) // 4).astype(np.uint8)
+
+
+class _Level:
+    """One pyramid level: buffers just enough rows to cut its next row of tiles."""
+
+    def __init__(self, writer: "DeepZoomWriter", level: int, width: int, height: int, below: "_Level | None"):
+        self.writer, self.level, self.width, self.height = writer, level, width, height
+        self.below = below  # next coarser level, fed 2x-downsampled rows
+        self.buf = np.empty((0, width, 3), dtype=np.uint8)
+        self.buf_y0 = 0  # level row index of buf[0]
+        self.received = 0
+        self.tile_row = 0
+        self.carry = np.empty((0, width, 3), dtype=np.uint8)  # odd row waiting for its pair
+
+    def push(self, rows: np.ndarray) -> None:
+        self.received += len(rows)
+        if self.below is not None:
+            pending = np.concatenate([self.carry, rows]) if len(self.carry) else rows
+            even = len(pending) - len(pending) % 2
+            if even:
+                self.below.push(_halve(pending[:even]))
+            self.carry = pending[even:].copy()
+        self.buf = np.concatenate([self.buf, rows])
+        self._cut_tiles()
+
+    def finish(self) -> None:
+        if self.received != self.height:
+            raise ValueError(f"level {self.level} expects {self.height} rows, got {self.received}")
+        self._cut_tiles()
+        if self.below is not None:
+            if len(self.carry):  # odd height: the last row pairs with itself
+                self.below.push(_halve(np.concatenate([self.carry, self.carry])))
+            self.below.finish()
+
+    def _cut_tiles(self) -> None:
+        ts, ov = self.writer.tile_size, self.writer.overlap
+        while self.tile_row * ts < self.height:
+            top = max(0, self.tile_row * ts - ov)
+            bottom = min(self.height, (self.tile_row + 1) * ts + ov)
+            if self.buf_y0 + len(self.buf) < bottom:
+                return
+            block = self.buf[top - self.buf_y0 : bottom - self.buf_y0]
+            for col in range(math.ceil(self.width / ts)):
+                left, right = max(0, col * ts - ov), min(self.width, (col + 1) * ts + ov)
+                self.writer.save_tile(self.level, col, self.tile_row, block[:, left:right])
+            self.tile_row += 1
+            keep_from = self.tile_row * ts - ov  # the next tile row starts `overlap` rows back
+            drop = max(0, keep_from - self.buf_y0)
+            self.buf, self.buf_y0 = self.buf[drop:], self.buf_y0 + drop
+
+
+class DeepZoomWriter:
+    """
+    Stream an image into a Deep Zoom (DZI) tile pyramid without ever holding it whole.
+
+    Feed full-resolution rows top to bottom with `write_rows`. Each level keeps only the
+    rows for its current row of tiles (about tile_size + 2 * overlap) and passes 2×2
+    box-downsampled rows to the next coarser level, so every level is produced in the same
+    pass. Tiles are encoded by a thread pool, with at most 4 * threads pending.
+
+    Output: `<path>.dzi` (XML descriptor) and `<path>_files/<level>/<col>_<row>.<format>`.
+    """
+
+    def __init__(
+        self, path: Path, width: int, height: int, tile_size: int = 254, overlap: int = 1, fmt: str = "jpg", threads=4
+    ):
+        self.path = Path(path).with_suffix(".dzi")
+        self.files_dir = self.path.with_name(self.path.stem + "_files")
+        self.width, self.height = width, height
+        self.tile_size, self.overlap, self.fmt = tile_size, overlap, fmt
+        self.threads = threads
+        self.max_level = math.ceil(math.log2(max(width, height, 1)))
+        below = None
+        for level in range(self.max_level + 1):
+            scale = 2 ** (self.max_level - level)
+            below = _Level(self, level, math.ceil(width / scale), math.ceil(height / scale), below)
+        self._top = below
+        self._pool: ThreadPoolExecutor | None = None
+        self._pending: list[Future] = []
+        self.tiles_written = 0
+
+    def __enter__(self) -> "DeepZoomWriter":
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self._top.finish()
+                self._drain(0)
+                self._write_descriptor()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """Append an (n, width, 3) uint8 strip of full-resolution rows."""
+        if rows.shape[1:] != (self.width, 3):
+            raise ValueError(f"expected rows of shape (n, {self.width}, 3), got {rows.shape}")
+        self._top.push(np.asarray(rows, dtype=np.uint8))
+
+    def save_tile(self, level: int, col: int, row: int, pixels: np.ndarray) -> None:
+        out = self.files_dir / str(level) / f"{col}_{row}.{self.fmt}"
+        if col == 0 and row == 0:
+            out.parent.mkdir(parents=True, exist_ok=True)
+        self._drain(4 * self.threads)
+        self._pending.append(self._pool.submit(Image.fromarray(pixels.copy()).save, out))
+        self.tiles_written += 1
+
+    def _drain(self, limit: int) -> None:
+        while len(self._pending) > limit:
+            self._pending.pop(0).result()
+
+    def _write_descriptor(self) -> None:
+        self.path.write_text(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{self.tile_size}" '
+            f'Overlap="{self.overlap}" Format="{self.fmt}">\n'
+            f'  <Size Width="{self.width}" Height="{self.height}"/>\n'
+            "</Image>\n"
+        )
@@ -0,0 +1,42 @@
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+_HASH_CHUNK = 1 << 20
+
+
+@dataclass(frozen=True)
+class FileFingerprint:
+    """Cheap change detector for a source photo: stat data plus an optional content hash."""
+
+    size: int
+    mtime_ns: int
+    content_hash: str | None = None
+
+
+def content_hash(path: Path) -> str:
+    """BLAKE2b-128 of the file bytes; much cheaper than decoding the image."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_fingerprint(path: Path, with_hash: bool = False) -> FileFingerprint:
+    st = path.stat()
+    return FileFingerprint(st.st_size, st.st_mtime_ns, content_hash(path) if with_hash else None)
+
+
+def is_unchanged(path: Path, current: FileFingerprint, stored: FileFingerprint, with_hash: bool = False) -> bool:
+    """
+    Compare a file against its catalog fingerprint without decoding it.
+
+    Equal size and mtime means unchanged. If only the mtime moved (copies, touch) and
+    hashing is enabled, the content hash decides.
+    """
+    if current.size != stored.size:
+        return False
+    if current.mtime_ns == stored.mtime_ns:
+        return True
+    return with_hash and stored.content_hash is not None and content_hash(path) == stored.content_hash
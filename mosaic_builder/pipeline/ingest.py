@@ -1,3 +1,8 @@
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import partial
 from pathlib import Path
 
 import numpy as np
@@ -12,33 +17,300 @@ from rich.progress import (
     TimeElapsedColumn,
     TimeRemainingColumn,
 )
-from skimage.color import rgb2lab
 
+from mosaic_builder.pipeline.atlas import PatchAtlas, claim_atlas_dir, grid_patches
+from mosaic_builder.pipeline.fingerprint import FileFingerprint, file_fingerprint, is_unchanged
+from mosaic_builder.pipeline.tiling import image_to_lab, multi_tile_vectors
 from mosaic_builder.stores.factory import open_store
+from mosaic_builder.stores.sql_store import PhotoRecord
 
 
 def avg_lab_from_patch(pil_img):
-    arr = np.asarray(pil_img.convert("RGB"), dtype=np.float32) / 255.0
-    lab = rgb2lab(arr)
-    return lab.reshape(-1, 3).mean(axis=0)
+    return image_to_lab(pil_img).reshape(-1, 3).mean(axis=0, dtype=np.float64)
+
+
+TileSize = tuple[int, int]  # (tile_w, tile_h)
+
+
+@dataclass
+class TiledPhoto:
+    """Compact per-photo result handed from a tiling worker to the writer."""
+
+    path: Path
+    width: int
+    height: int
+    grids: dict[TileSize, np.ndarray]  # (tile_w, tile_h) -> (rows, cols, D) float32 tile vectors
+    fingerprint: FileFingerprint
+    decode_scale: int = 1  # grids were computed from a 1/decode_scale decode
+    layout_k: int = 1  # D = 3 * layout_k**2; 1 = mean Lab only
+    patches: dict[tuple[TileSize, int], np.ndarray] = field(default_factory=dict)  # (size, px) -> uint8 patches
+    replace_tiles: bool = False  # drop existing tiles first (--reingest or the file changed)
+
+
+@dataclass
+class _Job:
+    path: Path
+    sizes: list[TileSize]
+    replace_tiles: bool
+
+
+_DRAFT_SCALES = (8, 4, 2)  # JPEG DCT scaling factors
+
+
+def decode_scale(sizes: list[TileSize], min_source_px: int, layout_k: int = 1) -> int:
+    """
+    Largest JPEG draft scale that still leaves at least `min_source_px` decoded pixels
+    per tile side for every requested size (1 = full resolution, also when disabled).
+
+    The scale must divide every tile side (and leave sides divisible by `layout_k`) so
+    reduced tiles and their sub-blocks map exactly onto full-resolution ones.
+    """
+    if min_source_px <= 0:
+        return 1
+    step = {scale: scale * layout_k for scale in _DRAFT_SCALES}
+    for scale in _DRAFT_SCALES:
+        if all(
+            tw % step[scale] == 0 and th % step[scale] == 0 and min(tw, th) // scale >= min_source_px
+            for tw, th in sizes
+        ):
+            return scale
+    return 1
+
+
+def _decode(path: Path, scale: int) -> tuple[PILImage.Image, int, int]:
+    """
+    Decode at 1/scale resolution. Returns the EXIF-transposed image and the
+    full-resolution (width, height) in the same orientation.
+
+    JPEGs are downscaled in the DCT domain via `draft`, so the full-size image is never
+    materialized; other formats are decoded fully and box-reduced.
+    """
+    im = PILImage.open(path)
+    full_w, full_h = im.size
+    if scale > 1:
+        im.draft("RGB", (full_w // scale, full_h // scale))
+        # draft may pick a smaller scale (or none, for non-JPEGs); box-reduce the remainder
+        drafted = next((a for a in _DRAFT_SCALES if im.size == (-(-full_w // a), -(-full_h // a))), 1)
+        if scale // drafted > 1:
+            im = im.convert("RGB").reduce(scale // drafted)
+    oriented = ImageOps.exif_transpose(im.convert("RGB"))
+    if oriented.size != im.size:
+        full_w, full_h = full_h, full_w
+    return oriented, full_w, full_h
+
+
+def tile_photo(
+    path: Path,
+    sizes: list[TileSize],
+    debug_dir: Path | None = None,
+    with_hash: bool = False,
+    min_source_px: int = 0,
+    layout_k: int = 1,
+    atlas_px: tuple[int, ...] = (),
+) -> TiledPhoto:
+    """
+    Decode, EXIF-transpose and tile one photo at every requested size.
+
+    The photo is decoded and converted to Lab once; all grid sizes are reduced from
+    that single conversion. With `min_source_px`, the decode happens at the smallest
+    JPEG scale that keeps that many pixels per tile side; grids are still reported in
+    full-resolution tile sizes and cols/rows. With `layout_k` > 1 each tile vector is
+    its k×k sub-block Lab layout instead of a single mean. For each `atlas_px`, the
+    tiles' pixels are also resampled to px×px patches for the render atlas. Top-level so
+    it can run in a worker process.
+    """
+    # Stat before decoding so a file modified mid-ingest is seen as changed next run
+    fingerprint = file_fingerprint(path, with_hash)
+    scale = decode_scale(sizes, min_source_px, layout_k)
+    im, w, h = _decode(path, scale)
+
+    reduced_sizes = [(tw // scale, th // scale) for tw, th in sizes]
+    vectors_by_size = multi_tile_vectors(image_to_lab(im), reduced_sizes, layout_k)
+    grids = {}
+    patches = {}
+    for tile_w, tile_h in sizes:
+        # Ceil-rounded reduced edges can complete one extra tile; keep the full-resolution grid shape
+        vectors = vectors_by_size[(tile_w // scale, tile_h // scale)][: h // tile_h, : w // tile_w]
+        grids[(tile_w, tile_h)] = vectors.astype(np.float32)
+        rows, cols = vectors.shape[:2]
+        if cols and rows:
+            for px in atlas_px:
+                patches[((tile_w, tile_h), px)] = grid_patches(im, tile_w // scale, tile_h // scale, cols, rows, px)
+        if debug_dir and cols and rows:
+            thumbs = im.crop((0, 0, cols * tile_w // scale, rows * tile_h // scale))
+            thumbs.save((debug_dir / f"{path.stem}_tiles_{tile_w}x{tile_h}.jpg"))
+    return TiledPhoto(path, w, h, grids, fingerprint, scale, layout_k, patches)
+
+
+def _iter_tiled(todo: list[_Job], work: Callable[..., TiledPhoto], workers: int) -> Iterator[TiledPhoto]:
+    """
+    Yield `work(path, sizes)` results in input order.
+
+    With workers > 1, photos are tiled in a process pool. At most `2 * workers`
+    results are in flight at once, so a slow writer throttles the workers instead
+    of letting finished grids pile up in memory.
+    """
+    if workers <= 1:
+        for job in todo:
+            yield replace(work(job.path, job.sizes), replace_tiles=job.replace_tiles)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque[tuple[_Job, Future[TiledPhoto]]] = deque()
+        for job in todo:
+            pending.append((job, pool.submit(work, job.path, job.sizes)))
+            if len(pending) >= 2 * workers:
+                job, fut = pending.popleft()
+                yield replace(fut.result(), replace_tiles=job.replace_tiles)
+        while pending:
+            job, fut = pending.popleft()
+            yield replace(fut.result(), replace_tiles=job.replace_tiles)
+
+
+def _store_tiled(store, tiled: TiledPhoto, atlas_dir: Path | None = None) -> int | None:
+    """
+    Write one tiled photo through the single store connection: one `upsert_grid` and
+    one `insert_tiles` batch per size, plus the patches of each new grid to its atlas.
+    Returns tiles inserted, None if every grid was skipped.
+    """
+    fp = tiled.fingerprint
+    photo_id = store.upsert_photo(tiled.path, tiled.width, tiled.height, fp.size, fp.mtime_ns, fp.content_hash)
+    added = None
+    for (tile_w, tile_h), vectors in tiled.grids.items():
+        rows, cols = vectors.shape[:2]
+        grid_id = store.upsert_grid(photo_id, tile_w, tile_h, cols, rows, tiled.decode_scale, tiled.layout_k)
+
+        # Skip or force reingest per grid
+        if store.has_tiles_for_grid(grid_id) and not tiled.replace_tiles:
+            continue
+        if tiled.replace_tiles:
+            store.delete_tiles_for_grid(grid_id)
+
+        if vectors.size:
+            store.insert_tiles(grid_id, vectors)
+            if atlas_dir:
+                tile_ids = store.tile_ids_for_grid(grid_id, cols, rows)
+                if not tile_ids.all():  # patches filed under id 0 would never be found at render time
+                    raise RuntimeError(
+                        f"{tiled.path}: the store returned no id for {int((tile_ids == 0).sum())} of its "
+                        f"{tile_w}x{tile_h} tiles; not writing them to the atlas"
+                    )
+                for ((tw, th), px), block in tiled.patches.items():
+                    if (tw, th) == (tile_w, tile_h):
+                        PatchAtlas(atlas_dir, tw, th, px).append(tile_ids.ravel(), block.reshape(-1, px, px, 3))
+        added = (added or 0) + cols * rows
+    return added
+
+
+def _plan(
+    catalog: dict[str, PhotoRecord],
+    images: list[Path],
+    sizes: list[TileSize],
+    reingest: bool,
+    with_hash: bool,
+    layout_k: int = 1,
+) -> tuple[list[_Job], list[tuple[str, int, int, str | None]]]:
+    """
+    Decide, from stat data and the catalog alone, which photos need decoding.
+
+    Returns the jobs to run and fingerprint rows to record for photos that are
+    skipped but had no (or a stale mtime-only) fingerprint.
+    """
+    todo: list[_Job] = []
+    backfill: list[tuple[str, int, int, str | None]] = []
+    for p in images:
+        rec = catalog.get(str(p))
+        if rec is None:
+            todo.append(_Job(p, sizes, replace_tiles=False))
+            continue
+        if reingest:
+            todo.append(_Job(p, sizes, replace_tiles=True))
+            continue
+
+        current = file_fingerprint(p)
+        if rec.file_size is None:
+            # Catalogued before fingerprints existed: trust it and record one now
+            unchanged = True
+        else:
+            stored = FileFingerprint(rec.file_size, rec.mtime_ns, rec.content_hash)
+            unchanged = is_unchanged(p, current, stored, with_hash)
+
+        if not unchanged:
+            # Re-tile every size the photo had, not just the requested ones, so no stale grid survives
+            todo.append(_Job(p, list(dict.fromkeys([*sizes, *sorted(rec.tiled_grids)])), replace_tiles=True))
+            continue
+        if current.mtime_ns != rec.mtime_ns:
+            backfill.append((str(p), current.size, current.mtime_ns, None))
+        missing = [size for size in sizes if rec.tiled_grids.get(size) != layout_k]
+        if missing:
+            # A grid tiled with a different layout_k is replaced rather than skipped
+            relayout = any(size in rec.tiled_grids for size in missing)
+            todo.append(_Job(p, missing, replace_tiles=relayout))
+    return todo, backfill
 
 
 def ingest_dir(
-    store_url: str, images_dir: Path, tile_w=24, tile_h=24, debug_dir: Path | None = None, reingest: bool = False
+    store_url: str,
+    images_dir: Path,
+    tile_w=24,
+    tile_h=24,
+    debug_dir: Path | None = None,
+    reingest: bool = False,
+    workers: int = 0,
+    tile_sizes: list[TileSize] | None = None,
+    hash_content: bool = False,
+    min_source_px: int = 0,
+    layout_k: int = 1,
+    atlas_dir: Path | None = None,
+    atlas_px: list[int] | None = None,
+    batch_photos: int = 256,
 ):
+    """
+    Ingest every image under `images_dir` into the store.
+
+    `tile_sizes` requests several grids per photo in one pass (each photo is decoded
+    once); when omitted, the single `tile_w`×`tile_h` grid is built.
+
+    Photos are matched against the store's fingerprint catalog before decoding:
+    unchanged, fully tiled files are skipped; changed files are re-tiled at every
+    size they had plus the requested ones. `hash_content` also records a content
+    hash, so files whose mtime moved but bytes did not are still skipped.
+
+    `min_source_px` > 0 enables reduced-resolution JPEG decoding (see `decode_scale`).
+    `layout_k` > 1 stores a k×k sub-block Lab layout per tile alongside its mean.
+    `atlas_dir` writes every new tile's pixels into packed per-size atlases at each
+    `atlas_px` resolution (default: the tile size itself) so rendering never has to
+    reopen the source photos.
+
+    Writes go through `SqlTileStore.bulk_load`: tiles of `batch_photos` photos are
+    written as one batch and committed as one transaction.
+    """
+    sizes = list(dict.fromkeys(tile_sizes or [(tile_w, tile_h)]))
+    if layout_k < 1 or any(tw % layout_k or th % layout_k for tw, th in sizes):
+        raise ValueError(f"tile sizes must be divisible by layout_k={layout_k}")
     images = [p for p in sorted(images_dir.rglob("*")) if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}]
     if not images:
         print(f"No images found under {images_dir}")
         return
 
+    # Atlas patches must not be upsampled from a reduced decode
+    patch_px = tuple(atlas_px or sorted({min(size) for size in sizes})) if atlas_dir else ()
+    if min_source_px > 0 and patch_px:
+        min_source_px = max(min_source_px, *patch_px)
+
     store = open_store(store_url)
     store.ensure_schema()
+    if atlas_dir:
+        claim_atlas_dir(atlas_dir, store.tile_snapshot()["generation"])
     if debug_dir:
         debug_dir.mkdir(parents=True, exist_ok=True)
 
     photos_total = 0
     tiles_total = 0
 
+    todo, backfill = _plan(store.photo_catalog(), images, sizes, reingest, hash_content, layout_k)
+    store.update_fingerprints(backfill)
+
     with Progress(
         SpinnerColumn(),
         TextColumn("[bold]{task.description}[/bold]"),
@@ -50,44 +322,32 @@ def ingest_dir(
         TimeRemainingColumn(),
     ) as progress:
         files_task = progress.add_task("Photos", total=len(images))
-        for p in images:
-            im = ImageOps.exif_transpose(PILImage.open(p).convert("RGB"))
-            w, h = im.size
-            photo_id = store.upsert_photo(p, w, h)
-
-            cols, rows = w // tile_w, h // tile_h
-            grid_id = store.upsert_grid(photo_id, tile_w, tile_h, cols, rows)
-
-            # Skip or force reingest per grid
-            if store.has_tiles_for_grid(grid_id) and not reingest:
-                progress.update(files_task, advance=1, description="Photos (skipping)")
-                continue
-            if reingest:
-                store.delete_tiles_for_grid(grid_id)
-
-            total_tiles = cols * rows
-            per_file = progress.add_task(f"Tiling {p.name} ({cols}×{rows})", total=total_tiles)
-
-            rows_to_insert: list[tuple[int, int, float, float, float]] = []
-            thumbs = PILImage.new("RGB", (cols * tile_w, rows * tile_h)) if (debug_dir and cols and rows) else None
-
-            for y in range(rows):
-                for x in range(cols):
-                    box = (x * tile_w, y * tile_h, (x + 1) * tile_w, (y + 1) * tile_h)
-                    patch = im.crop(box)
-                    L, A, B = avg_lab_from_patch(patch)
-                    rows_to_insert.append((x, y, float(L), float(A), float(B)))
-                    if thumbs:
-                        thumbs.paste(patch.resize((tile_w, tile_h)), (x * tile_w, y * tile_h))
-                    progress.update(per_file, advance=1)
-
-            if rows_to_insert:
-                store.insert_tiles(grid_id, rows_to_insert)
-
-            progress.update(files_task, advance=1)
-            progress.remove_task(per_file)
-            if thumbs:
-                thumbs.save((debug_dir / f"{p.stem}_tiles_{tile_w}x{tile_h}.jpg"))
+        if len(todo) < len(images):
+            progress.update(files_task, advance=len(images) - len(todo), description="Photos (skipping)")
+
+        work = partial(
+            tile_photo,
+            debug_dir=debug_dir,
+            with_hash=hash_content,
+            min_source_px=min_source_px,
+            layout_k=layout_k,
+            atlas_px=patch_px,
+        )
+        # Atlas writes look tile ids up per grid, which needs the grid index during the load
+        with store.bulk_load(defer_indexes=atlas_dir is None) as write_stats:
+            for i, tiled in enumerate(_iter_tiled(todo, work, workers), start=1):
+                added = _store_tiled(store, tiled, atlas_dir)
+                if added is not None:
+                    photos_total += 1
+                    tiles_total += added
+                    progress.update(files_task, advance=1, description="Photos")
+                else:
+                    progress.update(files_task, advance=1, description="Photos (skipping)")
+                if i % batch_photos == 0:
+                    store.flush()
 
     store.close()
-    print(f"[mosaic-builder] Ingest complete: {photos_total} new photos, {tiles_total} tiles added.")
+    print(
+        f"[mosaic-builder] Ingest complete: {photos_total} new photos, {tiles_total} tiles added "
+        f"({write_stats.rows_per_sec:,.0f} tile rows/s written)."
+    )
@@ -0,0 +1,74 @@
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class PngStripWriter:
+    """
+    Write an RGB PNG a strip of rows at a time, so the full image never has to be in memory.
+
+    Rows use the PNG "Sub" filter and are deflated incrementally; compressed output is
+    flushed as IDAT chunks of about `chunk_bytes`. Use as a context manager: leaving the
+    block without writing all `height` rows raises.
+    """
+
+    def __init__(self, path: Path, width: int, height: int, level: int = 6, chunk_bytes: int = 1 << 20):
+        self.path, self.width, self.height = Path(path), width, height
+        self.chunk_bytes = chunk_bytes
+        self.rows_written = 0
+        self._zlib = zlib.compressobj(level)
+        self._pending: list[bytes] = []
+        self._pending_bytes = 0
+        self._f = None
+
+    def __enter__(self) -> "PngStripWriter":
+        self._f = open(self.path, "wb")
+        self._f.write(_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0))
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                if self.rows_written != self.height:
+                    raise ValueError(f"PNG expects {self.height} rows, got {self.rows_written}")
+                self._emit(self._zlib.flush())
+                self._flush_idat()
+                self._chunk(b"IEND", b"")
+        finally:
+            self._f.close()
+
+    def _chunk(self, tag: bytes, data: bytes) -> None:
+        self._f.write(struct.pack(">I", len(data)) + tag + data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+        if self._pending_bytes >= self.chunk_bytes:
+            self._flush_idat()
+
+    def _flush_idat(self) -> None:
+        if self._pending:
+            self._chunk(b"IDAT", b"".join(self._pending))
+            self._pending, self._pending_bytes = [], 0
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """Append an (n, width, 3) uint8 strip."""
+        rows = np.asarray(rows, dtype=np.uint8)
+        if rows.shape[1:] != (self.width, 3):
+            raise ValueError(f"expected rows of shape (n, {self.width}, 3), got {rows.shape}")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError(f"PNG has only {self.height} rows")
+        filtered = np.empty((len(rows), 1 + self.width * 3), dtype=np.uint8)
+        filtered[:, 0] = 1  # Sub: each byte minus the same channel of the pixel to its left
+        flat = rows.reshape(len(rows), -1)
+        filtered[:, 1:4] = flat[:, :3]
+        np.subtract(flat[:, 3:], flat[:, :-3], out=filtered[:, 4:])
+        self._emit(self._zlib.compress(filtered.tobytes()))
+        self.rows_written += len(rows)
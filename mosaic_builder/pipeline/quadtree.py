@@ -0,0 +1,142 @@
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.index.base import SearchIndex, VectorIndex
+from mosaic_builder.index.fallback import with_exact_fallback
+from mosaic_builder.index.kdtree import KDTreeIndex
+from mosaic_builder.pipeline.tiling import image_to_lab, lab_block_integral
+
+
+@dataclass
+class QuadCells:
+    """Leaves of an adaptive layout: square cells of varying size covering the output."""
+
+    boxes: np.ndarray  # (n, 4) int64 (x, y, w, h) in output pixels
+    means: np.ndarray  # (n, 3) mean Lab of each cell
+    width: int
+    height: int
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return self.boxes[:, 2]
+
+
+def quadtree_cells(img: Image.Image, tile_px: int, levels: int, split_variance: float, samples: int = 4) -> QuadCells:
+    """
+    Split the target into square cells of tile_px * 2^n pixels (n < levels), largest first.
+
+    The target is divided into a grid of the largest cells, and any cell whose Lab variance
+    (mean over L, a, b, in Lab units²) exceeds `split_variance` is split into four, down to
+    `tile_px`. Statistics come from summed-area tables of the target resampled to `samples`²
+    pixels per finest cell, so each cell costs four lookups at any level. Partial cells on the
+    right/bottom edges are dropped, as for the fixed grid.
+    """
+    max_px = tile_px << (levels - 1)
+    per_top = 1 << (levels - 1)  # finest cells along one side of a top cell
+    top_cols, top_rows = img.width // max_px, img.height // max_px
+    small = img.crop((0, 0, top_cols * max_px, top_rows * max_px)).resize(
+        (top_cols * per_top * samples, top_rows * per_top * samples), Image.Resampling.LANCZOS
+    )
+    lab = image_to_lab(small).astype(np.float64)
+    sat = lab_block_integral(lab, samples, samples)
+    sat_sq = lab_block_integral(lab * lab, samples, samples)
+
+    def stats(fy: np.ndarray, fx: np.ndarray, side: int) -> tuple[np.ndarray, np.ndarray]:
+        def box_sum(table):
+            return table[fy + side, fx + side] - table[fy, fx + side] - table[fy + side, fx] + table[fy, fx]
+
+        count = (side * samples) ** 2
+        mean = box_sum(sat) / count
+        var = (box_sum(sat_sq) / count - mean * mean).mean(axis=1)
+        return mean, var
+
+    # cells are tracked by their top-left corner in finest-cell units
+    fy, fx = (a.ravel() * per_top for a in np.mgrid[0:top_rows, 0:top_cols])
+    boxes, means = [], []
+    for level in range(levels):
+        side = per_top >> level
+        mean, var = stats(fy, fx, side)
+        leaf = (var <= split_variance) | (level == levels - 1)
+        px = side * tile_px
+        boxes.append(
+            np.stack([fx[leaf] * tile_px, fy[leaf] * tile_px, np.full(leaf.sum(), px), np.full(leaf.sum(), px)], 1)
+        )
+        means.append(mean[leaf])
+        half = side // 2
+        fy, fx = fy[~leaf], fx[~leaf]
+        fy = np.concatenate([fy, fy, fy + half, fy + half])
+        fx = np.concatenate([fx, fx + half, fx, fx + half])
+
+    return QuadCells(
+        boxes=np.concatenate(boxes).astype(np.int64),
+        means=np.concatenate(means).astype(np.float32),
+        width=top_cols * max_px,
+        height=top_rows * max_px,
+    )
+
+
+class SizeIndexes:
+    """
+    Per-size indexes for adaptive builds: for each tile size, an index over only the tiles
+    cut at that size. Each is built on first use with `make_index` (the session's backend)
+    and kept, so later builds reuse it. Backends that cannot index a size's few tiles
+    (e.g. an IVF factory with more lists than vectors) fall back to an exact KD-tree.
+    """
+
+    def __init__(
+        self,
+        vecs: np.ndarray,
+        tile_sizes: np.ndarray | None,
+        live: np.ndarray | None = None,
+        make_index: Callable[[], VectorIndex] = KDTreeIndex,
+    ):
+        self.vecs = vecs
+        self.tile_sizes = np.asarray(tile_sizes) if tile_sizes is not None else None
+        self.live = live
+        self.make_index = make_index
+        self._built: dict[int, tuple[SearchIndex, np.ndarray] | None] = {}
+        self._lock = threading.Lock()
+
+    def get(self, size: int) -> tuple[SearchIndex, np.ndarray] | None:
+        """(index, positions it covers) for tiles of `size` px, or None when there are none."""
+        with self._lock:  # concurrent builds wait for the first to build a size
+            if size not in self._built:
+                self._built[size] = self._build(size)
+            return self._built[size]
+
+    def _build(self, size: int) -> tuple[SearchIndex, np.ndarray] | None:
+        if self.tile_sizes is None:
+            return None
+        sel = np.flatnonzero((self.tile_sizes == size).all(axis=1) & (True if self.live is None else self.live))
+        if not len(sel):
+            return None
+        vecs = np.ascontiguousarray(self.vecs[sel], dtype=np.float32)
+        index = self.make_index()
+        try:
+            index.build(vecs)
+        except (RuntimeError, ValueError) as e:
+            print(f"[mosaic-builder] {size}px tiles: {e}; searching them with a KD-tree")
+            index = KDTreeIndex()
+            index.build(vecs)
+        return with_exact_fallback(index, vecs), sel
+
+
+def match_by_size(cells: QuadCells, full_index: SearchIndex, size_indexes: SizeIndexes | None = None) -> np.ndarray:
+    """
+    Nearest index position for each cell, searching only tiles cut at the cell's size
+    (`size_indexes`). Sizes with no such tiles, or no `size_indexes`, use the full index.
+    """
+    out = np.empty(len(cells.boxes), dtype=np.int64)
+    for size in np.unique(cells.sizes):
+        mask = cells.sizes == size
+        found = size_indexes.get(int(size)) if size_indexes is not None else None
+        if found is not None:
+            sub, sel = found
+            out[mask] = sel[sub.batch_query(cells.means[mask], k=1)[0][:, 0]]
+        else:
+            out[mask] = full_index.batch_query(cells.means[mask], k=1)[0][:, 0]
+    return out
@@ -0,0 +1,191 @@
+import math
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from mosaic_builder.pipeline.atlas import AtlasSet
+
+PatchInfo = tuple[str, int, int, int, int]  # (photo_path, x, y, tile_w, tile_h)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ImageCache:
+    """
+    Thread-safe LRU of decoded source photos (RGB, EXIF-transposed), bounded by decoded
+    bytes. The most recent image is always kept, even if it alone exceeds the budget.
+    """
+
+    def __init__(self, max_bytes: int = 512 << 20):
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._images: OrderedDict[str, Image.Image] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Image.Image:
+        with self._lock:
+            im = self._images.get(path)
+            if im is not None:
+                self._images.move_to_end(path)
+                self.stats.hits += 1
+                return im
+            self.stats.misses += 1
+        im = ImageOps.exif_transpose(Image.open(path).convert("RGB"))
+        with self._lock:
+            if path not in self._images:
+                self._images[path] = im
+                self._bytes += im.width * im.height * 3
+            while len(self._images) > 1 and self._bytes > self.max_bytes:
+                _, old = self._images.popitem(last=False)
+                self._bytes -= old.width * old.height * 3
+        return im
+
+
+def _resize(patch: Image.Image, w: int, h: int) -> np.ndarray:
+    return np.asarray(patch.resize((w, h), Image.Resampling.LANCZOS))
+
+
+def grid_boxes(rows: int, cols: int, tile_w: int, tile_h: int) -> np.ndarray:
+    """(rows*cols, 4) row-major (x, y, w, h) pixel boxes of a uniform cell grid."""
+    ys, xs = np.divmod(np.arange(rows * cols), cols)
+    return np.stack([xs * tile_w, ys * tile_h, np.full_like(xs, tile_w), np.full_like(xs, tile_h)], axis=1)
+
+
+def fill_boxes(colors: np.ndarray, boxes: np.ndarray, out: np.ndarray) -> None:
+    """Flat-fill each (x, y, w, h) box of `out` with its uint8 RGB color, vectorized per box size."""
+    sizes = boxes[:, 2:4]
+    for w, h in np.unique(sizes, axis=0).tolist():
+        sel = np.flatnonzero((sizes[:, 0] == w) & (sizes[:, 1] == h))
+        ys = boxes[sel, 1, None] + np.arange(h)
+        xs = boxes[sel, 0, None] + np.arange(w)
+        out[ys[:, :, None], xs[:, None, :]] = colors[sel, None, None, :]
+
+
+def band_rows_for_budget(cols: int, tile_w: int, tile_h: int, budget_bytes: int) -> int:
+    """Cell rows per render band so one band's RGB pixels fit in `budget_bytes` (at least one row)."""
+    return max(1, budget_bytes // (cols * tile_w * tile_h * 3))
+
+
+class PatchRenderer:
+    """
+    Composites chosen tiles into output pixels. Cells are grouped by source photo so each
+    photo is decoded once per call (and reused across calls through the image cache), and
+    each distinct tile is resized once. Atlas patches, when available, skip decoding entirely.
+
+    With `threads` > 1, each render is split into runs of cells composited by a thread
+    pool into disjoint slices of the output; Pillow releases the GIL while decoding and
+    resampling, and the result is identical to the serial path.
+    """
+
+    def __init__(
+        self,
+        infos: dict[int, PatchInfo],
+        tile_w: int,
+        tile_h: int,
+        atlases: AtlasSet | None = None,
+        cache: ImageCache | None = None,
+        threads: int = 1,
+    ):
+        self.infos = infos
+        self.threads = max(1, threads)
+        self.tile_w, self.tile_h = tile_w, tile_h
+        self.atlases = atlases
+        self.cache = cache or ImageCache()
+
+    def render(self, cell_ids: np.ndarray, out: np.ndarray) -> None:
+        """
+        Paste the tiles of a (rows, cols) block of tile ids into `out`, a uint8
+        (rows * tile_h, cols * tile_w, 3) view of the output.
+        """
+        rows, cols = cell_ids.shape
+        self.render_placements(cell_ids.ravel(), grid_boxes(rows, cols, self.tile_w, self.tile_h), out)
+
+    def render_placements(self, tile_ids: np.ndarray, boxes: np.ndarray, out: np.ndarray) -> None:
+        """
+        Paste tiles into arbitrary non-overlapping boxes of `out`: `boxes` is (n, 4) of
+        (x, y, w, h) in `out` pixels, one per entry of `tile_ids`. Boxes are listed in row-major
+        order by grid renders, so the threaded split below hands out runs of cell rows.
+        """
+        n = len(tile_ids)
+        if self.threads == 1 or n < 2:
+            self._paste(tile_ids, boxes, out)
+            return
+        # two runs per thread evens out photo-heavy rows without splitting photo groups too finely
+        step = math.ceil(n / (2 * self.threads))
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            futures = [
+                pool.submit(self._paste, tile_ids[i : i + step], boxes[i : i + step], out) for i in range(0, n, step)
+            ]
+            for f in futures:
+                f.result()
+
+    def _paste(self, tile_ids: np.ndarray, boxes: np.ndarray, out: np.ndarray) -> None:
+        patches: dict[tuple[int, int, int], np.ndarray] = {}  # (tile_id, w, h) -> resized patch
+        by_source: dict[str, list[tuple[int, int, int, int, int]]] = defaultdict(list)
+        for tile_id, (x, y, w, h) in zip(np.asarray(tile_ids).tolist(), np.asarray(boxes).tolist()):
+            key = (tile_id, w, h)
+            if key not in patches:
+                path, _, _, src_w, src_h = self.infos[tile_id]
+                packed = self.atlases.patch(tile_id, src_w, src_h, max(w, h)) if self.atlases else None
+                if packed is None:
+                    by_source[path].append((tile_id, x, y, w, h))
+                    continue
+                patches[key] = _resize(Image.fromarray(np.asarray(packed)), w, h)
+            out[y : y + h, x : x + w] = patches[key]
+
+        for path, cells in by_source.items():
+            im = self.cache.get(path)
+            for tile_id, x, y, w, h in cells:
+                key = (tile_id, w, h)
+                if key not in patches:
+                    _, gx, gy, src_w, src_h = self.infos[tile_id]
+                    patches[key] = _resize(im.crop((gx * src_w, gy * src_h, (gx + 1) * src_w, (gy + 1) * src_h)), w, h)
+                out[y : y + h, x : x + w] = patches[key]
+
+    def iter_bands(self, cell_ids: np.ndarray, band_rows: int) -> Iterator[np.ndarray]:
+        """
+        Render a (rows, cols) grid of tile ids `band_rows` cell rows at a time, yielding each
+        band's (n * tile_h, cols * tile_w, 3) pixels. One band buffer is reused, so consume
+        (write out) each band before advancing.
+        """
+        rows, cols = cell_ids.shape
+        boxes = grid_boxes(rows, cols, self.tile_w, self.tile_h)
+        yield from self.iter_placement_bands(
+            cell_ids.ravel(), boxes, cols * self.tile_w, rows * self.tile_h, band_rows * self.tile_h
+        )
+
+    def iter_placement_bands(
+        self, tile_ids: np.ndarray, boxes: np.ndarray, width: int, height: int, band_px: int
+    ) -> Iterator[np.ndarray]:
+        """
+        `render_placements` over a (height, width) output, `band_px` pixel rows at a time.
+        No box may straddle a multiple of `band_px`. Yields a reused band buffer, as `iter_bands`.
+        """
+        band_of = boxes[:, 1] // band_px
+        order = np.argsort(band_of, kind="stable")
+        n_bands = -(-height // band_px)
+        bounds = np.searchsorted(band_of[order], np.arange(n_bands + 1))
+        buffer = np.empty((min(band_px, height), width, 3), dtype=np.uint8)
+        for b in range(n_bands):
+            y0 = b * band_px
+            sel = order[bounds[b] : bounds[b + 1]]
+            band_boxes = boxes[sel].copy()
+            band_boxes[:, 1] -= y0
+            out = buffer[: min(band_px, height - y0)]
+            self.render_placements(tile_ids[sel], band_boxes, out)
+            yield out
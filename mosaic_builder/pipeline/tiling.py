@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.color import srgb_to_lab
+
+
+def image_to_lab(im: Image.Image) -> np.ndarray:
+    """Convert a decoded image to an (H, W, 3) float32 Lab array in a single pass."""
+    return srgb_to_lab(np.asarray(im.convert("RGB")))
+
+
+def lab_tile_means(lab: np.ndarray, tile_w: int, tile_h: int) -> np.ndarray:
+    """
+    Reduce an (H, W, 3) Lab image to its (rows, cols, 3) grid of per-tile means.
+
+    Partial tiles on the right/bottom edges are dropped, matching the
+    `cols, rows = w // tile_w, h // tile_h` convention used for `grids`.
+    """
+    h, w = lab.shape[:2]
+    cols, rows = w // tile_w, h // tile_h
+    blocks = lab[: rows * tile_h, : cols * tile_w].reshape(rows, tile_h, cols, tile_w, 3)
+    return blocks.mean(axis=(1, 3), dtype=np.float64)
+
+
+def lab_block_integral(lab: np.ndarray, cell_w: int, cell_h: int) -> np.ndarray:
+    """
+    Summed-area table of an (H, W, 3) Lab image at cell_w×cell_h block granularity.
+
+    Pixels are first summed into blocks, so the table is (H/cell_h + 1, W/cell_w + 1, 3)
+    rather than per pixel. Any tile whose sides are multiples of the cell size can then
+    be summed with four lookups.
+    """
+    h, w = lab.shape[:2]
+    bw, bh = w // cell_w, h // cell_h
+    sums = lab[: bh * cell_h, : bw * cell_w].reshape(bh, cell_h, bw, cell_w, 3).sum(axis=(1, 3), dtype=np.float64)
+    sat = np.zeros((bh + 1, bw + 1, 3), dtype=np.float64)
+    np.cumsum(np.cumsum(sums, axis=0), axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def integral_tile_means(sat: np.ndarray, cell_w: int, cell_h: int, tile_w: int, tile_h: int) -> np.ndarray:
+    """(rows, cols, 3) tile means from a `lab_block_integral` table; tile sides must be cell multiples."""
+    sx, sy = tile_w // cell_w, tile_h // cell_h
+    rows, cols = (sat.shape[0] - 1) // sy, (sat.shape[1] - 1) // sx
+    corners = sat[np.ix_(np.arange(rows + 1) * sy, np.arange(cols + 1) * sx)]
+    sums = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+    return sums / (tile_w * tile_h)
+
+
+def multi_tile_means(lab: np.ndarray, sizes: list[tuple[int, int]]) -> dict[tuple[int, int], np.ndarray]:
+    """Tile-mean grids for several (tile_w, tile_h) sizes from one Lab image."""
+    if len(sizes) == 1:
+        tile_w, tile_h = sizes[0]
+        return {(tile_w, tile_h): lab_tile_means(lab, tile_w, tile_h)}
+    cell_w = math.gcd(*(tw for tw, _ in sizes))
+    cell_h = math.gcd(*(th for _, th in sizes))
+    sat = lab_block_integral(lab, cell_w, cell_h)
+    return {(tw, th): integral_tile_means(sat, cell_w, cell_h, tw, th) for tw, th in sizes}
+
+
+def tile_layouts(fine: np.ndarray, k: int) -> np.ndarray:
+    """
+    Group a (rows*k, cols*k, 3) grid of sub-block means into (rows, cols, 3*k*k) layout descriptors.
+
+    Each descriptor is the tile's k×k sub-blocks in row-major order, Lab interleaved
+    (L0, a0, b0, L1, a1, b1, ...), so sub-block 0 is the tile's top-left.
+    """
+    rows, cols = fine.shape[0] // k, fine.shape[1] // k
+    blocks = fine[: rows * k, : cols * k].reshape(rows, k, cols, k, 3).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(rows, cols, k * k * 3)
+
+
+def layout_means(layouts: np.ndarray) -> np.ndarray:
+    """Mean Lab of each tile from its layout descriptor (sub-blocks are equal-sized)."""
+    return layouts.reshape(*layouts.shape[:-1], -1, 3).mean(axis=-2)
+
+
+def multi_tile_vectors(lab: np.ndarray, sizes: list[tuple[int, int]], layout_k: int = 1) -> dict:
+    """
+    Per-size (rows, cols, D) tile vectors: mean Lab (D=3) or, for layout_k > 1, the
+    k×k layout descriptor (D=3k²). Tile sides must be divisible by layout_k.
+    """
+    if layout_k == 1:
+        return multi_tile_means(lab, sizes)
+    fine = multi_tile_means(lab, [(tw // layout_k, th // layout_k) for tw, th in sizes])
+    return {(tw, th): tile_layouts(fine[(tw // layout_k, th // layout_k)], layout_k) for tw, th in sizes}
@@ -0,0 +1,308 @@
+"""
+Long-lived local mosaic service: a small asyncio HTTP/1.1 server that keeps one
+`MosaicSession` (index, store pool, decoded-photo cache) warm between requests.
+
+    POST /mosaic?tile_px=24   body: target image  -> image/png mosaic
+    POST /match?tile_px=24    body: target image  -> JSON grid of matched tile ids
+    GET  /metrics             Prometheus text: latency histograms, match batching, cache
+    GET  /healthz
+
+CPU work (decoding, matching, rendering) runs in a thread pool so the event loop stays
+responsive, and match queries arriving within a few milliseconds of each other are
+answered by one batched index search.
+"""
+
+import asyncio
+import bisect
+import io
+import json
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from mosaic_builder.index.base import SearchIndex
+from mosaic_builder.index.index_file import SEARCH_PROCESSES
+from mosaic_builder.pipeline.build_mosaic import MosaicSession, grid_avg_lab
+from mosaic_builder.pipeline.render import ImageCache
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyHistogram:
+    """Cumulative request-latency histogram per endpoint, in Prometheus bucket layout."""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts: dict[str, list[int]] = defaultdict(lambda: [0] * (len(self.BUCKETS) + 1))
+        self.sums: dict[str, float] = defaultdict(float)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def observe(self, endpoint: str, seconds: float, ok: bool = True) -> None:
+        self.counts[endpoint][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sums[endpoint] += seconds
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def render(self) -> list[str]:
+        lines = ["# TYPE mosaic_request_seconds histogram"]
+        for endpoint, counts in sorted(self.counts.items()):
+            total = 0
+            for le, n in zip([*map(str, self.BUCKETS), "+Inf"], counts):
+                total += n
+                lines.append(f'mosaic_request_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {total}')
+            lines.append(f'mosaic_request_seconds_sum{{endpoint="{endpoint}"}} {self.sums[endpoint]:.6f}')
+            lines.append(f'mosaic_request_seconds_count{{endpoint="{endpoint}"}} {total}')
+        lines.append("# TYPE mosaic_request_errors_total counter")
+        lines += [f'mosaic_request_errors_total{{endpoint="{e}"}} {n}' for e, n in sorted(self.errors.items())]
+        return lines
+
+
+class MatchBatcher:
+    """
+    Coalesces concurrent match queries: requests arriving within `window_s` of the first
+    pending one (or until `max_rows` vectors are pending) share one `batch_query` call.
+    """
+
+    def __init__(self, index: SearchIndex, executor: ThreadPoolExecutor, window_s: float = 0.002, max_rows=1 << 16):
+        self.index, self.executor = index, executor
+        self.window_s, self.max_rows = window_s, max_rows
+        self.batches = self.requests = 0
+        self._pending: list[tuple[np.ndarray, asyncio.Future]] = []
+        self._rows = 0
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def query(self, vecs: np.ndarray) -> np.ndarray:
+        """Nearest index position for each row of `vecs`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((vecs, future))
+        self._rows += len(vecs)
+        if self._rows >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._rows = self._pending, [], 0
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: list[tuple[np.ndarray, asyncio.Future]]) -> None:
+        stacked = np.concatenate([vecs for vecs, _ in batch])
+        try:
+            idx, _ = await asyncio.get_running_loop().run_in_executor(self.executor, self.index.batch_query, stacked, 1)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.requests += len(batch)
+        offset = 0
+        for vecs, future in batch:
+            if not future.done():
+                future.set_result(idx[offset : offset + len(vecs), 0])
+            offset += len(vecs)
+
+
+class MosaicService:
+    def __init__(
+        self,
+        session: MosaicSession,
+        workers: int = 4,
+        batch_window_ms: float = 2.0,
+        max_body_mb: int = 64,
+        default_tile_px: int = 24,
+    ):
+        self.session = session
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mosaic")
+        self.batcher = MatchBatcher(session.index, self.executor, batch_window_ms / 1000)
+        self.latency = LatencyHistogram()
+        self.max_body = max_body_mb << 20
+        self.default_tile_px = default_tile_px
+        self._routes = {
+            ("GET", "/healthz"): self._healthz,
+            ("GET", "/metrics"): self._metrics,
+            ("POST", "/match"): self._match,
+            ("POST", "/mosaic"): self._mosaic,
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle, host, port)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    # -- HTTP plumbing -------------------------------------------------------------
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, bytes]:
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HttpError(400, f"malformed request line {request_line!r}") from None
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0) or 0)
+        if length > self.max_body:
+            raise HttpError(413, f"body larger than {self.max_body >> 20} MiB")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        start = time.perf_counter()
+        endpoint = "unknown"
+        try:
+            method, target, body = await self._read_request(reader)
+            url = urlsplit(target)
+            route = self._routes.get((method, url.path))
+            if route is None:
+                raise HttpError(404, f"no route for {method} {url.path}")
+            endpoint = url.path.strip("/")
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            status, content_type, payload = 200, *await route(params, body)
+        except HttpError as e:
+            status, content_type, payload = e.status, "text/plain", f"{e}\n".encode()
+        except Exception as e:
+            status, content_type, payload = 500, "text/plain", f"{type(e).__name__}: {e}\n".encode()
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode("latin-1") + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+        if endpoint != "metrics":
+            self.latency.observe(endpoint, time.perf_counter() - start, ok=status < 400)
+
+    def _int_param(self, params: dict[str, str], name: str, default: int | None, minimum: int = 0) -> int | None:
+        if name not in params:
+            return default
+        try:
+            value = int(params[name])
+        except ValueError:
+            raise HttpError(400, f"{name} must be an integer") from None
+        if value < minimum:
+            raise HttpError(400, f"{name} must be at least {minimum}")
+        return value
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # -- endpoints -----------------------------------------------------------------
+
+    async def _healthz(self, params, body) -> tuple[str, bytes]:
+        return "text/plain", b"ok\n"
+
+    async def _metrics(self, params, body) -> tuple[str, bytes]:
+        stats = self.session.cache.stats
+        lines = self.latency.render() + [
+            "# TYPE mosaic_match_batches_total counter",
+            f"mosaic_match_batches_total {self.batcher.batches}",
+            f"mosaic_match_requests_total {self.batcher.requests}",
+            "# TYPE mosaic_photo_cache_total counter",
+            f'mosaic_photo_cache_total{{result="hit"}} {stats.hits}',
+            f'mosaic_photo_cache_total{{result="miss"}} {stats.misses}',
+        ]
+        return "text/plain; version=0.0.4", ("\n".join(lines) + "\n").encode()
+
+    def _check_target(self, body: bytes, tile_px: int) -> Image.Image:
+        """The body's image, opened but not decoded, checked to hold at least one tile."""
+        try:
+            target = Image.open(io.BytesIO(body))
+        except Exception as e:
+            raise HttpError(400, f"body is not a readable image: {e}") from None
+        if min(target.size) < tile_px:  # either orientation: EXIF rotation only swaps the sides
+            raise HttpError(400, f"target {target.width}x{target.height} is smaller than one {tile_px}px tile")
+        return target
+
+    def _target_vectors(self, body: bytes, tile_px: int) -> tuple[np.ndarray, int, int]:
+        target = self._check_target(body, tile_px)
+        try:
+            target = ImageOps.exif_transpose(target.convert("RGB"))
+        except Exception as e:
+            raise HttpError(400, f"body is not a readable image: {e}") from None
+        lab, cols, rows, _ = grid_avg_lab(target, tile_px, tile_px, self.session.layout_k)
+        return lab.reshape(rows * cols, -1), rows, cols
+
+    async def _match(self, params, body) -> tuple[str, bytes]:
+        tile_px = self._int_param(params, "tile_px", self.default_tile_px, minimum=1)
+        vecs, rows, cols = await self._run(self._target_vectors, body, tile_px)
+        idx = await self.batcher.query(vecs)
+        tile_ids = self.session.ids[idx]
+        result = {"rows": rows, "cols": cols, "tile_px": tile_px, "tile_ids": tile_ids.tolist()}
+        return "application/json", json.dumps(result).encode()
+
+    def _render(self, body: bytes, options: dict) -> bytes:
+        self._check_target(body, options["tile_w"])
+        out = io.BytesIO()
+        try:
+            self.session.build(io.BytesIO(body), out, quiet=True, **options)
+        except (OSError, Image.UnidentifiedImageError) as e:
+            raise HttpError(400, f"body is not a readable image: {e}") from None
+        except ValueError as e:  # options the build rejects, e.g. an adaptive layout with repeat limits
+            raise HttpError(400, str(e)) from None
+        return out.getvalue()
+
+    async def _mosaic(self, params, body) -> tuple[str, bytes]:
+        tile_px = self._int_param(params, "tile_px", self.default_tile_px, minimum=1)
+        options = {
+            "tile_w": tile_px,
+            "tile_h": tile_px,
+            "max_uses": self._int_param(params, "max_uses", None, minimum=1),
+            "min_repeat_distance": self._int_param(params, "min_repeat_distance", 0),
+            "adaptive_levels": self._int_param(params, "adaptive_levels", 1, minimum=1),
+        }
+        return "image/png", await self._run(self._render, body, options)
+
+
+def serve(
+    store_url: str,
+    index_path: Path,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    atlas_dir: Path | None = None,
+    workers: int = 4,
+    cache_mb: int = 1024,
+    batch_window_ms: float = 2.0,
+    default_tile_px: int = 24,
+    search_processes: int = SEARCH_PROCESSES,
+) -> None:
+    """Load the session once and serve until interrupted."""
+    cache = ImageCache(max_bytes=cache_mb << 20)
+    session = MosaicSession(store_url, index_path, atlas_dir, cache, search_processes)
+    service = MosaicService(session, workers, batch_window_ms, default_tile_px=default_tile_px)
+
+    async def main() -> None:
+        server = await service.start(host, port)
+        print(f"[mosaic-builder] Serving on http://{host}:{port} ({len(session.ids):,} tiles indexed)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        session.close()
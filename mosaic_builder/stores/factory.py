@@ -4,7 +4,7 @@ from urllib.parse import urlparse
 from mosaic_builder.stores.sql_store import SqlTileStore
 
 
-def open_store(url: str):
+def open_store(url: str, check_same_thread: bool = True):
     parsed = urlparse(url)
     scheme = parsed.scheme.lower()
     path = Path(parsed.path.lstrip("/")) or Path("mosaic.db")
@@ -12,7 +12,7 @@ def open_store(url: str):
     if scheme == "sqlite":
         import sqlite3
 
-        conn = sqlite3.connect(path)
+        conn = sqlite3.connect(path, check_same_thread=check_same_thread)
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
         return SqlTileStore(conn, engine="sqlite")
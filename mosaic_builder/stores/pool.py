@@ -0,0 +1,33 @@
+import threading
+
+from mosaic_builder.stores.factory import open_store
+from mosaic_builder.stores.sql_store import SqlTileStore
+
+
+class StorePool:
+    """
+    One store connection per thread, opened on first use. sqlite3 connections may not be
+    shared across threads, and DuckDB serializes work on a single connection, so concurrent
+    readers each get their own. `close` may run on any thread once the users are done.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._local = threading.local()
+        self._all: list[SqlTileStore] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> SqlTileStore:
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = self._local.store = open_store(self.url, check_same_thread=False)
+            with self._lock:
+                self._all.append(store)
+        return store
+
+    def close(self) -> None:
+        with self._lock:
+            stores, self._all = self._all, []
+        for store in stores:
+            store.close()
+        self._local = threading.local()
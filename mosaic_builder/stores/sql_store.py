@@ -1,17 +1,91 @@
 from __future__ import annotations
 
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import numpy as np
 
 
+@dataclass
+class PhotoRecord:
+    """Catalog entry for one photo: stored fingerprint (None for legacy rows) and grids that have tiles."""
+
+    file_size: int | None
+    mtime_ns: int | None
+    content_hash: str | None
+    tiled_grids: dict[tuple[int, int], int] = field(default_factory=dict)  # (tile_w, tile_h) -> layout_k
+
+
+@dataclass
+class BulkLoadStats:
+    rows: int = 0
+    seconds: float = 0.0  # time spent writing tiles and committing
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class _BulkState:
+    deferred_indexes: bool
+    stats: BulkLoadStats = field(default_factory=BulkLoadStats)
+    pending: list[dict] = field(default_factory=list)
+    pending_grids: set[int] = field(default_factory=set)
+    loaded_grids: set[int] = field(default_factory=set)
+
+    def add(self, grid_id: int, columns: dict) -> None:
+        self.pending.append(columns)
+        self.pending_grids.add(grid_id)
+
+    def discard(self, grid_id: int) -> None:
+        self.pending = [c for c in self.pending if int(c["grid_id"][0]) != grid_id]
+        self.pending_grids.discard(grid_id)
+
+
+_TILE_INDEXES = ("tiles_grid_id_idx", "tiles_grid_xy_unique")
+
+
+def _sqlite_version() -> tuple[int, ...]:
+    import sqlite3
+
+    return sqlite3.sqlite_version_info
+
+
+def _columnar_batch(columns: dict[str, np.ndarray | list]):
+    """Arrow table (or pandas DataFrame) over the column arrays for DuckDB to scan; None if neither is installed."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        pa = None
+    if pa is not None:
+        return pa.table(
+            {
+                name: pa.array(col, type=pa.binary()) if name == "layout" else pa.array(col)
+                for name, col in columns.items()
+            }
+        )
+    try:
+        import pandas as pd
+    except ImportError:
+        return None
+    return pd.DataFrame(columns)
+
+
 class SqlTileStore:
     def __init__(self, conn, engine: str):
         self.conn = conn
         self.engine = engine  # "sqlite" | "duckdb"
+        self._bulk: _BulkState | None = None
+        # RETURNING saves the SELECT round trip after each upsert (SQLite >= 3.35, any DuckDB)
+        self._returning = engine == "duckdb" or _sqlite_version() >= (3, 35, 0)
 
     def ensure_schema(self) -> None:
-        cur = self.conn.cursor()
+        cur = self._cursor()
         if self.engine == "sqlite":
             cur.execute(
                 """
@@ -19,7 +93,10 @@ class SqlTileStore:
                 id INTEGER PRIMARY KEY,
                 path TEXT UNIQUE NOT NULL,
                 width INT NOT NULL,
-                height INT NOT NULL
+                height INT NOT NULL,
+                file_size INTEGER,
+                mtime_ns INTEGER,
+                content_hash TEXT
                 );
             """
             )
@@ -32,6 +109,8 @@ class SqlTileStore:
                 tile_h INT NOT NULL,
                 cols INT NOT NULL,
                 rows INT NOT NULL,
+                decode_scale INT NOT NULL DEFAULT 1,
+                layout_k INT NOT NULL DEFAULT 1,
                 UNIQUE(photo_id, tile_w, tile_h)
                 );
             """
@@ -39,11 +118,12 @@ class SqlTileStore:
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS tiles (
-                id INTEGER PRIMARY KEY,
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
                 grid_id INT NOT NULL,
                 x INT NOT NULL,
                 y INT NOT NULL,
-                l REAL NOT NULL, a REAL NOT NULL, b REAL NOT NULL
+                l REAL NOT NULL, a REAL NOT NULL, b REAL NOT NULL,
+                layout BLOB
                 );
             """
             )
@@ -57,7 +137,10 @@ class SqlTileStore:
                 id BIGINT PRIMARY KEY DEFAULT nextval('photos_id_seq'),
                 path TEXT UNIQUE NOT NULL,
                 width INTEGER NOT NULL,
-                height INTEGER NOT NULL
+                height INTEGER NOT NULL,
+                file_size BIGINT,
+                mtime_ns BIGINT,
+                content_hash TEXT
                 );
             """
             )
@@ -70,6 +153,8 @@ class SqlTileStore:
                 tile_h INTEGER NOT NULL,
                 cols INTEGER NOT NULL,
                 rows INTEGER NOT NULL,
+                decode_scale INTEGER NOT NULL DEFAULT 1,
+                layout_k INTEGER NOT NULL DEFAULT 1,
                 UNIQUE(photo_id, tile_w, tile_h)
                 );
             """
@@ -81,15 +166,49 @@ class SqlTileStore:
                 grid_id BIGINT NOT NULL,
                 x INTEGER NOT NULL,
                 y INTEGER NOT NULL,
-                l DOUBLE NOT NULL, a DOUBLE NOT NULL, b DOUBLE NOT NULL
+                l DOUBLE NOT NULL, a DOUBLE NOT NULL, b DOUBLE NOT NULL,
+                layout BLOB
                 );
             """
             )
+        cur.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+        cur.execute("SELECT value FROM store_meta WHERE key='generation'")
+        if cur.fetchone() is None:
+            self._new_generation()
+        self._migrate_columns()
         self.conn.commit()
 
+    def _new_generation(self) -> None:
+        """Mark the tile ids as a new series (after a wipe) so indexes built before it are not extended."""
+        cur = self._cursor()
+        cur.execute("DELETE FROM store_meta WHERE key='generation'")
+        cur.execute("INSERT INTO store_meta (key, value) VALUES ('generation', ?)", (uuid.uuid4().hex,))
+
+    def _columns(self, table: str) -> set[str]:
+        cur = self._cursor()
+        if self.engine == "sqlite":
+            cur.execute(f"PRAGMA table_info({table})")
+            return {r[1] for r in cur.fetchall()}
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name=?", (table,))
+        return {r[0] for r in cur.fetchall()}
+
+    def _migrate_columns(self) -> None:
+        """Add columns introduced after a database was created (nullable, so old rows stay valid)."""
+        added = {
+            "photos": [("file_size", "BIGINT"), ("mtime_ns", "BIGINT"), ("content_hash", "TEXT")],
+            "grids": [("decode_scale", "INTEGER DEFAULT 1"), ("layout_k", "INTEGER DEFAULT 1")],
+            "tiles": [("layout", "BLOB")],
+        }
+        cur = self._cursor()
+        for table, columns in added.items():
+            existing = self._columns(table)
+            for name, sql_type in columns:
+                if name not in existing:
+                    cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+
     # --- create INDEXES (safe to run after data is clean) ---
     def ensure_indexes(self) -> None:
-        cur = self.conn.cursor()
+        cur = self._cursor()
         cur.execute("CREATE INDEX IF NOT EXISTS tiles_grid_id_idx ON tiles(grid_id);")
         cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS tiles_grid_xy_unique ON tiles(grid_id, x, y);")
         cur.execute("CREATE INDEX IF NOT EXISTS grids_photo_idx ON grids(photo_id);")
@@ -97,7 +216,7 @@ class SqlTileStore:
 
     def wipe_all(self) -> None:
         """Delete all rows; keep schema. Tolerant if tables don't exist."""
-        cur = self.conn.cursor()
+        cur = self._cursor()
         for tbl in ("tiles", "photos"):
             try:
                 cur.execute(f"DELETE FROM {tbl};")
@@ -109,15 +228,20 @@ class SqlTileStore:
                 cur.execute("ALTER SEQUENCE photos_id_seq RESTART WITH 1;")
             except Exception:
                 pass
+        try:
+            self._new_generation()
+        except Exception:
+            pass
         self.conn.commit()
 
     def drop_all(self) -> None:
         """Drop tables (and sequences on DuckDB). Safe if they don't exist."""
-        cur = self.conn.cursor()
+        cur = self._cursor()
         # Drop child tables first
         cur.execute("DROP TABLE IF EXISTS tiles;")
         cur.execute("DROP TABLE IF EXISTS grids;")
         cur.execute("DROP TABLE IF EXISTS photos;")
+        cur.execute("DROP TABLE IF EXISTS store_meta;")
 
         if self.engine == "duckdb":
             # Use IF EXISTS (not IF NOT EXISTS). Guard with try in case very old versions.
@@ -129,72 +253,433 @@ class SqlTileStore:
 
         self.conn.commit()
 
-    def upsert_photo(self, path: Path, width: int, height: int) -> int:
-        cur = self.conn.cursor()
-        if self.engine == "sqlite":
-            cur.execute("INSERT OR IGNORE INTO photos(path,width,height) VALUES (?,?,?)", (str(path), width, height))
-        else:
-            cur.execute(
-                "INSERT INTO photos(path,width,height) VALUES (?,?,?) ON CONFLICT (path) DO NOTHING",
-                (str(path), width, height),
-            )
-        cur.execute("SELECT id FROM photos WHERE path=?", (str(path),))
-        return int(cur.fetchone()[0])
+    def _cursor(self):
+        """
+        Cursor for the next statement. A DuckDB cursor is a separate connection with its own
+        transaction, so inside `bulk_load()` DuckDB statements run on the connection that
+        owns the bulk transaction instead.
+        """
+        if self.engine == "duckdb" and self._bulk is not None:
+            return self.conn
+        return self.conn.cursor()
 
-    def upsert_grid(self, photo_id: int, tile_w: int, tile_h: int, cols: int, rows: int) -> int:
-        cur = self.conn.cursor()
-        if self.engine == "sqlite":
-            cur.execute(
-                "INSERT OR IGNORE INTO grids(photo_id,tile_w,tile_h,cols,rows) VALUES (?,?,?,?,?)",
-                (photo_id, tile_w, tile_h, cols, rows),
-            )
+    def _commit(self) -> None:
+        # Inside bulk_load() the loader decides when to commit
+        if self._bulk is None:
+            self.conn.commit()
+
+    def _upsert_returning_id(self, sql: str, params: tuple, select_sql: str, select_params: tuple) -> int:
+        cur = self._cursor()
+        if self._returning:
+            cur.execute(sql + " RETURNING id", params)
         else:
-            cur.execute(
-                "INSERT INTO grids(photo_id,tile_w,tile_h,cols,rows) VALUES (?,?,?,?,?) "
-                "ON CONFLICT (photo_id, tile_w, tile_h) DO NOTHING",
-                (photo_id, tile_w, tile_h, cols, rows),
-            )
-        cur.execute("SELECT id FROM grids WHERE photo_id=? AND tile_w=? AND tile_h=?", (photo_id, tile_w, tile_h))
+            cur.execute(sql, params)
+            cur.execute(select_sql, select_params)
         return int(cur.fetchone()[0])
 
+    def upsert_photo(
+        self,
+        path: Path,
+        width: int,
+        height: int,
+        file_size: int | None = None,
+        mtime_ns: int | None = None,
+        content_hash: str | None = None,
+    ) -> int:
+        """Insert a photo, or refresh its dimensions and fingerprint if the path is already known."""
+        return self._upsert_returning_id(
+            "INSERT INTO photos(path,width,height,file_size,mtime_ns,content_hash) VALUES (?,?,?,?,?,?) "
+            "ON CONFLICT (path) DO UPDATE SET width=excluded.width, height=excluded.height, "
+            "file_size=excluded.file_size, mtime_ns=excluded.mtime_ns, content_hash=excluded.content_hash",
+            (str(path), width, height, file_size, mtime_ns, content_hash),
+            "SELECT id FROM photos WHERE path=?",
+            (str(path),),
+        )
+
+    def update_fingerprints(self, rows: list[tuple[str, int, int, str | None]]) -> None:
+        """Record (path, file_size, mtime_ns, content_hash) for photos that were not re-tiled."""
+        if not rows:
+            return
+        cur = self._cursor()
+        cur.executemany(
+            "UPDATE photos SET file_size=?, mtime_ns=?, content_hash=COALESCE(?, content_hash) WHERE path=?",
+            [(size, mtime, digest, path) for (path, size, mtime, digest) in rows],
+        )
+        self._commit()
+
+    def upsert_grid(
+        self,
+        photo_id: int,
+        tile_w: int,
+        tile_h: int,
+        cols: int,
+        rows: int,
+        decode_scale: int = 1,
+        layout_k: int = 1,
+    ) -> int:
+        """
+        Insert or refresh a grid. tile_w/tile_h/cols/rows are always full-resolution;
+        `decode_scale` records that the tile stats came from a 1/decode_scale decode and
+        `layout_k` that its tiles carry a k×k layout descriptor.
+        """
+        return self._upsert_returning_id(
+            "INSERT INTO grids(photo_id,tile_w,tile_h,cols,rows,decode_scale,layout_k) VALUES (?,?,?,?,?,?,?) "
+            "ON CONFLICT (photo_id, tile_w, tile_h) DO UPDATE SET "
+            "cols=excluded.cols, rows=excluded.rows, decode_scale=excluded.decode_scale, layout_k=excluded.layout_k",
+            (photo_id, tile_w, tile_h, cols, rows, decode_scale, layout_k),
+            "SELECT id FROM grids WHERE photo_id=? AND tile_w=? AND tile_h=?",
+            (photo_id, tile_w, tile_h),
+        )
+
     def has_tiles_for_grid(self, grid_id: int) -> bool:
-        cur = self.conn.cursor()
+        if self._bulk is not None:
+            if grid_id in self._bulk.pending_grids:
+                return True
+            if self._bulk.deferred_indexes:
+                # tiles was empty when loading started, so only this load's grids can have tiles
+                return grid_id in self._bulk.loaded_grids
+        cur = self._cursor()
         cur.execute("SELECT 1 FROM tiles WHERE grid_id=? LIMIT 1", (grid_id,))
         return cur.fetchone() is not None
 
+    def photo_catalog(self) -> dict[str, PhotoRecord]:
+        """
+        Fingerprint and tiled grid sizes of every known photo, in one query.
+
+        Lets ingest decide which files are new, changed or already tiled without opening them.
+        """
+        cur = self._cursor()
+        cur.execute(
+            """
+            SELECT p.path, p.file_size, p.mtime_ns, p.content_hash, g.tile_w, g.tile_h, g.layout_k
+            FROM photos p
+            LEFT JOIN grids g
+              ON g.photo_id = p.id AND EXISTS (SELECT 1 FROM tiles t WHERE t.grid_id = g.id)
+            """
+        )
+        catalog: dict[str, PhotoRecord] = {}
+        for path, size, mtime, digest, tile_w, tile_h, layout_k in cur.fetchall():
+            rec = catalog.get(path)
+            if rec is None:
+                rec = catalog[path] = PhotoRecord(size, mtime, digest)
+            if tile_w is not None:
+                rec.tiled_grids[(int(tile_w), int(tile_h))] = int(layout_k or 1)
+        return catalog
+
     def delete_tiles_for_grid(self, grid_id: int) -> None:
-        cur = self.conn.cursor()
+        if self._bulk is not None and grid_id in self._bulk.pending_grids:
+            self._bulk.discard(grid_id)
+        cur = self._cursor()
         cur.execute("DELETE FROM tiles WHERE grid_id=?", (grid_id,))
-        self.conn.commit()
+        self._commit()
+
+    @staticmethod
+    def _tile_columns(grid_id: int, vectors: np.ndarray) -> dict[str, np.ndarray | list]:
+        """Column arrays for a (rows, cols, D) grid of tile vectors (see `insert_tiles`)."""
+        rows, cols, dims = vectors.shape
+        ys, xs = np.divmod(np.arange(rows * cols, dtype=np.int64), cols)
+        flat = np.asarray(vectors, dtype=np.float32).reshape(-1, dims)
+        lab = flat.reshape(len(flat), -1, 3).mean(axis=1, dtype=np.float64)
+        return {
+            "grid_id": np.full(len(flat), grid_id, dtype=np.int64),
+            "x": xs,
+            "y": ys,
+            "l": lab[:, 0],
+            "a": lab[:, 1],
+            "b": lab[:, 2],
+            "layout": [f.tobytes() for f in flat] if dims > 3 else [None] * len(flat),
+        }
+
+    def _write_tile_columns(self, columns: dict[str, np.ndarray | list], on_conflict: bool = True) -> None:
+        """
+        Write tile column arrays in one statement.
 
-    def insert_tiles(self, grid_id: int, rows: list[tuple[int, int, float, float, float]]) -> None:
-        # rows: (x, y, L, A, B)
-        cur = self.conn.cursor()
+        DuckDB scans them as a registered Arrow table (or DataFrame) with a single
+        INSERT ... SELECT when pyarrow or pandas is installed. SQLite, or DuckDB without
+        either, falls back to one executemany over a cached prepared statement.
+        """
+        names = ",".join(columns)
+        if self.engine == "duckdb":
+            batch = _columnar_batch(columns)
+            if batch is not None:
+                conflict = " ON CONFLICT (grid_id, x, y) DO NOTHING" if on_conflict else ""
+                self.conn.register("tiles_batch", batch)
+                try:
+                    self.conn.execute(f"INSERT INTO tiles ({names}) SELECT {names} FROM tiles_batch{conflict}")
+                finally:
+                    self.conn.unregister("tiles_batch")
+                return
+        params = list(zip(*(c.tolist() if isinstance(c, np.ndarray) else c for c in columns.values())))
+        cur = self._cursor()
         if self.engine == "sqlite":
-            cur.executemany(
-                "INSERT OR IGNORE INTO tiles (grid_id,x,y,l,a,b) VALUES (?,?,?,?,?,?)",
-                [(grid_id, x, y, l, a, b) for (x, y, l, a, b) in rows],
-            )
+            cur.executemany(f"INSERT OR IGNORE INTO tiles ({names}) VALUES (?,?,?,?,?,?,?)", params)
         else:
-            cur.executemany(
-                "INSERT INTO tiles (grid_id,x,y,l,a,b) VALUES (?,?,?,?,?,?) " "ON CONFLICT (grid_id, x, y) DO NOTHING",
-                [(grid_id, x, y, l, a, b) for (x, y, l, a, b) in rows],
+            conflict = " ON CONFLICT (grid_id, x, y) DO NOTHING" if on_conflict else ""
+            cur.executemany(f"INSERT INTO tiles ({names}) VALUES (?,?,?,?,?,?,?){conflict}", params)
+
+    def insert_tiles(self, grid_id: int, vectors: np.ndarray) -> None:
+        """
+        Insert a (rows, cols, D) grid of tile vectors; x/y come from each cell's position.
+
+        D=3 is the mean Lab. D=3k² is a k×k layout descriptor: it is stored as a float32
+        blob in `layout`, and l/a/b receive the tile mean derived from it. Inside
+        `bulk_load()` the grid is buffered and written with other grids at the next flush.
+        """
+        columns = self._tile_columns(grid_id, vectors)
+        if self._bulk is not None:
+            self._bulk.add(grid_id, columns)
+            return
+        self._write_tile_columns(columns)
+        self.conn.commit()
+
+    def tile_ids_for_grid(self, grid_id: int, cols: int, rows: int) -> np.ndarray:
+        """(rows, cols) int64 array of tile ids laid out by tile position."""
+        if self._bulk is not None and grid_id in self._bulk.pending_grids:
+            self._flush_tiles()  # ids are assigned on insert
+        cur = self._cursor()
+        cur.execute("SELECT id, x, y FROM tiles WHERE grid_id=?", (grid_id,))
+        ids = np.zeros((rows, cols), dtype=np.int64)
+        data = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 3)
+        ids[data[:, 2], data[:, 1]] = data[:, 0]
+        return ids
+
+    # --- bulk loading ---
+    def _flush_tiles(self) -> None:
+        bulk = self._bulk
+        if not bulk.pending:
+            return
+        t0 = time.perf_counter()
+        columns = {
+            name: (
+                np.concatenate([c[name] for c in bulk.pending])
+                if isinstance(bulk.pending[0][name], np.ndarray)
+                else [v for c in bulk.pending for v in c[name]]
             )
+            for name in bulk.pending[0]
+        }
+        # Grids are emptied (or known empty) before insert, so no conflict target is needed;
+        # that also lets the insert run before deferred indexes exist
+        self._write_tile_columns(columns, on_conflict=False)
+        bulk.stats.rows += len(columns["grid_id"])
+        bulk.stats.seconds += time.perf_counter() - t0
+        bulk.loaded_grids |= bulk.pending_grids
+        bulk.pending.clear()
+        bulk.pending_grids.clear()
+
+    def flush(self) -> None:
+        """Write buffered tiles and commit the current bulk transaction (no-op outside bulk_load)."""
+        if self._bulk is None:
+            return
+        self._flush_tiles()
+        t0 = time.perf_counter()
+        self.conn.commit()
+        if self.engine == "duckdb":
+            self.conn.begin()
+        self._bulk.stats.seconds += time.perf_counter() - t0
+
+    @contextmanager
+    def bulk_load(self, defer_indexes: bool = True) -> Iterator[BulkLoadStats]:
+        """
+        Group many photos per transaction for ingest.
+
+        Inside the block, upserts and tile inserts do not commit; `insert_tiles` buffers
+        grids and `flush()` writes them as one columnar batch and commits. When `tiles`
+        is empty and `defer_indexes` is set, its indexes are dropped and rebuilt once at
+        the end, which is much cheaper than maintaining them row by row. Yields running
+        write statistics (rows, seconds, rows/sec).
+        """
+        if self._bulk is not None:
+            raise RuntimeError("bulk_load() is already active")
+        cur = self._cursor()
+        cur.execute("SELECT 1 FROM tiles LIMIT 1")
+        deferred = defer_indexes and cur.fetchone() is None
+        if deferred:
+            for name in _TILE_INDEXES:
+                cur.execute(f"DROP INDEX IF EXISTS {name}")
         self.conn.commit()
+        if self.engine == "duckdb":
+            self.conn.begin()
+        self._bulk = _BulkState(deferred_indexes=deferred)
+        stats = self._bulk.stats
+        try:
+            yield stats
+            self.flush()
+        except BaseException:
+            self._bulk = None
+            self.conn.rollback()
+            raise
+        finally:
+            if self._bulk is not None:
+                self._bulk = None
+                self.conn.commit()
+            self.ensure_indexes()
+
+    def _vector_query(self, layout_k: int, above_id: int = 0) -> tuple[str, tuple]:
+        if layout_k == 1:
+            return "SELECT id, l, a, b FROM tiles WHERE id > ?", (above_id,)
+        return (
+            "SELECT t.id, t.layout FROM tiles t JOIN grids g ON t.grid_id = g.id WHERE g.layout_k=? AND t.id > ?",
+            (layout_k, above_id),
+        )
 
-    def all_tile_vectors(self) -> tuple[list[int], np.ndarray]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT id, l, a, b FROM tiles")
-        data = cur.fetchall()
-        ids = [int(r[0]) for r in data]
-        vecs = np.array([[r[1], r[2], r[3]] for r in data], dtype=np.float32)
+    @staticmethod
+    def _rows_to_vectors(rows: list[tuple], layout_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Typed (ids, vecs) arrays from one fetched chunk, without per-value Python lists."""
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        if layout_k == 1:
+            vecs = np.array(rows, dtype=np.float64)[:, 1:].astype(np.float32)
+        else:
+            blob = b"".join(bytes(r[1]) for r in rows)
+            vecs = np.frombuffer(blob, dtype=np.float32).reshape(len(rows), 3 * layout_k**2).copy()
         return ids, vecs
 
+    @staticmethod
+    def _columns_to_vectors(columns, layout_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """(ids, vecs) from DuckDB numpy columns or an Arrow record batch."""
+        col = (lambda name: columns[name]) if isinstance(columns, dict) else columns.column
+        as_np = (lambda c: np.asarray(c)) if isinstance(columns, dict) else (lambda c: c.to_numpy(zero_copy_only=False))
+        ids = as_np(col("id")).astype(np.int64, copy=False)
+        if layout_k == 1:
+            vecs = np.empty((len(ids), 3), dtype=np.float32)
+            for j, name in enumerate(("l", "a", "b")):
+                vecs[:, j] = as_np(col(name))
+        else:
+            blob = b"".join(bytes(v) for v in as_np(col("layout")))
+            vecs = np.frombuffer(blob, dtype=np.float32).reshape(len(ids), 3 * layout_k**2).copy()
+        return ids, vecs
+
+    def iter_tile_vectors(
+        self, layout_k: int = 1, chunk_rows: int = 1 << 18, above_id: int = 0
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Stream tile (ids int64, vecs float32) in chunks of at most `chunk_rows`, for consumers
+        that cannot hold the whole matrix. DuckDB streams Arrow record batches when pyarrow is
+        installed; otherwise rows are fetched with fetchmany and converted per chunk.
+        """
+        cur = self._cursor()
+        cur.execute(*self._vector_query(layout_k, above_id))
+        if self.engine == "duckdb":
+            try:
+                arrow_reader = getattr(cur, "to_arrow_reader", None) or cur.fetch_record_batch  # older duckdb
+                reader = arrow_reader(chunk_rows)
+            except ImportError:  # no pyarrow
+                reader = None
+            if reader is not None:
+                for batch in reader:
+                    if batch.num_rows:
+                        yield self._columns_to_vectors(batch, layout_k)
+                return
+        while rows := cur.fetchmany(chunk_rows):
+            yield self._rows_to_vectors(rows, layout_k)
+
+    def all_tile_vectors(self, layout_k: int = 1, above_id: int = 0) -> tuple[np.ndarray, np.ndarray]:
+        """
+        All tile ids (int64) and vectors (contiguous float32). layout_k=1 gives every tile's
+        mean Lab (N, 3); layout_k > 1 gives the (N, 3k²) layout descriptors of tiles ingested
+        with that layout. `above_id` limits the export to tiles added after that id.
+        DuckDB exports columns directly; SQLite fills preallocated arrays chunk by chunk.
+        """
+        dim = 3 * layout_k**2
+        if self.engine == "duckdb":
+            cur = self._cursor()
+            cur.execute(*self._vector_query(layout_k, above_id))
+            ids, vecs = self._columns_to_vectors(cur.fetchnumpy(), layout_k)
+            return ids, np.ascontiguousarray(vecs)
+        sql, params = self._vector_query(layout_k, above_id)
+        count_sql = "SELECT COUNT(*) FROM (" + sql + ")"
+        n = int(self.conn.execute(count_sql, params).fetchone()[0])
+        ids = np.empty(n, dtype=np.int64)
+        vecs = np.empty((n, dim), dtype=np.float32)
+        i = 0
+        for chunk_ids, chunk_vecs in self.iter_tile_vectors(layout_k, above_id=above_id):
+            j = min(i + len(chunk_ids), n)  # rows added since the count are ignored
+            ids[i:j], vecs[i:j] = chunk_ids[: j - i], chunk_vecs[: j - i]
+            i = j
+        return ids[:i], vecs[:i]
+
+    def tile_grid_sizes(self, tile_ids: np.ndarray, chunk_rows: int = 1 << 18) -> np.ndarray:
+        """(N, 2) int32 (tile_w, tile_h) of each tile's grid, aligned with `tile_ids` (all must exist)."""
+        tile_ids = np.asarray(tile_ids, dtype=np.int64)
+        if not len(tile_ids):
+            return np.empty((0, 2), dtype=np.int32)
+        cur = self._cursor()
+        cur.execute(
+            "SELECT t.id, g.tile_w, g.tile_h FROM tiles t JOIN grids g ON t.grid_id = g.id WHERE t.id BETWEEN ? AND ?",
+            (int(tile_ids.min()), int(tile_ids.max())),
+        )
+        parts = []
+        while rows := cur.fetchmany(chunk_rows):
+            parts.append(np.array(rows, dtype=np.int64))
+        table = np.concatenate(parts) if parts else np.empty((0, 3), dtype=np.int64)
+        table = table[np.argsort(table[:, 0])]
+        pos = np.searchsorted(table[:, 0], tile_ids)
+        return table[pos, 1:].astype(np.int32)
+
+    def tile_snapshot(self) -> dict:
+        """
+        {"tile_count", "max_tile_id", "generation"} of the tiles table: enough to tell whether
+        an index is current. The generation changes whenever the store is wiped.
+        """
+        cur = self._cursor()
+        cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM tiles")
+        count, max_id = cur.fetchone()
+        row = None
+        if self._columns("store_meta"):  # absent until the first ingest after upgrading
+            cur.execute("SELECT value FROM store_meta WHERE key='generation'")
+            row = cur.fetchone()
+        return {"tile_count": int(count), "max_tile_id": int(max_id), "generation": row[0] if row else None}
+
+    def tile_ids(self, max_id: int | None = None) -> np.ndarray:
+        """Sorted int64 ids of all tiles (up to `max_id`), read from the primary key alone."""
+        cur = self._cursor()
+        if max_id is None:
+            cur.execute("SELECT id FROM tiles ORDER BY id")
+        else:
+            cur.execute("SELECT id FROM tiles WHERE id <= ? ORDER BY id", (max_id,))
+        if self.engine == "duckdb":
+            return np.asarray(cur.fetchnumpy()["id"], dtype=np.int64)
+        parts = []
+        while rows := cur.fetchmany(1 << 18):
+            parts.append(np.array(rows, dtype=np.int64).reshape(-1))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def tile_count(self, max_id: int | None = None) -> int:
+        cur = self._cursor()
+        if max_id is None:
+            cur.execute("SELECT COUNT(*) FROM tiles")
+        else:
+            cur.execute("SELECT COUNT(*) FROM tiles WHERE id <= ?", (max_id,))
+        return int(cur.fetchone()[0])
+
+    def tile_size_stats(self, layout_k: int = 1) -> list[tuple[int, int, int, int, int]]:
+        """
+        (tile_w, tile_h, count, min_id, max_id) per grid size of the tiles that
+        `all_tile_vectors(layout_k)` exports, smallest size first.
+        """
+        sql = "SELECT g.tile_w, g.tile_h, COUNT(*), MIN(t.id), MAX(t.id) FROM tiles t JOIN grids g ON t.grid_id = g.id"
+        params: tuple = ()
+        if layout_k != 1:
+            sql, params = sql + " WHERE g.layout_k = ?", (layout_k,)
+        cur = self._cursor()
+        cur.execute(sql + " GROUP BY g.tile_w, g.tile_h ORDER BY g.tile_w, g.tile_h", params)
+        return [tuple(int(v) for v in row) for row in cur.fetchall()]
+
+    def tile_ids_monotonic(self) -> bool:
+        """
+        Whether new tiles always get ids above every id ever used. DuckDB sequences and SQLite
+        AUTOINCREMENT tables do; SQLite tables created before AUTOINCREMENT reuse the ids of
+        deleted newest tiles, so an index cannot tell their new tiles from old ones.
+        """
+        if self.engine == "duckdb":
+            return True
+        row = self.conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='tiles'").fetchone()
+        return bool(row) and "AUTOINCREMENT" in row[0].upper()
+
     def tile_patch_info(self, tile_id: int) -> tuple[str, int, int, int, int]:
         """
         Returns (photo_path, x, y, tile_w, tile_h) for a tile id.
         """
-        cur = self.conn.cursor()
+        cur = self._cursor()
         cur.execute(
             """
             SELECT p.path, t.x, t.y, g.tile_w, g.tile_h
@@ -208,6 +693,30 @@ class SqlTileStore:
         path, x, y, tw, th = cur.fetchone()
         return path, int(x), int(y), int(tw), int(th)
 
+    def tile_patch_infos(self, tile_ids, chunk: int = 500) -> dict[int, tuple[str, int, int, int, int]]:
+        """
+        Batched `tile_patch_info`: {tile_id: (photo_path, x, y, tile_w, tile_h)} for many ids,
+        fetched with one query per `chunk` ids.
+        """
+        ids = sorted({int(t) for t in np.asarray(tile_ids).ravel()})
+        cur = self._cursor()
+        infos = {}
+        for start in range(0, len(ids), chunk):
+            part = ids[start : start + chunk]
+            cur.execute(
+                f"""
+                SELECT t.id, p.path, t.x, t.y, g.tile_w, g.tile_h
+                FROM tiles t
+                JOIN grids g ON t.grid_id = g.id
+                JOIN photos p ON g.photo_id = p.id
+                WHERE t.id IN ({",".join("?" * len(part))})
+                """,
+                part,
+            )
+            for tile_id, path, x, y, tw, th in cur.fetchall():
+                infos[int(tile_id)] = (path, int(x), int(y), int(tw), int(th))
+        return infos
+
     def close(self) -> None:
         try:
             self.conn.close()
@@ -0,0 +1,31 @@
+import numpy as np
+
+from mosaic_builder.index.factory import make_index
+from mosaic_builder.pipeline.assign import assign_tiles
+
+
+def _candidates(rows=40, cols=50, k=12):
+    rng = np.random.default_rng(0)
+    index = make_index("kdtree")
+    index.build((rng.random((300, 3)) * 100).astype(np.float32))
+    # a nearly flat target, where nearest-only matching repeats a handful of tiles
+    target = (np.array([50.0, 10.0, -5.0]) + rng.normal(size=(rows * cols, 3))).astype(np.float32)
+    return index.batch_query(target, k=k)
+
+
+def test_unconstrained_assignment_is_the_nearest_neighbour():
+    idx, dist = _candidates()
+    a = assign_tiles(idx, dist, (40, 50))
+    np.testing.assert_array_equal(a.indices.ravel(), idx[:, 0])
+    assert a.cost == a.optimum and a.overhead == 0.0 and a.fallbacks == 0
+
+
+def test_assignment_enforces_usage_cap_and_spacing():
+    idx, dist = _candidates()
+    a = assign_tiles(idx, dist, (40, 50), max_uses=200, min_distance=1)
+    assert a.fallbacks == 0 and a.cost >= a.optimum
+    _, counts = np.unique(a.indices, return_counts=True)
+    assert counts.max() <= 200
+    grid = a.indices
+    assert not (grid[1:, :] == grid[:-1, :]).any() and not (grid[:, 1:] == grid[:, :-1]).any()
+    assert not (grid[1:, 1:] == grid[:-1, :-1]).any() and not (grid[1:, :-1] == grid[:-1, 1:]).any()
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from mosaic_builder.pipeline.atlas import AtlasSet, PatchAtlas, grid_patches
+from mosaic_builder.pipeline.ingest import ingest_dir
+from mosaic_builder.pipeline.render import ImageCache, PatchRenderer
+from mosaic_builder.stores.factory import open_store
+
+
+def test_atlas_roundtrip_last_write_wins(tmp_path):
+    atlas = PatchAtlas(tmp_path, 24, 24, 4)
+    first = np.full((2, 4, 4, 3), 10, dtype=np.uint8)
+    atlas.append(np.array([7, 9]), first)
+    assert int(atlas.get(9)[0, 0, 0]) == 10
+    atlas.append(np.array([9]), np.full((1, 4, 4, 3), 200, dtype=np.uint8))  # tile 9 re-ingested
+
+    atlases = AtlasSet(tmp_path)
+    assert int(atlases.patch(9, 24, 24, out_px=4)[0, 0, 0]) == 200
+    assert int(atlases.patch(7, 24, 24, out_px=4)[0, 0, 0]) == 10
+    assert atlases.patch(8, 24, 24, out_px=4) is None
+    assert atlases.patch(7, 32, 32, out_px=4) is None
+
+
+def test_grid_patches_are_per_tile():
+    arr = np.zeros((20, 30, 3), dtype=np.uint8)
+    arr[10:20, 20:30] = 255  # bottom-right tile of a 3x2 grid of 10px tiles
+    patches = grid_patches(Image.fromarray(arr), 10, 10, cols=3, rows=2, patch_px=10)
+    assert patches.shape == (2, 3, 10, 10, 3)
+    assert patches[1, 2].min() == 255 and patches[0, 0].max() == 0
+
+
+def _ingest_with_atlas(tmp_path, url):
+    rng = np.random.default_rng(0)
+    (tmp_path / "g").mkdir()
+    for i in range(3):
+        Image.fromarray(rng.integers(0, 256, size=(48, 72, 3), dtype=np.uint8)).save(tmp_path / "g" / f"p{i}.png")
+    ingest_dir(url, tmp_path / "g", tile_w=12, tile_h=12, atlas_dir=tmp_path / "atlas", atlas_px=[12])
+    store = open_store(url)
+    try:
+        ids = store.tile_ids()
+        return ids, store.tile_patch_infos(ids)
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("url", ["sqlite:///mosaic.db", "duckdb:///mosaic.duckdb"])
+def test_ingested_atlas_serves_every_tile_without_decoding(tmp_path, monkeypatch, url):
+    monkeypatch.chdir(tmp_path)
+    ids, infos = _ingest_with_atlas(tmp_path, url)
+    atlases = AtlasSet(tmp_path / "atlas")
+    assert len(ids) == 3 * 24 and all(atlases.patch(int(t), 12, 12, 12) is not None for t in ids)
+
+    cache = ImageCache()
+    cells = ids[:24].reshape(4, 6)
+    out = np.empty((4 * 12, 6 * 12, 3), dtype=np.uint8)
+    PatchRenderer(infos, 12, 12, atlases, cache).render(cells, out)
+    assert cache.stats.misses == 0
+    path, x, y, _, _ = infos[int(cells[1, 2])]
+    crop = np.asarray(Image.open(path).convert("RGB"))[y * 12 : (y + 1) * 12, x * 12 : (x + 1) * 12]
+    np.testing.assert_array_equal(out[12:24, 24:36], crop)
+
+
+@pytest.mark.parametrize("url", ["sqlite:///mosaic.db", "duckdb:///mosaic.duckdb"])
+def test_atlas_written_before_a_store_wipe_is_never_served(tmp_path, monkeypatch, url):
+    monkeypatch.chdir(tmp_path)
+    _ingest_with_atlas(tmp_path, url)
+    rng = np.random.default_rng(7)
+
+    def wipe_and_replace_photos():
+        store = open_store(url)
+        store.wipe_all()
+        store.close()
+        for p in sorted((tmp_path / "g").iterdir()):
+            Image.fromarray(rng.integers(0, 256, size=(48, 72, 3), dtype=np.uint8)).save(p)
+
+    def current():
+        store = open_store(url)
+        try:
+            ids = store.tile_ids()
+            return ids, store.tile_patch_infos(ids), store.tile_snapshot()["generation"]
+        finally:
+            store.close()
+
+    # re-ingested without the atlas: its patches no longer belong to the store's tile ids
+    wipe_and_replace_photos()
+    ingest_dir(url, tmp_path / "g", tile_w=12, tile_h=12)
+    _, _, generation = current()
+    stale = AtlasSet(tmp_path / "atlas", generation)
+    assert stale.stale and stale.atlases == {}
+
+    # re-ingested with it: the wiped store's patches are removed before new ones are written
+    wipe_and_replace_photos()
+    ingest_dir(url, tmp_path / "g", tile_w=12, tile_h=12, atlas_dir=tmp_path / "atlas", atlas_px=[12])
+    ids, infos, generation = current()
+    atlases = AtlasSet(tmp_path / "atlas", generation)
+    assert not atlases.stale
+    assert len(np.fromfile(atlases.atlases[12, 12][12].ids_path, dtype=np.int64)) == len(ids)
+    for t in ids[::7]:
+        path, x, y, _, _ = infos[int(t)]
+        crop = np.asarray(Image.open(path).convert("RGB"))[y * 12 : (y + 1) * 12, x * 12 : (x + 1) * 12]
+        np.testing.assert_array_equal(atlases.patch(int(t), 12, 12, 12), crop)
+
+
+def test_threaded_render_over_shared_atlas_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ids, infos = _ingest_with_atlas(tmp_path, "sqlite:///mosaic.db")
+    cells = ids.reshape(6, 12)
+
+    def render(threads):
+        cache = ImageCache()
+        out = np.empty((6 * 12, 12 * 12, 3), dtype=np.uint8)
+        # a fresh AtlasSet each time, so the render threads race to open the atlas
+        PatchRenderer(infos, 12, 12, AtlasSet(tmp_path / "atlas"), cache, threads=threads).render(cells, out)
+        assert cache.stats.misses == 0
+        return out
+
+    serial = render(1)
+    for _ in range(5):
+        np.testing.assert_array_equal(render(4), serial)
@@ -0,0 +1,36 @@
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.index.build_index import build_kdtree
+from mosaic_builder.pipeline.batch import build_batch, read_manifest
+from mosaic_builder.pipeline.build_mosaic import build_mosaic
+from mosaic_builder.pipeline.ingest import ingest_dir
+
+
+def test_batch_shares_session_and_matches_single_builds(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    (tmp_path / "g").mkdir()
+    for i in range(3):
+        Image.fromarray(rng.integers(0, 256, size=(48, 72, 3), dtype=np.uint8)).save(tmp_path / "g" / f"p{i}.png")
+    Image.fromarray(rng.integers(0, 256, size=(60, 96, 3), dtype=np.uint8)).save(tmp_path / "target.png")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_w=24, tile_h=24)
+    build_kdtree("sqlite:///mosaic.db", tmp_path / "index.pkl")
+
+    (tmp_path / "jobs").mkdir()
+    (tmp_path / "jobs" / "manifest.csv").write_text(
+        "target,out,tile_px\n../target.png,a.png,\n../target.png,b.png,12\nmissing.png,c.png,12\n"
+    )
+    jobs = read_manifest(tmp_path / "jobs" / "manifest.csv", default_tile_px=24)
+    assert [j.tile_px for j in jobs] == [24, 12, 12]
+    report = build_batch("sqlite:///mosaic.db", tmp_path / "index.pkl", jobs, workers=2)
+
+    assert [r.job.out.name for r in report.failed] == ["c.png"]
+    assert [r.cells for r in report.results[:2]] == [8, 40]
+    assert report.cache.hits > 0  # photos decoded once for the whole batch
+    build_mosaic(
+        "sqlite:///mosaic.db", tmp_path / "index.pkl", tmp_path / "target.png", tmp_path / "single.png", 12, 12
+    )
+    np.testing.assert_array_equal(
+        np.asarray(Image.open(tmp_path / "jobs" / "b.png")), np.asarray(Image.open(tmp_path / "single.png"))
+    )
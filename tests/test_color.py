@@ -0,0 +1,19 @@
+import numpy as np
+from skimage.color import rgb2lab
+
+from mosaic_builder.color import LAB_MAX_ERROR, lab_to_srgb, srgb_to_lab
+
+
+def test_srgb_to_lab_within_error_bound_of_skimage_and_round_trips():
+    g = np.arange(0, 256, 3, dtype=np.uint8)
+    cube = np.stack(np.meshgrid(g, g, g, indexing="ij"), axis=-1).reshape(-1, 3)
+    grays = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+    rgb = np.concatenate([cube, grays])
+
+    lab = srgb_to_lab(rgb)
+    assert lab.dtype == np.float32 and lab.shape == rgb.shape
+    reference = rgb2lab(rgb.reshape(-1, 1, 3) / 255.0).reshape(-1, 3)
+    assert np.abs(lab - reference).max() <= LAB_MAX_ERROR
+    np.testing.assert_array_equal(lab_to_srgb(lab), rgb)
+    # chunking and leading dimensions do not change the result
+    np.testing.assert_array_equal(srgb_to_lab(rgb.reshape(-1, 4, 3)).reshape(-1, 3), lab)
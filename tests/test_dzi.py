@@ -0,0 +1,42 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.pipeline.dzi import DeepZoomWriter
+
+
+def _reference_levels(full: np.ndarray) -> list[np.ndarray]:
+    """Whole-image pyramid: 2x2 box means with edge rows/columns repeated, finest level last."""
+    levels = [full]
+    while max(levels[-1].shape[:2]) > 1:
+        a = levels[-1].astype(np.uint16)
+        if a.shape[0] % 2:
+            a = np.concatenate([a, a[-1:]], axis=0)
+        if a.shape[1] % 2:
+            a = np.concatenate([a, a[:, -1:]], axis=1)
+        levels.append(((a[0::2, 0::2] + a[1::2, 0::2] + a[0::2, 1::2] + a[1::2, 1::2] + 2) // 4).astype(np.uint8))
+    return levels[::-1]
+
+
+def test_streamed_pyramid_matches_whole_image_pyramid(tmp_path):
+    full = np.random.default_rng(0).integers(0, 256, size=(301, 517, 3), dtype=np.uint8)
+    with DeepZoomWriter(tmp_path / "m.dzi", 517, 301, tile_size=64, overlap=1, fmt="png", threads=2) as dzi:
+        y = 0
+        for n in [7, 50, 1, 64, 100, 79]:  # uneven bands, as a renderer would produce
+            dzi.write_rows(full[y : y + n])
+            y += n
+
+    levels = _reference_levels(full)
+    assert dzi.max_level == len(levels) - 1 == math.ceil(math.log2(517))
+    assert 'TileSize="64" Overlap="1" Format="png"' in (tmp_path / "m.dzi").read_text()
+    written = 0
+    for level, ref in enumerate(levels):
+        h, w = ref.shape[:2]
+        for row in range(math.ceil(h / 64)):
+            for col in range(math.ceil(w / 64)):
+                tile = np.asarray(Image.open(tmp_path / "m_files" / str(level) / f"{col}_{row}.png"))
+                top, left = max(0, row * 64 - 1), max(0, col * 64 - 1)
+                np.testing.assert_array_equal(tile, ref[top : (row + 1) * 64 + 1, left : (col + 1) * 64 + 1])
+                written += 1
+    assert dzi.tiles_written == written
@@ -1,6 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+import pytest
 
 from mosaic_builder.index.factory import make_index
+from mosaic_builder.index.fallback import ExactFallbackIndex, with_exact_fallback
 
 
 def _toy(n=200, d=8):
@@ -19,3 +23,144 @@ def test_bruteforce_kdtree_api():
         assert res.indices.shape == (3,)
         assert res.distances.shape == (3,)
         assert np.isfinite(res.distances).all()
+
+
+def test_backends_handle_layout_descriptors(tmp_path):
+    # 3x3 layout descriptors are 27-D
+    X, q = _toy(n=400, d=27)
+    # small IVF/PQ so faiss trains quickly; PQ64 must be fitted down to a divisor of 27
+    params = {"faiss": {"factory": "IVF4,PQ64x4"}}
+    for backend in ("bruteforce", "kdtree", "hnsw", "faiss"):
+        try:
+            idx = make_index(backend, **params.get(backend, {}))
+            idx.build(X)
+        except RuntimeError:
+            continue  # optional backend not installed
+        res = idx.query(q, k=1)
+        assert int(res.indices[0]) == 5
+        path = str(tmp_path / f"{backend}.idx")
+        idx.save(path)
+        loaded = make_index(backend, **params.get(backend, {}))
+        loaded.load(path)
+        assert int(loaded.query(q, k=1).indices[0]) == 5
+
+
+def test_native_batch_query_matches_per_vector_query():
+    X, _ = _toy(n=500, d=12)
+    Q = np.random.default_rng(1).normal(size=(300, 12)).astype(np.float32)
+    params = {"faiss": {"factory": "Flat"}, "bruteforce": {"block_rows": 64}}
+    for backend in ("bruteforce", "kdtree", "hnsw", "faiss"):
+        try:
+            idx = make_index(backend, **params.get(backend, {}))
+            idx.build(X)
+        except RuntimeError:
+            continue  # optional backend not installed
+        indices, distances = idx.batch_query(Q, k=4)
+        assert indices.shape == distances.shape == (300, 4)
+        for i in range(0, 300, 37):
+            res = idx.query(Q[i], k=4)
+            np.testing.assert_array_equal(indices[i], res.indices)
+            np.testing.assert_allclose(distances[i], res.distances, rtol=1e-4, atol=1e-4)
+
+
+def test_lab_lut_matches_within_its_error_bound_of_exact_search(tmp_path):
+    rng = np.random.default_rng(2)
+    X = rng.uniform([0, -80, -100], [100, 90, 90], size=(300, 3)).astype(np.float32)
+    Q = rng.uniform([0, -80, -100], [100, 90, 90], size=(2000, 3)).astype(np.float32)
+    lut = make_index("lut", step=2.0, top_k=2, check_samples=5000)
+    lut.build(X)
+    assert 0.0 <= lut.measured_error <= lut.error_bound == pytest.approx(2.0 * np.sqrt(3))
+    exact = make_index("kdtree")
+    exact.build(X)
+    ref_idx, ref_dist = exact.batch_query(Q, k=5)
+
+    path = str(tmp_path / "lut.npy")
+    lut.save(path)
+    loaded = make_index("lut")
+    loaded.load(path)
+    loaded.vectors = X
+    assert isinstance(loaded.table, np.memmap) and loaded.step == 2.0
+    for index in (lut, loaded):
+        idx, dist = index.batch_query(Q, k=2)
+        np.testing.assert_allclose(dist, np.linalg.norm(X[idx] - Q[:, None], axis=2), rtol=1e-5, atol=1e-5)
+        assert (dist - ref_dist[:, :2] <= lut.error_bound + 1e-4).all()
+        # more candidates than the table stores fall back to exact search
+        np.testing.assert_array_equal(index.batch_query(Q, k=5)[0], ref_idx)
+
+    with pytest.raises(ValueError, match="3-D"):
+        make_index("lut").build(rng.normal(size=(10, 12)).astype(np.float32))
+
+
+def test_padded_results_are_answered_by_exact_search():
+    X, _ = _toy(n=60, d=3)
+    Q = np.random.default_rng(3).normal(size=(40, 3)).astype(np.float32)
+    exact = make_index("bruteforce")
+    exact.build(X)
+    # one IVF list probed out of 8 holds fewer than 20 tiles; a sparse HNSW graph does not reach all 60
+    cases = {
+        "faiss": ({"factory": "IVF8,Flat", "nprobe": 1}, 20),
+        "hnsw": ({"M": 2, "ef_construction": 4, "ef_search": 1}, 60),
+    }
+    for backend, (params, k) in cases.items():
+        try:
+            index = make_index(backend, **params)
+            index.build(X)
+        except RuntimeError:
+            continue  # optional backend not installed
+        short = (index.batch_query(Q, k=k)[0] < 0).any(axis=1)
+        assert short.any()
+        wrapped = with_exact_fallback(index, X)
+        assert isinstance(wrapped, ExactFallbackIndex)
+        idx, _ = wrapped.batch_query(Q, k=k)
+        assert (idx >= 0).all() and wrapped.refilled == short.sum()
+        np.testing.assert_array_equal(idx[short], exact.batch_query(Q[short], k=k)[0])
+    assert with_exact_fallback(exact, X) is exact
+
+
+def test_hnsw_pads_only_the_queries_it_cannot_answer():
+    X, _ = _toy(n=300, d=3)
+    Q = np.random.default_rng(5).normal(size=(64, 3)).astype(np.float32)
+    try:
+        index = make_index("hnsw")
+        index.build(X)
+    except RuntimeError:
+        pytest.skip("hnswlib not installed")
+    expected = index.batch_query(Q, k=5)[0]
+    failing = np.zeros(len(Q), dtype=bool)
+    failing[[3, 40, 41]] = True
+
+    class FailSomeRows:  # hnswlib raises for a whole batch when any of its rows is short
+        def __init__(self, inner):
+            self.inner, self.calls = inner, 0
+
+        def __getattr__(self, name):
+            return getattr(self.inner, name)
+
+        def knn_query(self, vecs, k, num_threads=-1):
+            self.calls += 1
+            if (np.abs(vecs[:, None] - Q[failing]).sum(axis=2) == 0).any():
+                raise RuntimeError("Cannot return the results in a contiguous 2D array")
+            return self.inner.knn_query(vecs, k=k, num_threads=num_threads)
+
+    index.index = proxy = FailSomeRows(index.index)
+    idx, dist = index.batch_query(Q, k=5)
+    assert ((idx < 0).all(axis=1) == failing).all() and np.isinf(dist[failing]).all()
+    np.testing.assert_array_equal(idx[~failing], expected[~failing])
+    assert proxy.calls < len(Q)  # bisected, not retried row by row
+
+
+def test_hnsw_queries_with_different_k_from_many_threads():
+    # with ef_search=1 a k=1 search is far from exact, so one run at another thread's ef shows up
+    X, _ = _toy(n=4000, d=32)
+    Q = np.random.default_rng(4).normal(size=(200, 32)).astype(np.float32)
+    try:
+        index = make_index("hnsw", M=4, ef_search=1)
+        index.build(X)
+    except RuntimeError:
+        pytest.skip("hnswlib not installed")
+    ks = [1, 200] * 60
+    expected = {k: index.batch_query(Q, k=k)[0] for k in set(ks)}
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda k: index.batch_query(Q, k=k)[0], ks))
+    for k, idx in zip(ks, results):
+        np.testing.assert_array_equal(idx, expected[k])
@@ -0,0 +1,186 @@
+import multiprocessing
+
+import joblib
+import numpy as np
+import pytest
+from PIL import Image
+from scipy.spatial import cKDTree
+
+from mosaic_builder.index import build_index as build_index_module
+from mosaic_builder.index.base import SearchIndex, VectorIndex
+from mosaic_builder.index.bruteforce import BruteForceIndex
+from mosaic_builder.index.build_index import build_index, build_kdtree, compact_index, update_index
+from mosaic_builder.index.fallback import ExactFallbackIndex
+from mosaic_builder.index.index_file import open_index
+from mosaic_builder.pipeline.build_mosaic import MosaicSession
+from mosaic_builder.pipeline.ingest import ingest_dir
+
+
+def _library(tmp_path):
+    rng = np.random.default_rng(0)
+    (tmp_path / "g").mkdir()
+    for i in range(2):
+        Image.fromarray(rng.integers(0, 256, size=(48, 96, 3), dtype=np.uint8)).save(tmp_path / "g" / f"p{i}.png")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_w=12, tile_h=12, tile_sizes=[(12, 12), (24, 24)])
+
+
+def _fail_on_shard_1(work, spec, plan, build_shard=build_index_module._build_shard):
+    if spec["name"] == "shard-0001":
+        raise RuntimeError("interrupted")
+    return build_shard(work, spec, plan)
+
+
+def test_index_directory_is_memory_mapped_filtered_and_reads_legacy_bundles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _library(tmp_path)
+
+    build_kdtree("sqlite:///mosaic.db", tmp_path / "all.index")
+    full = open_index(tmp_path / "all.index")
+    assert isinstance(full.vecs, np.memmap) and isinstance(full.ids, np.memmap)
+    assert full.header.count == len(full.ids) == 2 * (32 + 8)
+    snapshot = full.header.store_snapshot
+    assert (snapshot["tile_count"], snapshot["max_tile_id"]) == (80, int(full.ids.max()))
+    idx, _ = full.load_backend().batch_query(np.asarray(full.vecs[:5]), k=1)
+    np.testing.assert_array_equal(idx[:, 0], np.arange(5))
+
+    build_kdtree("sqlite:///mosaic.db", tmp_path / "small.index", tile_sizes=[(12, 12)])
+    small = open_index(tmp_path / "small.index")
+    assert small.header.tile_filter == [[12, 12]] and len(small.ids) == 64
+    assert (np.asarray(small.tile_sizes) == 12).all()
+
+    # an older SciPy's pickle is not trusted: the tree is rebuilt from the vectors
+    header = (tmp_path / "small.index" / "header.json").read_text().replace(small.header.payload["version"], "0.0")
+    (tmp_path / "small.index" / "header.json").write_text(header)
+    rebuilt = open_index(tmp_path / "small.index").load_backend()
+    np.testing.assert_array_equal(rebuilt.batch_query(np.asarray(small.vecs), k=1)[0][:, 0], np.arange(64))
+
+    ids, vecs = np.asarray(full.ids), np.asarray(full.vecs)
+    joblib.dump({"ids": ids, "vecs": vecs, "tree": cKDTree(vecs), "layout_k": 1}, tmp_path / "legacy.joblib")
+    legacy = open_index(tmp_path / "legacy.joblib")
+    assert legacy.header.version == 0 and legacy.tile_sizes is None
+    np.testing.assert_array_equal(legacy.ids, ids)
+
+
+def test_every_backend_round_trips_through_the_index_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _library(tmp_path)
+    params = {"faiss": {"factory": "IVF2,Flat", "nprobe": 2}, "hnsw": {"M": 8, "ef_search": 80}}
+    for backend in ("kdtree", "bruteforce", "faiss", "hnsw"):
+        path = tmp_path / f"{backend}.index"
+        try:
+            build_index("sqlite:///mosaic.db", path, backend=backend, backend_params=params.get(backend))
+        except RuntimeError:
+            continue  # optional backend not installed
+        opened = open_index(path)
+        assert (opened.header.backend, opened.header.params) == (backend, params.get(backend, {}))
+        index = opened.load_backend()
+        # faiss and hnswlib pad short results with -1: they are searched with an exact fallback
+        assert isinstance(index, ExactFallbackIndex) == (backend in ("faiss", "hnsw"))
+        idx, _ = index.batch_query(np.asarray(opened.vecs), k=1)
+        np.testing.assert_array_equal(idx[:, 0], np.arange(len(opened.ids)))
+
+
+def test_incremental_update_adds_deltas_tombstones_reingested_tiles_and_compacts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _library(tmp_path)
+    build_index("sqlite:///mosaic.db", tmp_path / "inc.index")
+    rng = np.random.default_rng(1)
+    Image.fromarray(rng.integers(0, 256, size=(48, 96, 3), dtype=np.uint8)).save(tmp_path / "g" / "p2.png")
+    Image.fromarray(rng.integers(0, 256, size=(48, 96, 3), dtype=np.uint8)).save(tmp_path / "g" / "p0.png")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_sizes=[(12, 12), (24, 24)], reingest=True)
+    update_index("sqlite:///mosaic.db", tmp_path / "inc.index", max_delta_fraction=10)
+
+    inc = open_index(tmp_path / "inc.index")
+    assert inc.header.segments == ["delta-0001"] and len(inc.dead) > 0
+    build_index("sqlite:///mosaic.db", tmp_path / "fresh.index")
+    fresh = open_index(tmp_path / "fresh.index")
+    live_ids = np.asarray(inc.all_ids)[inc.live_mask]
+    assert sorted(live_ids.tolist()) == sorted(np.asarray(fresh.ids).tolist())
+
+    queries = np.random.default_rng(2).uniform([0, -60, -60], [100, 60, 60], size=(200, 3)).astype(np.float32)
+    segmented = inc.load_backend()
+    assert isinstance(segmented, SearchIndex) and not isinstance(segmented, VectorIndex)  # query-only
+    idx, dist = segmented.batch_query(queries, k=3)
+    ref_idx, ref_dist = fresh.load_backend().batch_query(queries, k=3)
+    np.testing.assert_array_equal(inc.all_ids[idx], np.asarray(fresh.ids)[ref_idx])
+    np.testing.assert_allclose(dist, ref_dist, rtol=1e-5)
+
+    compact_index(tmp_path / "inc.index")
+    compacted = open_index(tmp_path / "inc.index")
+    assert compacted.header.segments == [] and len(compacted.dead) == 0
+    assert sorted(np.asarray(compacted.ids).tolist()) == sorted(live_ids.tolist())
+
+
+def test_padding_backend_segments_are_searched_with_an_exact_fallback(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _library(tmp_path)
+    try:
+        # one IVF list of 8 is probed: a main-segment search holds fewer than k tiles and pads with -1
+        params = {"factory": "IVF8,Flat", "nprobe": 1}
+        build_index("sqlite:///mosaic.db", tmp_path / "ivf.index", backend="faiss", backend_params=params)
+    except RuntimeError:
+        pytest.skip("faiss not installed")
+    Image.fromarray(np.random.default_rng(1).integers(0, 256, size=(48, 96, 3), dtype=np.uint8)).save(
+        tmp_path / "g" / "p0.png"
+    )
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_sizes=[(12, 12), (24, 24)])  # p0 changed: re-tiled
+    update_index("sqlite:///mosaic.db", tmp_path / "ivf.index", max_delta_fraction=10)
+
+    inc = open_index(tmp_path / "ivf.index")
+    assert inc.header.segments == ["delta-0001"] and 0 < len(inc.dead) < len(inc.vecs)
+    segmented = inc.load_backend()
+    main = segmented.segments[0]
+    assert isinstance(main, ExactFallbackIndex) and not isinstance(segmented.segments[1], ExactFallbackIndex)
+
+    queries = np.random.default_rng(2).uniform([0, -60, -60], [100, 60, 60], size=(50, 3)).astype(np.float32)
+    idx, _ = segmented.batch_query(queries, k=20)
+    assert main.refilled > 0
+    live = np.flatnonzero(inc.live_mask)
+    exact = BruteForceIndex()
+    exact.build(np.asarray(inc.all_vecs)[live])
+    np.testing.assert_array_equal(idx, live[exact.batch_query(queries, k=20)[0]])
+
+
+def test_sharded_index_matches_a_single_index_and_resumes_interrupted_builds(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    _library(tmp_path)
+    build_index("sqlite:///mosaic.db", tmp_path / "single.index")
+    single = open_index(tmp_path / "single.index")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(build_index_module, "_build_shard", _fail_on_shard_1)
+        with pytest.raises(RuntimeError, match="interrupted"):
+            build_index("sqlite:///mosaic.db", tmp_path / "sharded.index", shard_by="size", shard_rows=30, jobs=2)
+    assert not (tmp_path / "sharded.index").exists()
+    capsys.readouterr()
+    build_index("sqlite:///mosaic.db", tmp_path / "sharded.index", shard_by="size", shard_rows=30, jobs=2)
+    out = capsys.readouterr().out
+    assert "Resuming sharded build" in out and "into 4 shards; 1 to build" in out  # only the failed shard
+
+    sharded = open_index(tmp_path / "sharded.index")
+    assert sharded.header.count == len(sharded.ids) == 80 and len(sharded.shards) == 4
+    assert [s.header.tile_filter for s in sharded.shards] == [[[12, 12]]] * 3 + [[[24, 24]]]
+    assert sorted(np.asarray(sharded.ids).tolist()) == sorted(np.asarray(single.ids).tolist())
+
+    queries = np.random.default_rng(2).uniform([0, -60, -60], [100, 60, 60], size=(200, 3)).astype(np.float32)
+    exact = BruteForceIndex()
+    exact.build(np.asarray(single.vecs))
+    ref_idx, ref_dist = exact.batch_query(queries, k=3)
+    results = {}
+    for processes in (1, 2):
+        index = sharded.load_backend(processes=processes)
+        assert not isinstance(index, VectorIndex) and len(index.pools) == (0 if processes == 1 else 2)
+        results[processes] = index.batch_query(queries, k=3)
+        index.close()
+    for idx, dist in results.values():
+        np.testing.assert_array_equal(sharded.ids[idx], np.asarray(single.ids)[ref_idx])
+        np.testing.assert_allclose(dist, ref_dist, rtol=1e-5, atol=1e-4)  # brute force expands |a - q|²
+    np.testing.assert_array_equal(results[1][0], results[2][0])
+    np.testing.assert_array_equal(results[1][1], results[2][1])
+    idx = results[2][0]
+
+    # a session owns the search processes and stops them on close
+    with MosaicSession("sqlite:///mosaic.db", tmp_path / "sharded.index", search_processes=2) as session:
+        assert len(session.index.pools) == 2 and len(multiprocessing.active_children()) == 2
+        np.testing.assert_array_equal(session.index.batch_query(queries, k=3)[0], idx)
+    assert multiprocessing.active_children() == []
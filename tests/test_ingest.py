@@ -0,0 +1,106 @@
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.pipeline.ingest import avg_lab_from_patch, ingest_dir, tile_photo
+from mosaic_builder.pipeline.tiling import (
+    image_to_lab,
+    lab_tile_means,
+    layout_means,
+    multi_tile_means,
+    multi_tile_vectors,
+)
+from mosaic_builder.stores.factory import open_store
+
+
+def _noise_image(w=101, h=77):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8))
+
+
+def test_lab_tile_means_matches_per_tile_average():
+    im = _noise_image()
+    tile_w, tile_h = 12, 10
+    means = lab_tile_means(image_to_lab(im), tile_w, tile_h)
+    assert means.shape == (7, 8, 3)
+    for y in range(7):
+        for x in range(8):
+            patch = im.crop((x * tile_w, y * tile_h, (x + 1) * tile_w, (y + 1) * tile_h))
+            np.testing.assert_allclose(means[y, x], avg_lab_from_patch(patch), atol=1e-3)
+
+
+def test_multi_tile_means_matches_single_size_grids():
+    lab = image_to_lab(_noise_image(w=203, h=150))
+    sizes = [(16, 16), (24, 24), (32, 32), (48, 48)]
+    grids = multi_tile_means(lab, sizes)
+    for tile_w, tile_h in sizes:
+        np.testing.assert_allclose(grids[(tile_w, tile_h)], lab_tile_means(lab, tile_w, tile_h), atol=1e-6)
+
+
+def test_ingest_skips_unchanged_and_retiles_changed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    gallery = tmp_path / "gallery"
+    gallery.mkdir()
+    for i in range(3):
+        _noise_image(w=96, h=48).save(gallery / f"p{i}.png")
+    store_url = "sqlite:///mosaic.db"
+
+    ingest_dir(store_url, gallery, 24, 24)
+    store = open_store(store_url)
+    first = store.photo_catalog()
+    store.close()
+    assert all(rec.tiled_grids == {(24, 24): 1} and rec.file_size for rec in first.values())
+
+    Image.new("RGB", (48, 48), "red").save(gallery / "p1.png")
+    ingest_dir(store_url, gallery, 24, 24)
+    store = open_store(store_url)
+    try:
+        ids, vecs = store.all_tile_vectors()
+        assert len(ids) == 2 * 8 + 4
+        assert store.photo_catalog()[str(gallery / "p0.png")] == first[str(gallery / "p0.png")]
+    finally:
+        store.close()
+
+
+def test_process_pool_ingest_stores_the_same_tiles_as_serial(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    gallery = tmp_path / "gallery"
+    gallery.mkdir()
+    rng = np.random.default_rng(1)
+    for i in range(5):
+        Image.fromarray(rng.integers(0, 256, size=(48, 96, 3), dtype=np.uint8)).save(gallery / f"p{i}.png")
+
+    def ingested(workers):
+        url = f"sqlite:///w{workers}.db"
+        ingest_dir(url, gallery, workers=workers, tile_sizes=[(12, 12), (24, 24)], layout_k=2, batch_photos=2)
+        store = open_store(url)
+        try:
+            ids, vecs = store.all_tile_vectors(layout_k=2)
+            infos = store.tile_patch_infos(ids)
+        finally:
+            store.close()
+        return {infos[int(t)]: v for t, v in zip(ids, vecs)}
+
+    serial, pooled = ingested(0), ingested(2)
+    assert len(serial) == 5 * (32 + 8)
+    assert pooled.keys() == serial.keys()
+    for key, vec in serial.items():
+        np.testing.assert_array_equal(pooled[key], vec)
+
+
+def test_reduced_decode_keeps_full_resolution_grid(tmp_path):
+    path = tmp_path / "smooth.jpg"
+    _noise_image(w=20, h=15).resize((800, 600), Image.Resampling.BILINEAR).save(path, quality=95)
+    full = tile_photo(path, [(32, 32)])
+    reduced = tile_photo(path, [(32, 32)], min_source_px=4)
+    assert reduced.decode_scale == 8
+    assert (reduced.width, reduced.height) == (full.width, full.height) == (800, 600)
+    assert reduced.grids[(32, 32)].shape == full.grids[(32, 32)].shape == (18, 25, 3)
+    np.testing.assert_allclose(reduced.grids[(32, 32)], full.grids[(32, 32)], atol=1.5)
+
+
+def test_layout_descriptors_average_to_tile_means():
+    lab = image_to_lab(_noise_image())
+    layouts = multi_tile_vectors(lab, [(12, 12)], layout_k=2)[(12, 12)]
+    assert layouts.shape == (6, 8, 12)
+    np.testing.assert_allclose(layout_means(layouts), lab_tile_means(lab, 12, 12), atol=1e-4)
+    np.testing.assert_allclose(layouts[0, 0, :3], lab[:6, :6].reshape(-1, 3).mean(axis=0), atol=1e-4)
@@ -0,0 +1,37 @@
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.index.build_index import build_kdtree
+from mosaic_builder.pipeline.build_mosaic import MosaicSession
+from mosaic_builder.pipeline.ingest import ingest_dir
+
+
+def test_progressive_previews_start_flat_and_end_at_full_render(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    (tmp_path / "g").mkdir()
+    for i in range(3):
+        Image.fromarray(rng.integers(0, 256, size=(48, 72, 3), dtype=np.uint8)).save(tmp_path / "g" / f"p{i}.png")
+    Image.fromarray(rng.integers(0, 256, size=(72, 96, 3), dtype=np.uint8)).save(tmp_path / "target.png")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_w=12, tile_h=12)
+    build_kdtree("sqlite:///mosaic.db", tmp_path / "index.pkl")
+
+    previews = []
+    with MosaicSession("sqlite:///mosaic.db", tmp_path / "index.pkl") as session:
+        session.build(tmp_path / "target.png", tmp_path / "full.png", 12, 12, quiet=True)
+        session.build(
+            tmp_path / "target.png",
+            tmp_path / "progressive.png",
+            12,
+            12,
+            quiet=True,
+            on_preview=lambda image, done, total: previews.append((np.asarray(image), done, total)),
+            preview_passes=3,
+        )
+
+    assert [(done, total) for _, done, total in previews] == [(0, 48), (16, 48), (32, 48), (48, 48)]
+    cells = previews[0][0].reshape(6, 12, 8, 12, 3)
+    assert (cells == cells[:, :1, :, :1]).all()  # first preview: one flat color per cell
+    full = np.asarray(Image.open(tmp_path / "full.png"))
+    np.testing.assert_array_equal(previews[-1][0], full)
+    np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / "progressive.png")), full)
@@ -0,0 +1,50 @@
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.index.bruteforce import BruteForceIndex
+from mosaic_builder.index.kdtree import KDTreeIndex
+from mosaic_builder.pipeline.quadtree import SizeIndexes, match_by_size, quadtree_cells
+
+
+def _half_flat_image():
+    arr = np.full((200, 300, 3), 120, dtype=np.uint8)
+    arr[:, 150:] = np.random.default_rng(0).integers(0, 256, size=(200, 150, 3), dtype=np.uint8)
+    return Image.fromarray(arr)
+
+
+def test_quadtree_splits_detail_and_tiles_the_output():
+    cells = quadtree_cells(_half_flat_image(), tile_px=12, levels=3, split_variance=40.0)
+    assert (cells.width, cells.height) == (288, 192)  # whole 48px cells only
+    covered = np.zeros((cells.height, cells.width), dtype=np.int32)
+    for x, y, w, h in cells.boxes:
+        covered[y : y + h, x : x + w] += 1
+    assert (covered == 1).all()
+
+    left = cells.boxes[:, 0] + cells.sizes <= 144
+    assert (cells.sizes[left] == 48).all()  # flat half keeps the largest cells
+    assert (cells.sizes[cells.boxes[:, 0] >= 192] == 12).all()  # noise splits to the finest
+    np.testing.assert_allclose(cells.means[left] - cells.means[left][0], 0, atol=0.5)
+
+
+def test_match_by_size_only_uses_tiles_of_the_cell_size():
+    cells = quadtree_cells(_half_flat_image(), tile_px=12, levels=3, split_variance=40.0)
+    rng = np.random.default_rng(1)
+    vecs = (rng.random((60, 3)) * [100, 60, 60] - [0, 30, 30]).astype(np.float32)
+    tile_sizes = np.repeat([[12, 12], [24, 24], [48, 48]], 20, axis=0).astype(np.int32)
+    full = KDTreeIndex()
+    full.build(vecs)
+    built = []
+
+    def make_index():
+        built.append(BruteForceIndex())
+        return built[-1]
+
+    size_indexes = SizeIndexes(vecs, tile_sizes, make_index=make_index)
+    chosen = match_by_size(cells, full, size_indexes)
+    np.testing.assert_array_equal(tile_sizes[chosen, 0], cells.sizes)
+    assert len(built) == len(np.unique(cells.sizes))
+    # later builds reuse the per-size indexes of the configured backend
+    np.testing.assert_array_equal(match_by_size(cells, full, size_indexes), chosen)
+    assert len(built) == len(np.unique(cells.sizes)) and size_indexes.get(12)[0] is built[0]
+    np.testing.assert_array_equal(match_by_size(cells, full), full.batch_query(cells.means)[0][:, 0])
+    assert SizeIndexes(vecs, None).get(12) is None
@@ -0,0 +1,77 @@
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.pipeline.ingest import ingest_dir
+from mosaic_builder.pipeline.png_stream import PngStripWriter
+from mosaic_builder.pipeline.render import ImageCache, PatchRenderer, band_rows_for_budget
+from mosaic_builder.stores.factory import open_store
+
+
+def _gallery(root, n=3):
+    root.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        Image.fromarray(rng.integers(0, 256, size=(48, 72, 3), dtype=np.uint8)).save(root / f"p{i}.png")
+
+
+def test_grouped_render_matches_per_cell_paste(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _gallery(tmp_path / "g")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_w=24, tile_h=24)
+    store = open_store("sqlite:///mosaic.db")
+    try:
+        ids, _ = store.all_tile_vectors()
+        cell_ids = np.random.default_rng(1).choice(ids, size=(5, 7))
+        infos = store.tile_patch_infos(cell_ids)
+        assert infos[int(cell_ids[0, 0])] == store.tile_patch_info(int(cell_ids[0, 0]))
+
+        expected = Image.new("RGB", (7 * 16, 5 * 16))
+        for (y, x), tile_id in np.ndenumerate(cell_ids):
+            path, gx, gy, tw, th = store.tile_patch_info(int(tile_id))
+            patch = Image.open(path).convert("RGB").crop((gx * tw, gy * th, (gx + 1) * tw, (gy + 1) * th))
+            expected.paste(patch.resize((16, 16), Image.Resampling.LANCZOS), (x * 16, y * 16))
+    finally:
+        store.close()
+
+    renderer = PatchRenderer(infos, 16, 16, cache=ImageCache())
+    out = np.empty((5 * 16, 7 * 16, 3), dtype=np.uint8)
+    renderer.render(cell_ids, out)
+    np.testing.assert_array_equal(out, np.asarray(expected))
+    threaded = np.empty_like(out)
+    PatchRenderer(infos, 16, 16, threads=3).render(cell_ids, threaded)
+    np.testing.assert_array_equal(threaded, out)
+    photos = len({info[0] for info in infos.values()})
+    assert renderer.cache.stats.misses == photos and renderer.cache.stats.hits == 0
+    renderer.render(cell_ids[:2], out[: 2 * 16])
+    assert renderer.cache.stats.hits > 0
+
+
+def test_image_cache_evicts_least_recently_used(tmp_path):
+    _gallery(tmp_path / "g")
+    cache = ImageCache(max_bytes=2 * 48 * 72 * 3)
+    for name in ("p0", "p1", "p0", "p2", "p0", "p1"):
+        cache.get(str(tmp_path / "g" / f"{name}.png"))
+    assert (cache.stats.hits, cache.stats.misses) == (2, 4)  # p1 was evicted by p2
+
+
+def test_streamed_bands_match_in_memory_render(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _gallery(tmp_path / "g")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_w=24, tile_h=24)
+    store = open_store("sqlite:///mosaic.db")
+    try:
+        ids, _ = store.all_tile_vectors()
+        cell_ids = np.random.default_rng(2).choice(ids, size=(7, 5))
+        infos = store.tile_patch_infos(cell_ids)
+    finally:
+        store.close()
+
+    renderer = PatchRenderer(infos, 12, 8)
+    full = np.empty((7 * 8, 5 * 12, 3), dtype=np.uint8)
+    renderer.render(cell_ids, full)
+    band_rows = band_rows_for_budget(5, 12, 8, budget_bytes=3 * 5 * 12 * 8 * 3)
+    assert band_rows == 3
+    with PngStripWriter(tmp_path / "out.png", 5 * 12, 7 * 8, chunk_bytes=64) as png:
+        for band in renderer.iter_bands(cell_ids, band_rows):
+            png.write_rows(band)
+    np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / "out.png")), full)
@@ -0,0 +1,76 @@
+import asyncio
+import io
+import json
+
+import numpy as np
+from PIL import Image
+
+from mosaic_builder.index.build_index import build_kdtree
+from mosaic_builder.pipeline.build_mosaic import MosaicSession
+from mosaic_builder.pipeline.ingest import ingest_dir
+from mosaic_builder.service import MosaicService
+
+
+async def _request(port: int, method: str, path: str, body: bytes = b"") -> tuple[int, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), payload
+
+
+def test_service_matches_renders_and_batches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    (tmp_path / "g").mkdir()
+    for i in range(3):
+        Image.fromarray(rng.integers(0, 256, size=(48, 72, 3), dtype=np.uint8)).save(tmp_path / "g" / f"p{i}.png")
+    ingest_dir("sqlite:///mosaic.db", tmp_path / "g", tile_w=24, tile_h=24)
+    build_kdtree("sqlite:///mosaic.db", tmp_path / "index.pkl")
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, size=(48, 96, 3), dtype=np.uint8)).save(buf, format="PNG")
+    target = buf.getvalue()
+
+    async def scenario():
+        with MosaicSession("sqlite:///mosaic.db", tmp_path / "index.pkl") as session:
+            service = MosaicService(session, workers=2, batch_window_ms=50)
+            server = await service.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                assert await _request(port, "GET", "/healthz") == (200, b"ok\n")
+                matches = await asyncio.gather(*(_request(port, "POST", "/match?tile_px=24", target) for _ in range(4)))
+                status, png = await _request(port, "POST", "/mosaic?tile_px=12", target)
+                bad = await _request(port, "POST", "/match", b"not an image")
+                missing = await _request(port, "GET", "/nope")
+                metrics = (await _request(port, "GET", "/metrics"))[1].decode()
+                rejected = [
+                    await _request(port, "POST", path, target)
+                    for path in (
+                        "/match?tile_px=0",
+                        "/match?tile_px=-4",
+                        "/match?tile_px=64",  # taller than the 48px target
+                        "/mosaic?tile_px=0",
+                        "/mosaic?tile_px=64",
+                        "/mosaic?max_uses=0",
+                        "/mosaic?adaptive_levels=2&max_uses=3",
+                    )
+                ]
+            finally:
+                server.close()
+                await server.wait_closed()
+                service.close()
+            return matches, status, png, bad, rejected, missing, metrics, service.batcher
+
+    matches, status, png, bad, rejected, missing, metrics, batcher = asyncio.run(scenario())
+    grids = [json.loads(body) for code, body in matches if code == 200]
+    assert len(grids) == 4 and all(g == grids[0] for g in grids)
+    assert (grids[0]["rows"], grids[0]["cols"]) == (2, 4) and len(grids[0]["tile_ids"]) == 8
+    assert batcher.requests == 4 and batcher.batches < 4  # concurrent matches shared a search
+    assert status == 200 and Image.open(io.BytesIO(png)).size == (96, 48)
+    assert bad[0] == 400 and missing[0] == 404
+    assert [code for code, _ in rejected] == [400] * len(rejected), rejected
+    assert b"smaller than one 64px tile" in rejected[2][1]
+    assert 'mosaic_request_seconds_count{endpoint="match"} 5' in metrics
+    assert 'mosaic_request_errors_total{endpoint="match"} 1' in metrics
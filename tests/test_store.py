@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from mosaic_builder.stores.factory import open_store
+
+ENGINES = ["sqlite:///mosaic.db", "duckdb:///mosaic.duckdb"]
+
+
+def _index_names(store) -> set[str]:
+    if store.engine == "sqlite":
+        return {r[0] for r in store.conn.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall()}
+    return {r[0] for r in store.conn.execute("SELECT index_name FROM duckdb_indexes()").fetchall()}
+
+
+@pytest.mark.parametrize("url", ENGINES)
+def test_bulk_load_buffers_and_rebuilds_indexes(tmp_path, monkeypatch, url):
+    monkeypatch.chdir(tmp_path)
+    store = open_store(url)
+    store.ensure_schema()
+    vectors = np.random.default_rng(0).random((3, 4, 3)).astype(np.float32)
+    try:
+        with store.bulk_load() as stats:
+            photo_id = store.upsert_photo(tmp_path / "p.jpg", 96, 72)
+            g1 = store.upsert_grid(photo_id, 24, 24, 4, 3)
+            g2 = store.upsert_grid(photo_id, 12, 12, 8, 6)
+            store.insert_tiles(g1, vectors)
+            store.insert_tiles(g2, vectors)
+            assert store.has_tiles_for_grid(g1)
+            store.delete_tiles_for_grid(g2)  # drops the buffered grid
+            assert not store.has_tiles_for_grid(g2)
+            # ids are read back on the connection holding the uncommitted tiles
+            ids_grid = store.tile_ids_for_grid(g1, 4, 3)
+            assert (ids_grid > 0).all() and len(np.unique(ids_grid)) == 12
+        assert stats.rows == 12 and stats.rows_per_sec > 0
+        assert store.upsert_photo(tmp_path / "p.jpg", 96, 72) == photo_id
+
+        ids, vecs = store.all_tile_vectors()
+        assert len(ids) == 12
+        np.testing.assert_allclose(np.sort(vecs, axis=0), np.sort(vectors.reshape(-1, 3), axis=0), atol=1e-6)
+        assert {"tiles_grid_id_idx", "tiles_grid_xy_unique"} <= _index_names(store)
+        np.testing.assert_array_equal(store.tile_ids_for_grid(g1, 4, 3), ids_grid)
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("url", ENGINES)
+def test_bulk_load_rolls_back_every_write_on_error(tmp_path, monkeypatch, url):
+    monkeypatch.chdir(tmp_path)
+    store = open_store(url)
+    store.ensure_schema()
+    vectors = np.random.default_rng(0).random((3, 4, 3)).astype(np.float32)
+    try:
+        with pytest.raises(RuntimeError, match="boom"):
+            with store.bulk_load():
+                photo_id = store.upsert_photo(tmp_path / "p.jpg", 96, 72)
+                grid_id = store.upsert_grid(photo_id, 24, 24, 4, 3)
+                store.insert_tiles(grid_id, vectors)
+                store.flush()  # committed: survives the rollback
+                other = store.upsert_photo(tmp_path / "q.jpg", 96, 72)
+                store.insert_tiles(store.upsert_grid(other, 24, 24, 4, 3), vectors)
+                store.tile_ids_for_grid(grid_id, 4, 3)
+                raise RuntimeError("boom")
+        assert set(store.photo_catalog()) == {str(tmp_path / "p.jpg")}
+        assert len(store.all_tile_vectors()[0]) == 12
+    finally:
+        store.close()
+
+
+def test_vector_export_is_columnar_on_both_engines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(1)
+    means, layouts = rng.random((3, 4, 3)).astype(np.float32), rng.random((2, 2, 12)).astype(np.float32)
+    for url in ENGINES:
+        store = open_store(url)
+        store.ensure_schema()
+        store.ensure_indexes()
+        try:
+            photo_id = store.upsert_photo(tmp_path / "p.jpg", 96, 72)
+            store.insert_tiles(store.upsert_grid(photo_id, 24, 24, 4, 3), means)
+            store.insert_tiles(store.upsert_grid(photo_id, 48, 48, 2, 2, layout_k=2), layouts)
+
+            ids, vecs = store.all_tile_vectors()
+            assert ids.dtype == np.int64 and vecs.dtype == np.float32 and vecs.flags.c_contiguous
+            assert vecs.shape == (16, 3) and len(np.unique(ids)) == 16
+
+            ids2, vecs2 = store.all_tile_vectors(layout_k=2)
+            order = np.argsort(ids2)
+            np.testing.assert_array_equal(vecs2[order], layouts.reshape(-1, 12))
+
+            chunks = list(store.iter_tile_vectors(chunk_rows=5))
+            assert [len(c[0]) for c in chunks] == [5, 5, 5, 1]
+            chunk_ids = np.concatenate([c[0] for c in chunks])
+            chunk_vecs = np.concatenate([c[1] for c in chunks])
+            np.testing.assert_array_equal(chunk_ids, ids)
+            np.testing.assert_array_equal(chunk_vecs, vecs)
+        finally:
+            store.close()